@@ -1,14 +1,264 @@
-import os
+""" Incremental backups of the upload folder.
+
+Run from the project root, f.e. daily:
+    python backup.py [backup] [--exclude-derived] [--workers 8]
+    python backup.py list
+    python backup.py restore <target> [--at "2024-06-11 18:00"] [--prefix raw/2024-06-11]
+    python backup.py prune --keep 30
+    python backup.py zip            (full zip archive, as before)
+
+Backups are stored in the `backups` folder of `server.config`:
+- `objects/<ab>/<sha256>`: content addressed chunks (CHUNK_SIZE) of all
+  files, compressed unless compressing does not pay. Chunks already stored by
+  an earlier backup (of any file) are never written again.
+- `snapshots/<time>.json`: manifest of one backup, the chunks (and size,
+  mtime) of every file. Written last, so only complete backups are listed.
+Files with the size and mtime of the previous snapshot are not even read
+(except for `metadata.sqlite`, which is always copied).
+Hashing and compression run in parallel (`--workers`).
+"""
+import argparse
+import hashlib
 import json
+import os
 import shutil
-from datetime import date
+import sqlite3
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from fnmatch import fnmatch
+from typing import Dict, List
 
 with open("server.config") as f:
     config = json.load(f)
     DATA_DIR = config["upload_folder"]
     BACKUP_LOCATION = config["backups"]
 
-today = date.today() 
-date_format = today.strftime("%Y_%b_%d_")
+CHUNK_SIZE = 4 << 20
+SNAPSHOT_FORMAT = "%Y-%m-%d_%H%M%S"
+# Transient files and caches of the app (recreated on demand): never backed up
+EXCLUDED = [
+    "cache/*", "jobs/*", "*/.thumbs/*", "*.tmp", "*.upload", "metadata.lock", "projects.stamp",
+    "catalog.stamp", "metadata.sqlite-wal", "metadata.sqlite-shm",
+]
+# Regenerated from the sweep-selections (json): excluded with --exclude-derived
+DERIVED = [
+    "analysis/*.png", "analysis/*.svg", "analysis/*.plot.json", "analysis/*manifest.json",
+    "projects/*.png", "projects/*.svg", "projects/*.plot.json", "projects/*stacked.bin",
+    "projects/*stacked.json",
+]
+# Compressed formats: compressing them again only costs time
+STORED_EXTS = (".png", ".jpg", ".npz", ".zip", ".gz")
+# First byte of every object
+_RAW, _ZLIB = b"r", b"z"
+
+
+def backup(args):
+    """ Backs up every file changed since the last snapshot (only chunks not
+    stored yet are written) and writes a new snapshot.
+    """
+    excluded = EXCLUDED + (DERIVED if args.exclude_derived else [])
+    previous = _load_snapshot(_snapshots()[-1])["files"] if _snapshots() else {}
+    paths = [p for p in _walk(DATA_DIR) if not any(fnmatch(p, e) for e in excluded)]
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp, ThreadPoolExecutor(args.workers) as pool:
+        def entry(path: str) -> Dict:
+            source = os.path.join(DATA_DIR, path)
+            stat = os.stat(source)
+            known = previous.get(path)
+            if path == "metadata.sqlite":
+                # Always copied (consistent, even if written meanwhile): in WAL
+                # mode changes are in the excluded `-wal` file until a
+                # checkpoint, size and mtime of the database do not change
+                source = _copy_database(source, os.path.join(tmp, path))
+            elif known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+                return known
+            return {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "chunks": _store_file(source, path.lower().endswith(STORED_EXTS)),
+            }
+        files = dict(zip(paths, pool.map(entry, paths)))
+    name = datetime.now().strftime(SNAPSHOT_FORMAT)
+    _dump(os.path.join(BACKUP_LOCATION, "snapshots", f"{name}.json"), {
+        "created": time.time(),
+        "exclude_derived": args.exclude_derived,
+        "files": files,
+    })
+    changed = sum(1 for path, e in files.items() if previous.get(path) is not e)
+    print(
+        f"Snapshot {name}: {len(files)} files ({changed} changed, "
+        f"{sum(e['size'] for e in files.values()) / (1 << 20):.1f} MiB) "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+
+
+def list_snapshots(args):
+    """ Lists all snapshots """
+    for name in _snapshots():
+        files = _load_snapshot(name)["files"]
+        size = sum(e["size"] for e in files.values()) / (1 << 20)
+        print(f"{name}: {len(files)} files, {size:.1f} MiB")
+
+
+def restore(args):
+    """ Restores the last snapshot taken at or before `--at` (default: the
+    latest) into `target` (only files below `--prefix`, if given).
+    """
+    names = _snapshots()
+    if args.at:
+        at = datetime.fromisoformat(args.at).strftime(SNAPSHOT_FORMAT)
+        names = [n for n in names if n <= at]
+    if not names:
+        raise SystemExit("No snapshot to restore!")
+    files = _load_snapshot(names[-1])["files"]
+    prefix = os.path.join(args.prefix, "") if args.prefix else ""
+    paths = [p for p in files if p.startswith(prefix) or p == args.prefix]
+
+    def restore_file(path: str) -> None:
+        target = os.path.join(args.target, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(f"{target}.tmp", "wb") as f:
+            for digest in files[path]["chunks"]:
+                f.write(_load_object(digest))
+        os.replace(f"{target}.tmp", target)
+        os.utime(target, ns=(files[path]["mtime_ns"], files[path]["mtime_ns"]))
+
+    with ThreadPoolExecutor(args.workers) as pool:
+        list(pool.map(restore_file, paths))
+    print(f"Restored {len(paths)} files of snapshot {names[-1]} to {args.target}")
+
+
+def prune(args):
+    """ Removes all but the latest `--keep` snapshots and every chunk no
+    remaining snapshot refers to.
+    """
+    names = _snapshots()
+    for name in names[:max(len(names) - args.keep, 0)]:
+        os.remove(os.path.join(BACKUP_LOCATION, "snapshots", f"{name}.json"))
+    referenced = {
+        digest for name in _snapshots()
+        for e in _load_snapshot(name)["files"].values() for digest in e["chunks"]
+    }
+    removed = 0
+    objects = os.path.join(BACKUP_LOCATION, "objects")
+    for root, _, filenames in os.walk(objects):
+        for filename in filenames:
+            if filename not in referenced:
+                os.remove(os.path.join(root, filename))
+                removed += 1
+    print(f"Removed {max(len(names) - args.keep, 0)} snapshots and {removed} chunks")
+
+
+def zip_archive(args):
+    """ Full zip archive of the upload folder """
+    date_format = date.today().strftime("%Y_%b_%d_")
+    shutil.make_archive(os.path.join(BACKUP_LOCATION, date_format), 'zip', DATA_DIR)
+
+
+def _walk(directory: str) -> List[str]:
+    """ Paths (relative to `directory`, with `/`) of all files """
+    paths = []
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.relpath(os.path.join(root, filename), directory)
+            paths.append(path.replace(os.sep, "/"))
+    return sorted(paths)
+
+
+def _store_file(path: str, stored: bool) -> List[str]:
+    """ Stores all chunks of a file not stored yet, returns their hashes """
+    digests = []
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest = hashlib.sha256(chunk).hexdigest()
+            object_path = _object_path(digest)
+            if not os.path.exists(object_path):
+                compressed = b"" if stored else zlib.compress(chunk, 6)
+                if stored or len(compressed) >= len(chunk):
+                    _write(object_path, _RAW + chunk)
+                else:
+                    _write(object_path, _ZLIB + compressed)
+            digests.append(digest)
+    return digests
+
+
+def _load_object(digest: str) -> bytes:
+    with open(_object_path(digest), "rb") as f:
+        data = f.read()
+    chunk = zlib.decompress(data[1:]) if data[:1] == _ZLIB else data[1:]
+    if hashlib.sha256(chunk).hexdigest() != digest:
+        raise ValueError(f"Corrupt backup chunk: {_object_path(digest)}")
+    return chunk
+
+
+def _object_path(digest: str) -> str:
+    return os.path.join(BACKUP_LOCATION, "objects", digest[:2], digest)
+
+
+def _copy_database(path: str, target: str) -> str:
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    source, copy = sqlite3.connect(path), sqlite3.connect(target)
+    with source, copy:
+        source.backup(copy)
+    source.close()
+    copy.close()
+    return target
+
+
+def _snapshots() -> List[str]:
+    directory = os.path.join(BACKUP_LOCATION, "snapshots")
+    if not os.path.isdir(directory):
+        return []
+    return sorted(f[:-len(".json")] for f in os.listdir(directory) if f.endswith(".json"))
+
+
+def _load_snapshot(name: str) -> Dict:
+    with open(os.path.join(BACKUP_LOCATION, "snapshots", f"{name}.json"), "r") as f:
+        return json.load(f)
+
+
+def _dump(path: str, data: Dict) -> None:
+    _write(path, json.dumps(data).encode())
+
+
+def _write(path: str, data: bytes) -> None:
+    # Written to temporary file and renamed: an interrupted backup never
+    # leaves a partial chunk or snapshot
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{id(data)}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
 
-shutil.make_archive(os.path.join(BACKUP_LOCATION, date_format), 'zip', DATA_DIR)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.set_defaults(func=backup, exclude_derived=False, workers=os.cpu_count())
+    commands = parser.add_subparsers(dest="command")
+    backup_parser = commands.add_parser("backup", help=backup.__doc__)
+    backup_parser.add_argument(
+        "--exclude-derived", action="store_true",
+        help="skip analysis plots (regenerated from the sweep-selections)"
+    )
+    backup_parser.add_argument("--workers", type=int, default=os.cpu_count())
+    backup_parser.set_defaults(func=backup)
+    list_parser = commands.add_parser("list", help=list_snapshots.__doc__)
+    list_parser.set_defaults(func=list_snapshots)
+    restore_parser = commands.add_parser("restore", help=restore.__doc__)
+    restore_parser.add_argument("target")
+    restore_parser.add_argument("--at", help="point in time, f.e. \"2024-06-11 18:00\"")
+    restore_parser.add_argument("--prefix", help="only files below, f.e. raw/2024-06-11")
+    restore_parser.add_argument("--workers", type=int, default=os.cpu_count())
+    restore_parser.set_defaults(func=restore)
+    prune_parser = commands.add_parser("prune", help=prune.__doc__)
+    prune_parser.add_argument("--keep", type=int, required=True)
+    prune_parser.set_defaults(func=prune)
+    zip_parser = commands.add_parser("zip", help=zip_archive.__doc__)
+    zip_parser.set_defaults(func=zip_archive)
+    args = parser.parse_args()
+    args.func(args)
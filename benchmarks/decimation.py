@@ -0,0 +1,64 @@
+""" Benchmark: plotting a long inrow trace with and without min/max decimation.
+
+Run from the project root:
+    python benchmarks/decimation.py [--sweeps 500] [--samples 10000]
+
+Builds a synthetic recording (noise + spikes) of `--sweeps` sweeps, plots all
+sweeps in a row (like AnalysisOpts.INROW) once with full resolution and once
+decimated, and reports render time and file size of the png and svg.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from render import _only_format, decimate_minmax  # noqa: E402
+from extractor.plotting import plot_data  # noqa: E402
+
+
+def synthetic_trace(num_sweeps: int, num_samples: int, seed: int = 0) -> list:
+    rng = np.random.default_rng(seed)
+    trace = -65 + rng.normal(0, 0.5, num_sweeps*num_samples)
+    # Add action-potential like spikes
+    spikes = rng.choice(len(trace), size=num_sweeps*3, replace=False)
+    for spike in spikes:
+        trace[spike:spike+20] += np.linspace(90, 0, len(trace[spike:spike+20]))
+    return trace.tolist()
+
+
+def render(path: str, values: list, total_time: float, fmt: str) -> float:
+    start = time.perf_counter()
+    with _only_format(fmt):
+        plot_data(path, values, total_time)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sweeps", type=int, default=500)
+    parser.add_argument("--samples", type=int, default=10000)
+    args = parser.parse_args()
+
+    values = synthetic_trace(args.sweeps, args.samples)
+    total_time = args.sweeps * args.samples * 0.0001 / 60
+    results = {"sweeps": args.sweeps, "samples": args.samples, "points": len(values)}
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        decimated = decimate_minmax(values)
+        results["decimation_s"] = time.perf_counter() - start
+        for name, data in (("full", values), ("decimated", decimated)):
+            path = os.path.join(tmp, name)
+            for fmt in ("png", "svg"):
+                results[f"{name}_{fmt}_s"] = render(path, data, total_time, fmt)
+                results[f"{name}_{fmt}_bytes"] = os.path.getsize(f"{path}.{fmt}")
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+""" Benchmark: peak memory of unpacking an igor binary wave.
+
+Run from the project root:
+    python benchmarks/ingest_memory.py [--sweeps 10 100 400] [--samples 50000]
+
+For every number of sweeps a synthetic wave is written and unpacked in a
+fresh process (so the peak RSS of one run is not hidden by another) with
+- `load`: `extract_data` + `convert_rows_to_columns` + `write_sweeps` (the
+  whole wave in memory, as before streaming),
+- `stream`: `ibwstream.ibw_to_sweeps`.
+Reports file size, time and peak RSS above the RSS after imports (MiB).
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def _peak_rss_mib() -> float:
+    # ru_maxrss is in KiB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(method: str, path: str, sweeps_path: str) -> None:
+    """ Runs a single unpacking (in the child process) """
+    import numpy  # noqa: F401
+    from extractor.preprocessing import convert_rows_to_columns, extract_data
+    from ibwstream import ibw_to_sweeps
+    from sweepstore import write_sweeps
+    baseline = _peak_rss_mib()
+    start = time.perf_counter()
+    if method == "load":
+        data = extract_data(path, False)
+        write_sweeps(sweeps_path, convert_rows_to_columns(data, len(data[0])))
+    else:
+        ibw_to_sweeps(path, sweeps_path)
+    print(json.dumps({
+        "time_s": time.perf_counter() - start,
+        "peak_rss_mib": _peak_rss_mib() - baseline,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sweeps", type=int, nargs="+", default=[10, 100, 400])
+    parser.add_argument("--samples", type=int, default=50000)
+    parser.add_argument("--methods", nargs="+", default=["load", "stream"])
+    parser.add_argument("--run", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        return run(*args.run)
+
+    from synthetic import write_ibw
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for num_sweeps in args.sweeps:
+            path = os.path.join(tmp, f"{num_sweeps}.ibw")
+            write_ibw(path, num_sweeps, args.samples)
+            result = {
+                "sweeps": num_sweeps,
+                "samples": args.samples,
+                "file_mib": os.path.getsize(path) / (1 << 20),
+                "sweep_mib": args.samples * 4 / (1 << 20),
+            }
+            for method in args.methods:
+                out = subprocess.run(
+                    [sys.executable, __file__, "--run", method, path, f"{path}.bin"],
+                    capture_output=True, text=True, check=True, cwd=ROOT
+                )
+                measured = json.loads(out.stdout.strip().splitlines()[-1])
+                result.update({f"{method}_{k}": v for k, v in measured.items()})
+                os.remove(f"{path}.bin")
+            results.append(result)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+""" Benchmark: peaks of the same windows for many analysis, per sweep vs batch.
+
+Run from the project root:
+    python benchmarks/peaks.py [--analysis 40] [--sweeps 10] [--samples 20000]
+
+Writes `--analysis` synthetic sweep-selections of `--sweeps` sweeps each,
+loads them for each path (`extractor_load_s`, `batch_load_s`) and compares
+the time of
+- `extractor`: `peaks(sweeps, peaks_info)` per analysis (the path of
+  `Service.calc_peaks`, without plotting),
+- `batch`: `peakbatch.batch_extrema` (all sweeps stacked, one reduction).
+The minima and maxima of both paths (as markers at their sample, like the
+`min`/`max` the extractor returns for plotting) must be equal.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import peakbatch  # noqa: E402
+from extractor.functions import Peaks, calc_time_from_sweeps  # noqa: E402
+from extractor.ibw import peaks  # noqa: E402
+
+
+def write_sources(directory: str, num_analysis: int, num_sweeps: int, num_samples: int):
+    rng = np.random.default_rng(0)
+    sources = []
+    for i in range(num_analysis):
+        sweeps = -65 + rng.normal(0, 0.5, (num_sweeps, num_samples))
+        sources.append(os.path.join(directory, f"{i}.json"))
+        with open(sources[-1], "w") as f:
+            json.dump(sweeps.tolist(), f)
+    return sources
+
+
+def markers(sweep: Dict, num_samples: int, sample_time: float, key: str) -> np.ndarray:
+    """ Batch extrema of one sweep as the extractor's per sample markers
+    (value at the sample of every extremum, nan elsewhere)
+    """
+    values = np.full(num_samples, np.nan)
+    for value, at in zip(sweep[key], sweep[f"{key}_time"]):
+        if value is not None:
+            values[int(round(at / sample_time))] = value
+    return values
+
+
+def equal(expected: Dict, batch: Dict, loaded: List) -> bool:
+    sweeps = iter(batch["sweeps"])
+    for data, (peak_data, _) in zip(loaded, expected):
+        sample_time = calc_time_from_sweeps(data) / len(data[0])
+        for index, sweep in enumerate(data):
+            result = next(sweeps)
+            for key in ("min", "max"):
+                reference = np.asarray(peak_data[str(index)][key], dtype=float)
+                values = markers(result, len(sweep), sample_time, key)
+                if not np.array_equal(reference, values, equal_nan=True):
+                    return False
+    return True
+
+
+def load_sources(sources: List[str]) -> List:
+    loaded = []
+    for source in sources:
+        with open(source, "r") as f:
+            loaded.append(json.load(f))
+    return loaded
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--analysis", type=int, default=40)
+    parser.add_argument("--sweeps", type=int, default=10)
+    parser.add_argument("--samples", type=int, default=20000)
+    parser.add_argument("--intervals", type=int, default=50)
+    args = parser.parse_args()
+
+    results = vars(args).copy()
+    with tempfile.TemporaryDirectory() as tmp:
+        sources = write_sources(tmp, args.analysis, args.sweeps, args.samples)
+        with open(sources[0], "r") as f:
+            total_time = calc_time_from_sweeps(json.load(f))
+        # Intervals of a tenth of the step, spread over the whole sweep
+        step = total_time / args.intervals
+        peaks_info = Peaks(
+            start=0, step=step, interval=step/10, num_intervals=args.intervals
+        )
+
+        loaded, results["extractor_load_s"] = timed(load_sources, sources)
+        rows, results["batch_load_s"] = timed(peakbatch.load_batch, sources)
+
+    def extractor_path():
+        return [peaks(sweeps, peaks_info) for sweeps in loaded]
+
+    expected, results["extractor_s"] = timed(extractor_path)
+    batch, results["batch_s"] = timed(peakbatch.batch_extrema, rows, peaks_info)
+    results["speedup"] = results["extractor_s"] / results["batch_s"]
+    print(json.dumps(results, indent=2))
+    if not equal(expected, batch, loaded):
+        raise SystemExit("Batch peaks differ from extractor.ibw.peaks!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+""" Benchmark: the service's ingest -> analyse -> render pipeline.
+
+Run from the project root:
+    python benchmarks/pipeline.py [--dates 2] [--files 3] [--sweeps 10] [--samples 20000]
+        [--tags 3] [--warmup 1] [--repeats 3] [--stages ...] [--output results.json]
+
+Writes `--dates` x `--files` synthetic igor binary waves of `--sweeps` x
+`--samples` into a temporary upload folder (every file tagged with `--tags`
+tags), unpacks them and times every stage (the service entry point used by
+the app) `--warmup` + `--repeats` times:
+- `unpack_raw`: unpacking one file,
+- `do_analysis_<opt>`: analysis of all sweeps of one file, per AnalysisOpts,
+- `calc_peaks`: peaks of the stacked analysis (not cached),
+- `project_stack_analysis`: stacking a project of all single-sweep analysis,
+- `get_raw`, `get_sweeps`, `get_analysis`: listings (catalog not built yet),
+- `get_searched`: search of one tag in raw data,
+- `get_single_analysis`: the analysis page of one file.
+Reports min/median/mean time and the peak of traced memory (tracemalloc, one
+extra run) per stage as json, together with parameters and commit, so runs
+of different commits can be compared. Runs offline.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import write_ibw  # noqa: E402
+
+# Relative to the temporary working directory (analysis paths of projects are
+# "data/analysis/<date>/<name>/<plot>.png", like in the app)
+UPLOAD_FOLDER = "data"
+STAGES = [
+    "unpack_raw", "do_analysis_all", "do_analysis_avrg", "do_analysis_inrow",
+    "do_analysis_stacked", "calc_peaks", "project_stack_analysis", "get_raw",
+    "get_sweeps", "get_analysis", "get_searched", "get_single_analysis",
+]
+
+
+def prepare(args) -> Dict:
+    """ Writes synthetic raw data and metadata into the upload folder
+    (current directory) and unpacks it. Returns names of the first file.
+    """
+    from extractor.ibw import VERSION
+    from service import Service
+    for name in ("raw", "sweeps", "analysis", "projects"):
+        os.makedirs(os.path.join(UPLOAD_FOLDER, name))
+    for name in ("peaks", "num_sweeps", "tags", "favorites"):
+        with open(os.path.join(UPLOAD_FOLDER, f"{name}.json"), "w") as f:
+            json.dump({}, f)
+    with open(os.path.join(UPLOAD_FOLDER, "all_tags.json"), "w") as f:
+        json.dump([], f)
+    service = Service(UPLOAD_FOLDER, plot_workers=args.plot_workers)
+    files = []
+    for d in range(args.dates):
+        date = f"2024-01-{d+1:02}"
+        os.makedirs(os.path.join(service.dir_raw, date))
+        for i in range(args.files):
+            filename = f"cell{i}.ibw"
+            write_ibw(
+                os.path.join(service.dir_raw, date, filename), args.sweeps, args.samples,
+                seed=d*args.files + i
+            )
+            for t in range(args.tags):
+                service.add_tag_to_entry(os.path.join(date, f"cell{i}"), f"tag{(i+t) % 10}")
+            service.unpack_raw(date, filename)
+            files.append((date, filename))
+    service.dmanager.flush()
+    date, filename = files[0]
+    return {
+        "service": service,
+        "date": date,
+        "raw": filename,
+        "sweeps": f"{VERSION}_{os.path.splitext(filename)[0]}_sweeps",
+    }
+
+
+def stages(ctx: Dict, args) -> Dict[str, Tuple[Callable, Callable | None]]:
+    """ Stage name -> (measured call, setup before every call or None) """
+    from dmanager.dmodels import AnalysisOpts
+    from extractor.functions import Peaks
+    service, date, sweeps = ctx["service"], ctx["date"], ctx["sweeps"]
+    analysis_dir = os.path.join(service.dir_analysis, date, sweeps)
+    stacked = os.path.join(analysis_dir, f"stacked-0-{args.sweeps}_{sweeps}.png")
+    single = [
+        os.path.join(analysis_dir, f"sweep-{i:02}_{sweeps}.png") for i in range(args.sweeps)
+    ]
+    total_time = service.sweeps_time(service.sweeps_reader(date, sweeps))
+    step = total_time / args.intervals
+    peaks_info = Peaks(start=0, step=step, interval=step/10, num_intervals=args.intervals)
+
+    def analysis(opt):
+        return lambda: service.do_analysis(
+            date, sweeps, opt, 0, args.sweeps, None, None
+        )
+
+    def unpack_setup():
+        os.remove(service.sweeps_path(date, sweeps))
+
+    def peaks_setup():
+        # Stages may be run alone: analysis is created, if missing
+        if not os.path.exists(stacked):
+            analysis(AnalysisOpts.STACKED)()
+        _, _, plugin_path = service.peaks_path(stacked, peaks_info)
+        shutil.rmtree(plugin_path, ignore_errors=True)
+
+    def project_setup():
+        if not os.path.exists(single[0]):
+            analysis(AnalysisOpts.ALL)()
+        if "bench" not in service.dmanager.projects:
+            service.dmanager.add_project("bench")
+            for path in single:
+                service.dmanager.projects["bench"].add(path)
+
+    def listing_setup(kind):
+        return lambda: service.catalog.entries.pop(kind, None)
+
+    return {
+        "unpack_raw": (lambda: service.unpack_raw(date, ctx["raw"]), unpack_setup),
+        "do_analysis_all": (analysis(AnalysisOpts.ALL), None),
+        "do_analysis_avrg": (analysis(AnalysisOpts.AVRG), None),
+        "do_analysis_inrow": (analysis(AnalysisOpts.INROW), None),
+        "do_analysis_stacked": (analysis(AnalysisOpts.STACKED), None),
+        "calc_peaks": (lambda: service.calc_peaks(stacked, peaks_info), peaks_setup),
+        "project_stack_analysis": (
+            lambda: service.project_stack_analysis("bench", None), project_setup
+        ),
+        "get_raw": (lambda: service.get_raw(), listing_setup("raw")),
+        "get_sweeps": (lambda: service.get_sweeps(), listing_setup("sweeps")),
+        "get_analysis": (lambda: service.get_analysis(), listing_setup("analysis")),
+        "get_searched": (lambda: service.get_searched("raw", "tag1"), None),
+        "get_single_analysis": (
+            lambda: service.get_single_analysis(date, sweeps, False), None
+        ),
+    }
+
+
+def measure(func: Callable, setup: Callable | None, warmup: int, repeats: int) -> Dict:
+    times = []
+    for index in range(warmup + repeats):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        result = func()
+        if index >= warmup:
+            times.append(time.perf_counter() - start)
+    # Separate run: tracing allocations slows the call down
+    if setup:
+        setup()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "min_s": min(times),
+        "median_s": statistics.median(times),
+        "mean_s": statistics.mean(times),
+        "peak_traced_mib": peak / (1 << 20),
+        "result": result if isinstance(result, (tuple, str)) else None,
+    }
+
+
+def _commit() -> str | None:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True, cwd=ROOT
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dates", type=int, default=2)
+    parser.add_argument("--files", type=int, default=3, help="files per date")
+    parser.add_argument("--sweeps", type=int, default=10)
+    parser.add_argument("--samples", type=int, default=20000)
+    parser.add_argument("--tags", type=int, default=3, help="tags per file")
+    parser.add_argument("--intervals", type=int, default=50, help="peaks intervals")
+    parser.add_argument("--plot-workers", type=int, default=1)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--output", help="json file (default: stdout)")
+    args = parser.parse_args()
+
+    results: Dict[str, object] = {
+        "commit": _commit(),
+        "python": sys.version.split()[0],
+        "params": {k: v for k, v in vars(args).items() if k != "output"},
+    }
+    cwd = os.getcwd()
+    stage_results: List[Dict] = []
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            start = time.perf_counter()
+            ctx = prepare(args)
+            results["prepare_s"] = time.perf_counter() - start
+            available = stages(ctx, args)
+            for name in args.stages:
+                func, setup = available[name]
+                stage_results.append(
+                    {"stage": name, **measure(func, setup, args.warmup, args.repeats)}
+                )
+        finally:
+            os.chdir(cwd)
+    results["stages"] = stage_results
+    # ru_maxrss is in KiB on linux
+    results["peak_rss_mib"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+""" Benchmark: server startup (importing the app) and first request.
+
+Run from the project root:
+    python benchmarks/startup.py [--projects 200] [--members 50] [--tags 5000]
+
+Writes a synthetic data folder (projects with `--members` analysis each and
+metadata with `--tags` tagged entries) and imports `app` in a fresh process
+(`--repeats` times, the median is reported) for every mode:
+- `lazy`: default, data and scientific libraries are loaded on first use,
+- `preload`: `ANALYZER_PRELOAD=1` (see gunicorn.conf.py), everything is
+  loaded at import (once in the master process).
+Reports the time to import the app, of the first request of `/` and of the
+first request of `/projects` and whether matplotlib was imported by then.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def run() -> None:
+    """ Starts the app (in the child process, cwd: data folder) """
+    sys.path.insert(0, os.path.join(ROOT, "src"))
+    start = time.perf_counter()
+    import app
+    imported = time.perf_counter()
+    client = app.app.test_client()
+    client.get("/")
+    first = time.perf_counter()
+    heavy = "matplotlib" in sys.modules
+    client.get("/projects")
+    projects = time.perf_counter()
+    print(json.dumps({
+        "import_s": imported - start,
+        "first_request_s": first - imported,
+        "projects_request_s": projects - first,
+        "matplotlib_at_first_request": heavy,
+    }))
+
+
+def write_data(directory: str, num_projects: int, num_members: int, num_tags: int) -> None:
+    data = os.path.join(directory, "data")
+    for name in ("raw", "sweeps", "analysis"):
+        os.makedirs(os.path.join(data, name))
+    for i in range(num_projects):
+        project = os.path.join(data, "projects", f"project-{i}")
+        os.makedirs(project)
+        with open(os.path.join(project, "project.json"), "w") as f:
+            json.dump([
+                f"data/analysis/2024-06-11/0-0-2_c{i}_sweeps/sweep-{j:02}_0-0-2_c{i}_sweeps.png"
+                for j in range(num_members)
+            ], f)
+    tags = {f"2024-06-11/c{i}": [f"tag{i % 100}", "soma"] for i in range(num_tags)}
+    metadata = {
+        "tags.json": tags,
+        "all_tags.json": sorted({t for entry in tags.values() for t in entry}),
+        "favorites.json": {},
+        "num_sweeps.json": {f"data/sweeps/2024-06-11/c{i}": 20 for i in range(num_tags)},
+        "peaks.json": {},
+    }
+    for filename, content in metadata.items():
+        with open(os.path.join(data, filename), "w") as f:
+            json.dump(content, f)
+    with open(os.path.join(ROOT, "server.config.example"), "r") as f:
+        config = json.load(f)
+    config["upload_folder"] = data
+    with open(os.path.join(directory, "server.config"), "w") as f:
+        json.dump(config, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--projects", type=int, default=200)
+    parser.add_argument("--members", type=int, default=50)
+    parser.add_argument("--tags", type=int, default=5000)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--run", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        return run()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        write_data(tmp, args.projects, args.members, args.tags)
+        for mode in ("lazy", "preload"):
+            env = dict(os.environ, ANALYZER_PRELOAD="1" if mode == "preload" else "0")
+            runs = []
+            for _ in range(args.repeats):
+                out = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--run"],
+                    capture_output=True, text=True, check=True, cwd=tmp, env=env
+                )
+                runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+            result = {"mode": mode, **vars(args)}
+            del result["run"]
+            for key in runs[0]:
+                values = [r[key] for r in runs]
+                result[key] = (
+                    statistics.median(values) if isinstance(values[0], float) else values[0]
+                )
+            results.append(result)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
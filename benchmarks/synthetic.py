@@ -0,0 +1,47 @@
+""" Synthetic recordings for benchmarks. """
+import struct
+
+import numpy as np
+
+
+def synthetic_sweep(num_samples: int, rng: np.random.Generator) -> np.ndarray:
+    """ Noise around a resting potential plus a few action-potential like
+    spikes
+    """
+    sweep = -65 + rng.normal(0, 0.5, num_samples)
+    for spike in rng.choice(num_samples, size=3, replace=False):
+        sweep[spike:spike+20] += np.linspace(90, 0, len(sweep[spike:spike+20]))
+    return sweep
+
+
+def write_ibw(
+    path: str,
+    num_sweeps: int,
+    num_samples: int,
+    interval: float = 1e-4,
+    dtype=np.float32,
+    seed: int = 0
+) -> None:
+    """ Writes a (samples x sweeps) igor binary wave (version 5) sweep by
+    sweep, so arbitrarily large files can be generated.
+    """
+    dtype = np.dtype(dtype).newbyteorder("<")
+    type_code = {np.dtype("<f4"): 2, np.dtype("<f8"): 4}[dtype]
+    data_size = num_sweeps * num_samples * dtype.itemsize
+    wave_header = bytearray(320)
+    struct.pack_into("<ih", wave_header, 12, num_sweeps * num_samples, type_code)
+    struct.pack_into("<h", wave_header, 26, 1)
+    wave_header[28:32] = b"wave"
+    struct.pack_into("<4i", wave_header, 68, num_samples, num_sweeps, 0, 0)
+    struct.pack_into("<4d", wave_header, 84, interval, 1, 1, 1)
+    bin_header = bytearray(64)
+    struct.pack_into("<h", bin_header, 0, 5)
+    struct.pack_into("<i", bin_header, 4, 320 + data_size)
+    # Checksum: all shorts of both headers sum up to zero
+    checksum = sum(struct.unpack("<192h", bytes(bin_header + wave_header)))
+    struct.pack_into("<H", bin_header, 2, (-checksum) & 0xffff)
+    rng = np.random.default_rng(seed)
+    with open(path, "wb") as f:
+        f.write(bytes(bin_header + wave_header))
+        for _ in range(num_sweeps):
+            synthetic_sweep(num_samples, rng).astype(dtype).tofile(f)
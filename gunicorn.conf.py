@@ -0,0 +1,24 @@
+""" gunicorn settings, run from the project root:
+    gunicorn -c gunicorn.conf.py
+
+The app is preloaded: metadata, projects, the catalog and the scientific
+libraries are loaded once in the master process and shared copy-on-write by
+all workers, so forking a worker takes no time.
+"""
+import os
+
+wsgi_app = "app:app"
+pythonpath = "src"
+bind = os.environ.get("ANALYZER_BIND", "127.0.0.1:8000")
+workers = int(os.environ.get("ANALYZER_WORKERS", 4))
+preload_app = True
+
+# Read by app.py when the app is imported (in the master, before forking)
+os.environ["ANALYZER_PRELOAD"] = "1"
+
+
+def post_fork(server, worker):
+    # Threads do not survive a fork: started in every worker (jobs of a
+    # previous run are only resumed by one of them)
+    import app
+    app.start_background()
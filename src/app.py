@@ -1,13 +1,19 @@
-import io
 import os
 import json
-import zipfile
-from typing import List, Tuple
+import time
+import unicodedata
+from typing import Tuple
 import urllib.parse
-from flask import Flask, flash, render_template, redirect, request, send_file, send_from_directory
-from dmanager.dmodels import AnalysisOpts
+from dataclasses import asdict
+from flask import Flask, Response, abort, before_render_template, flash, g, jsonify, render_template, redirect, request, send_from_directory, stream_with_context, template_rendered
+from werkzeug.security import safe_join
 from dmanager.models import Sweep
+import metrics
+from export import Member, stream_zip
+from jobs import JobQueue
+from render import remove_plot, render_svg
 from service import Service
+from thumbnails import thumbnail
 from utils import stem
 from extractor.functions import Peaks, Scalebar
 from dotenv import load_dotenv
@@ -15,11 +21,110 @@ from dotenv import load_dotenv
 with open("server.config") as f:
     config = json.load(f)
     UPLOAD_FOLDER = config["upload_folder"]
+    JOB_WORKERS = config.get("job_workers", 2)
+    SERVICE_OPTIONS = {
+        "plot_workers": config.get("plot_workers", 1),
+        "metadata_backend": config.get("metadata_backend", "json"),
+        "metadata_flush_delay": config.get("metadata_flush_delay", 1),
+        "cache_size": config.get("cache_size_mib", 256),
+        "cache_disk_size": config.get("cache_disk_mib", 1024),
+        "catalog_poll_interval": config.get("catalog_poll_interval", 10),
+    }
+
+# Images requested with their version (`?v=<mtime>`, see `image_url`) never
+# change, so browsers may keep them for a year
+IMAGE_MAX_AGE = 365*24*3600
 
 app = Flask(__name__)
 app.secret_key = b'_5#y2L"F4Q8z\n\xec]/'
 
-service = Service(UPLOAD_FOLDER)
+# Data (metadata, projects, catalog) and scientific libraries are loaded on
+# first use. Preloaded (see gunicorn.conf.py) everything is loaded once in the
+# master process instead and shared by the forked workers, which start their
+# background work (`start_background`) after the fork.
+PRELOAD = os.environ.get("ANALYZER_PRELOAD") == "1"
+
+service = Service(UPLOAD_FOLDER, **SERVICE_OPTIONS)
+jobs = JobQueue(UPLOAD_FOLDER, JOB_WORKERS, SERVICE_OPTIONS)
+jobs.listeners.append(lambda job: service.job_finished(job.kind, job.args))
+
+def start_background() -> None: 
+    """ Starts the catalog watcher. One process (see `JobQueue.lead`) also
+    resumes jobs of a previous run and hashes raw files uploaded before
+    content hashes were stored.
+    """
+    service.catalog.start_watcher()
+    if not jobs.lead(): 
+        return
+    resumed = jobs.recover()
+    if not any(jobs.get(job_id).kind == "raw_hashes" for job_id in resumed) \
+            and service.unhashed_raw_files(): 
+        jobs.submit("raw_hashes")
+
+if __name__ == "__mp_main__": 
+    # Job workers (see `jobs.MP_CONTEXT`) import the main module again
+    pass
+elif PRELOAD: 
+    service.warm()
+else: 
+    start_background()
+
+@app.teardown_request
+def flush_metadata(_): 
+    # Changes of a request (f.e. tagging many uploads) are written once
+    service.dmanager.flush()
+
+# Timing of requests (`Server-Timing` header and /api/metrics) and profiling
+# are only hooked in, if enabled (see metrics)
+if metrics.ENABLED: 
+    @app.before_request
+    def start_request_metrics(): 
+        g.request_start = time.perf_counter()
+        g.metrics_token = metrics.start_request()
+
+    @app.after_request
+    def end_request_metrics(response: Response) -> Response: 
+        if "metrics_token" not in g: 
+            return response
+        total = time.perf_counter() - g.request_start
+        spans = metrics.end_request(g.pop("metrics_token"))
+        endpoint = request.endpoint or "unknown"
+        metrics.observe(metrics.REQUEST_SECONDS, total, endpoint=endpoint)
+        metrics.count(metrics.REQUESTS_TOTAL, endpoint=endpoint, status=response.status_code)
+        response.headers["Server-Timing"] = metrics.server_timing(spans, total)
+        return response
+
+    @before_render_template.connect_via(app)
+    def start_template_metrics(sender, template, context, **extra): 
+        g.template_start = time.perf_counter()
+
+    @template_rendered.connect_via(app)
+    def end_template_metrics(sender, template, context, **extra): 
+        if "template_start" in g: 
+            metrics.record("template", time.perf_counter() - g.pop("template_start"))
+
+if metrics.PROFILE_DIR: 
+    @app.before_request
+    def start_profile(): 
+        g.profile = metrics.start_profile()
+
+    @app.teardown_request
+    def stop_profile(_): 
+        profile = g.pop("profile", None)
+        if profile is not None: 
+            metrics.stop_profile(profile, request.endpoint or "unknown")
+
+@app.template_global()
+def image_url(path: str, thumb: bool = False) -> str: 
+    """ Url of an image (f.e. "data/analysis/<date>/<name>/<plot>.png")
+    including its version, optionally of its thumbnail
+    """
+    params = {"thumb": 1} if thumb else {}
+    try: 
+        params["v"] = os.stat(path).st_mtime_ns
+    except OSError: 
+        pass
+    return f"/{urllib.parse.quote(path)}?{urllib.parse.urlencode(params)}"
 
 @app.route("/")
 def main(): 
@@ -30,7 +135,8 @@ def data_raw():
     return render_template(
         "data/raw.html", 
         data=service.get_raw(), 
-        all_tags=service.dmanager.all_tags
+        all_tags=service.dmanager.all_tags,
+        job=_running_job()
     )
 
 @app.route("/data/sweeps")
@@ -55,16 +161,21 @@ def analysis(date: str = "", file: str = ""):
             ysize=int(scaleysize) if scaleysize != "" else None,
             xsize=int(scalexsize) if scalexsize != "" else None,
         )
-        msg, msg_type = service.do_analysis(
+        job_id = jobs.submit(
+            "analysis",
             date=date, 
             filename=file, 
-            opt=AnalysisOpts(int(request.form.get("opt") or 1)),
+            opt=int(request.form.get("opt") or 1),
             start=int(request.form.get("sweep_range"))-1,
             end=int(request.form.get("sweep_range_to")),
             ylim=_get_ylim(request),
-            scalebar=scalebar_infos
+            scalebar=asdict(scalebar_infos),
+            decimate="full_resolution" not in request.form
         )
-        flash(msg, msg_type)
+        return redirect(f"/data/analysis/{date}/{file}?job={job_id}")
+    return _render_analysis(date, file)
+
+def _render_analysis(date: str, file: str): 
     sweep = Sweep(service.dmanager, date, file)
     only_favorites = request.args.get("only_favorites") == "True" or False
     return render_template(
@@ -80,8 +191,8 @@ def analysis(date: str = "", file: str = ""):
         ),
         num_sweeps=service.num_sweeps(date, file),
         favorites = service.dmanager.favorites,
-        projects=sorted(service.dmanager.projects.keys())
-
+        projects=sorted(service.dmanager.projects.keys()),
+        job=_running_job()
     )
 
 
@@ -95,10 +206,34 @@ def upload():
             file = request.files['igorFile']
             date = request.form.get("creationDate");
             tags = request.form.get("tags");
-            extract = "unpackIgorCheck" in request.form
-            msg, msg_type = service.upload_raw(file, date, extract, tags)
-            flash(msg, msg_type)
-    return render_template("upload/upload.html", all_tags=service.dmanager.all_tags)
+            status = service.upload_raw(file, date, tags)
+            flash(status.msg, status.msg_type)
+            # Sweeps are extracted by a job, if desired
+            if status.path is not None and "unpackIgorCheck" in request.form: 
+                job_id = jobs.submit(
+                    "unpack", date=date, filename=os.path.basename(status.path)
+                )
+                return redirect(f"/upload?job={job_id}")
+    return render_template(
+        "upload/upload.html", all_tags=service.dmanager.all_tags, job=_running_job()
+    )
+
+@app.route("/upload/bulk", methods=["POST"])
+def upload_bulk(): 
+    date = request.form.get("creationDate") or ""
+    tags = request.form.get("tags") or ""
+    report = service.upload_many(request.files.getlist("igorFiles"), date, tags)
+    if "unpackIgorCheck" in request.form: 
+        for status in report: 
+            if status.path is not None: 
+                status.job = jobs.submit(
+                    "unpack", date=date, filename=os.path.basename(status.path)
+                )
+    if request.accept_mimetypes.best == "application/json": 
+        return jsonify([asdict(status) for status in report])
+    return render_template(
+        "upload/upload.html", all_tags=service.dmanager.all_tags, report=report
+    )
 
 @app.route("/projects")
 def projects(): 
@@ -168,6 +303,16 @@ def remove_from_project():
         msg, code = (f"Project {project} not found!", 404)
     return msg, code
 
+@app.route("/api/projects/<path:project_name>/peaks", methods=["POST"])
+def project_peaks(project_name): 
+    msg, msg_type = service.project_peaks(project_name, _get_peaks_info(request))
+    return jsonify(msg=msg, msg_type=msg_type), (200 if msg_type != "danger" else 400)
+
+@app.route("/api/analysis/<date>/peaks", methods=["POST"])
+def date_peaks(date): 
+    msg, msg_type = service.date_peaks(date, _get_peaks_info(request))
+    return jsonify(msg=msg, msg_type=msg_type), (200 if msg_type != "danger" else 400)
+
 @app.route("/api/projects/stack", methods=["POST"])
 def stack_project_analysis(): 
     project_name = request.form.get("project_name") or ""
@@ -182,7 +327,7 @@ def del_stacked_project_analysis():
     project_name = request.form.get("project_name") or ""
     try:
         os.remove(f"{path}.png")
-        os.remove(f"{path}.svg")
+        remove_plot(path)
         flash("Successfully deleted project analysis.", "success")
     except Exception as e:
         flash(f"Failed: {repr(e)}.", "success")
@@ -193,7 +338,8 @@ def handle_raw():
     date = request.form.get('dir')
     file = request.form.get("file")
     if "unpack-raw-data" in request.form:
-        msg, msg_type = service.unpack_raw(date, file)
+        job_id = jobs.submit("unpack", date=date, filename=file)
+        return redirect(f"/data/raw?job={job_id}")
     elif "delete-raw-data" in request.form: 
         msg, msg_type = service.delete_data(service.dir_raw, date, file)
     else: 
@@ -208,7 +354,10 @@ def handle_sweeps():
     if "analyze-sweeps" in request.form:
         return redirect(f"/data/analysis/{date}/{stem(file)}")
     elif "delete-sweeps" in request.form: 
-        msg, msg_type = service.delete_data(service.dir_sweeps, date, f"{file}.json")
+        path = service.sweeps_path(date, file)
+        msg, msg_type = service.delete_data(
+            service.dir_sweeps, date, os.path.basename(path)
+        )
     else: 
         msg, msg_type = ("Unknown option", "danger")
     flash(msg, msg_type)
@@ -229,32 +378,16 @@ def handle_analysis():
 
 @app.route("/handle/analysis/peaks", methods=["POST"])
 def analyse_peaks(): 
-    peaks_info = Peaks(
-        start=float(request.form["peak_start"]), 
-        step=float(request.form["peak_step"]), 
-        interval=float(request.form["peak_interval"]), 
-        num_intervals=int(request.form["peak_num_intervals"])
-    )
+    peaks_info = _get_peaks_info(request)
     date = request.form.get("date")
     filename = request.form.get("filename")
-    _ = service.calc_peaks(request.form.get('path'), peaks_info)
-    sweep = Sweep(service.dmanager, date, filename)
-    only_favorites = request.args.get("only_favorites") == "True" or False
-    return render_template(
-        "analysis/analysis.html",
-        date=date, 
-        name=sweep.name,
-        filename=sweep.filename,
-        version=sweep.version,
-        tags=sweep.tags,
-        all_tags=service.dmanager.all_tags,
-        analysis=service.get_single_analysis(
-            date, filename, only_favorites=only_favorites
-        ),
-        num_sweeps=service.num_sweeps(date, filename),
-        favorites=service.dmanager.favorites,
-        projects=sorted(service.dmanager.projects.keys())
+    if service.cached_peaks(request.form.get('path'), peaks_info) is not None: 
+        flash("Peaks with these parameters already calculated.", "success")
+        return redirect(f"/data/analysis/{date}/{filename}")
+    job_id = jobs.submit(
+        "peaks", path=request.form.get('path'), peaks_info=asdict(peaks_info)
     )
+    return redirect(f"/data/analysis/{date}/{filename}?job={job_id}")
 
 
 @app.route("/delete/analysis", methods=["POST"])
@@ -265,8 +398,8 @@ def delete_analysis():
     print(request.form)
     try:
         os.remove(path)
-        os.remove(path.replace("png", "svg"))
         os.remove(path.replace("png", "json"))
+        remove_plot(stem(path))
         flash("Successfully deleted analysis.", "success")
     except Exception as e:
         flash(f"Failed: {repr(e)}.", "success")
@@ -294,7 +427,7 @@ def remove_tag():
 def serve_image_analysis(date, name, filename):
     # Specify the path to the directory where your images are stored
     image_directory = os.path.abspath(os.path.join(service.dir_analysis, date, name))
-    return send_from_directory(image_directory, filename)
+    return _send_image(image_directory, filename)
 
 @app.route('/data/analysis/<date>/<name>/<plug_dir>/<plugin>/<sweep>')
 def serve_image_plug(date, name, plug_dir, plugin, sweep):
@@ -302,7 +435,7 @@ def serve_image_plug(date, name, plug_dir, plugin, sweep):
     image_directory = os.path.abspath(
         os.path.join(service.dir_analysis, date, name, plug_dir, plugin)
     )
-    return send_from_directory(image_directory, sweep)
+    return _send_image(image_directory, sweep)
 
 @app.route('/data/projects/<path:project_analysis>')
 def serve_image_project(project_analysis: str):
@@ -310,7 +443,7 @@ def serve_image_project(project_analysis: str):
     absolute_path = os.path.abspath(
         os.path.join(service.dmanager.dir_projects, project_analysis)
     )
-    return send_from_directory(*os.path.split(absolute_path))
+    return _send_image(*os.path.split(absolute_path))
 
 @app.route('/api/favorites/add/<path:path>', methods=["POST"])
 def api_add_favorite(path: str):
@@ -324,6 +457,19 @@ def api_del_favorite(path: str):
     service.dmanager.del_favorite(path)
     return "", 200
 
+@app.route("/api/metrics")
+def api_metrics(): 
+    if not metrics.ENABLED: 
+        return "Metrics are disabled (set ANALYZER_METRICS=1)", 404
+    return Response(metrics.prometheus(), content_type="text/plain; version=0.0.4")
+
+@app.route("/api/jobs/<job_id>")
+def api_job(job_id: str): 
+    job = jobs.get(job_id)
+    if job is None: 
+        return f"Job {job_id} not found!", 404
+    return jsonify(asdict(job) | {"finished": job.finished})
+
 @app.route("/api/search/<location>/", defaults = {"tags":""})
 @app.route("/api/search/<location>/<tags>")
 def search(location: str, tags: str): 
@@ -332,8 +478,10 @@ def search(location: str, tags: str):
         "sweeps": service.get_sweeps, 
         "analysis": service.get_analysis
     }
+    if location not in get_data_funcs: 
+        abort(404)
     if len(tags) > 0: 
-        data = service.get_searched(get_data_funcs[location], tags)
+        data = service.get_searched(location, tags)
     else: 
         data = get_data_funcs[location]()
     return render_template(
@@ -343,49 +491,87 @@ def search(location: str, tags: str):
         collapsed=tags==""
     )
 
-@app.route("/api/create/minimal/<project_name>")
+@app.route("/api/create/minimal/<path:project_name>")
 def create_project_minimal(project_name: str): 
-# List of file paths to include in the zip archive
+    if project_name not in service.dmanager.projects: 
+        abort(404)
+    # Sweep-selections as json or (with `?format=npy`) as numpy arrays
+    npy = request.args.get("format") == "npy"
+    ext = ".npy" if npy else ".json"
     file_paths = [
         f"{stem(a)}.json" for a in service.dmanager.projects[project_name].analysis 
     ]
     files_with_name = { 
-        f"{a[14:24]}_{stem(a[a.rfind("/")+1:])}":a[a.rfind("/")+1:] for a in file_paths 
+        f"{a[14:24]}_{stem(a[a.rfind("/")+1:])}": f"{stem(a[a.rfind('/')+1:])}{ext}" 
+        for a in file_paths 
     }
-    file_paths.append("src/extractor/functions.py")
-    file_paths.append("src/templates/minimal/requirements.txt")
-    file_paths.append("src/templates/minimal/README.md")
     minimal_py = render_template('minimal/minimal.py', analysis=files_with_name)
-
-    # Create the zip archive
-    zip_buffer = create_zip_archive(file_paths, minimal_py)
-
-    # Send the zip file
-    return send_file(
-        zip_buffer, 
-        mimetype='application/zip', 
-        as_attachment=True, 
-        download_name=f"analyzer_project_{project_name}"
+    members = [
+        Member(f"{stem(a.split('/')[-1])}{ext}", path=a, npy=npy) for a in file_paths
+    ]
+    for file_path in [
+        "src/extractor/functions.py",
+        "src/templates/minimal/requirements.txt",
+        "src/templates/minimal/README.md",
+    ]: 
+        members.append(Member(file_path.split('/')[-1], path=file_path))
+    members.append(Member("run.py", data=minimal_py.encode()))
+
+    # Archive is sent while it is written
+    response = Response(stream_with_context(stream_zip(members)), mimetype='application/zip')
+    _set_download_name(response, f"analyzer_project_{project_name}".replace("/", "_"))
+    return response
+
+def _set_download_name(response: Response, download_name: str) -> None: 
+    """ Content-Disposition of an attachment, quoted like `send_file` does
+    (non-ascii names as `filename*`, RFC 5987)
+    """
+    try: 
+        download_name.encode("ascii")
+        names = {"filename": download_name}
+    except UnicodeEncodeError: 
+        simple = unicodedata.normalize("NFKD", download_name).encode("ascii", "ignore").decode("ascii")
+        quoted = urllib.parse.quote(download_name, safe="!#$&+^`|~")
+        names = {"filename": simple, "filename*": f"UTF-8''{quoted}"}
+    response.headers.set("Content-Disposition", "attachment", **names)
+
+def _send_image(directory: str, filename: str): 
+    # Svgs are only rendered on first request
+    if filename.endswith(".svg"): 
+        path = safe_join(directory, stem(filename))
+        if path is None or not render_svg(path): 
+            abort(404)
+    if "thumb" in request.args and filename.endswith(".png"): 
+        path = safe_join(directory, filename)
+        thumb = thumbnail(path) if path is not None else None
+        if thumb is None: 
+            abort(404)
+        directory = os.path.dirname(thumb)
+    # Unversioned requests are revalidated (ETag/Last-Modified, answered
+    # with 304 if unchanged)
+    max_age = IMAGE_MAX_AGE if "v" in request.args else None
+    return send_from_directory(directory, filename, max_age=max_age)
+
+def _running_job() -> str | None: 
+    """ Returns id of job given by `?job=<id>`, if it is still running. If
+    the job is finished, its result is flashed instead.
+    """
+    job = jobs.get(request.args.get("job") or "")
+    if job is None: 
+        return None
+    if job.finished: 
+        flash(job.msg, job.msg_type)
+        return None
+    return job.id
+
+def _get_peaks_info(req) -> Peaks: 
+    return Peaks(
+        start=float(req.form["peak_start"]), 
+        step=float(req.form["peak_step"]), 
+        interval=float(req.form["peak_interval"]), 
+        num_intervals=int(req.form["peak_num_intervals"])
     )
 
-def create_zip_archive(file_paths: List[str], minimal_py: str):
-    # Create a BytesIO object to hold the zip file in memory
-    zip_buffer = io.BytesIO()
-
-    # Create a zip file object
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        for file_path in file_paths:
-            # Add each file to the zip archive
-            zip_file.write(file_path, arcname=file_path.split('/')[-1])
-        # Add the rendered minimal.py file to the zip archive
-        zip_file.writestr('run.py', minimal_py)
-
-    # Ensure the buffer position is at the beginning
-    zip_buffer.seek(0)
-
-    return zip_buffer
-
-
 def _get_ylim(req) -> Tuple[float, float] | None: 
     try: 
         return (
@@ -0,0 +1,206 @@
+import os
+import re
+import threading
+import time
+from typing import Dict, List, OrderedDict, Set
+
+from dmanager.dmanager import DManager
+from dmanager.models import Raw, Sweep
+from metrics import timed
+from sweepstore import is_sweeps_file
+from utils import stem
+
+RAW = "raw"
+SWEEPS = "sweeps"
+ANALYSIS = "analysis"
+# Touched (in the upload folder) by every process changing the data, so the
+# catalogs of all other processes notice it on their next access
+CATALOG_STAMP = "catalog.stamp"
+
+
+class Catalog:
+    """ In-memory listing of raw-, sweeps- and analysis-data (per date). It is
+    built once (on first access) and updated by rescanning single dates,
+    either by the service's write paths, on access after another process
+    changed data (see `stamp_path`) or by the (optional) watcher, which picks
+    up changes made outside of the app.
+    """
+    def __init__(
+        self, dmanager: DManager, dirs: Dict[str, str], stamp_path: str | None = None,
+        poll_interval: float = 0
+    ) -> None:
+        self.dmanager = dmanager
+        self.dirs = dirs
+        # Seconds between polls of the watcher (0: no watcher)
+        self.poll_interval = poll_interval
+        self.stamp_path = stamp_path
+        self.stamp = _stamp(stamp_path)
+        self.entries: Dict[str, Dict[str, List[Raw|Sweep]]] = {}
+        # Tag ids (see `models.tag_ids`) -> entries, per kind
+        self.by_tag_id: Dict[str, Dict[str, List[Raw|Sweep]]] = {}
+        self.mtimes: Dict[str, float] = {}
+        self.lock = threading.RLock()
+        self.watcher = None
+
+    def get(self, kind: str) -> Dict[str, List[Raw|Sweep]]:
+        with self.lock:
+            self._sync()
+            if kind not in self.entries:
+                self._build(kind)
+            return OrderedDict(sorted(self.entries[kind].items()))
+
+    def find(self, kind: str, tag_ids: Set[str]) -> Set[Raw|Sweep]:
+        """ Entries of given kind tagged via any of the given tag ids """
+        with self.lock:
+            self._sync()
+            if kind not in self.entries:
+                self._build(kind)
+            index = self.by_tag_id[kind]
+            return {x for tag_id in tag_ids for x in index.get(tag_id, [])}
+
+    def build(self) -> None:
+        with self.lock:
+            for kind in self.dirs:
+                self._build(kind)
+
+    def rescan(self, kind: str, date: str) -> None:
+        """ Updates entries of a single date and tells other processes about
+        the change. Only the latter, if the catalog was not built (f.e. in job
+        workers, which never list data).
+        """
+        if self.stamp_path is not None:
+            _touch_file(self.stamp_path)
+        with self.lock:
+            if kind not in self.entries:
+                return
+            directory = os.path.join(self.dirs[kind], date)
+            self.mtimes[directory] = _mtime(directory)
+            self._unindex(kind, self.entries[kind].pop(date, []))
+            entries = self._scan(kind, date)
+            if len(entries) > 0:
+                self.entries[kind][date] = entries
+                self._index(kind, entries)
+            self.mtimes[self.dirs[kind]] = _mtime(self.dirs[kind])
+
+    def start_watcher(self) -> None:
+        """ Polls the data directories every `poll_interval` seconds and
+        rescans dates whose directory changed.
+        """
+        if self.watcher is not None or self.poll_interval <= 0:
+            return
+        def watch():
+            while True:
+                time.sleep(self.poll_interval)
+                try:
+                    self.poll()
+                except Exception as e:
+                    print(f"Catalog watcher failed: {repr(e)}")
+        self.watcher = threading.Thread(target=watch, daemon=True)
+        self.watcher.start()
+
+    def poll(self) -> None:
+        with self.lock:
+            for kind in list(self.entries.keys()):
+                root = self.dirs[kind]
+                dates = set(self.entries[kind].keys())
+                if _mtime(root) != self.mtimes.get(root):
+                    # Dates were added or removed
+                    dates |= set(_list_dates(root))
+                for date in dates:
+                    directory = os.path.join(root, date)
+                    if _mtime(directory) != self.mtimes.get(directory):
+                        self.rescan(kind, date)
+                self.mtimes[root] = _mtime(root)
+
+    def _sync(self) -> None:
+        """ Picks up changes of other processes (while `lock` is held) """
+        stamp = _stamp(self.stamp_path)
+        if stamp != self.stamp:
+            self.stamp = stamp
+            self.poll()
+
+    def _build(self, kind: str) -> None:
+        root = self.dirs[kind]
+        self.mtimes[root] = _mtime(root)
+        self.entries[kind] = {}
+        self.by_tag_id[kind] = {}
+        for date in _list_dates(root):
+            directory = os.path.join(root, date)
+            self.mtimes[directory] = _mtime(directory)
+            entries = self._scan(kind, date)
+            if len(entries) > 0:
+                self.entries[kind][date] = entries
+                self._index(kind, entries)
+
+    def _index(self, kind: str, entries: List[Raw|Sweep]) -> None:
+        for entry in entries:
+            for tag_id in entry.tag_ids:
+                self.by_tag_id[kind].setdefault(tag_id, []).append(entry)
+
+    def _unindex(self, kind: str, entries: List[Raw|Sweep]) -> None:
+        for entry in entries:
+            for tag_id in entry.tag_ids:
+                indexed = self.by_tag_id[kind].get(tag_id, [])
+                if entry in indexed:
+                    indexed.remove(entry)
+                if len(indexed) == 0:
+                    self.by_tag_id[kind].pop(tag_id, None)
+
+    @timed("catalog.scan")
+    def _scan(self, kind: str, date: str) -> List[Raw|Sweep]:
+        directory = os.path.join(self.dirs[kind], date)
+        if not os.path.isdir(directory):
+            return []
+        if kind == RAW:
+            filenames = [e.name for e in os.scandir(directory) if e.is_file()]
+            raws = [Raw(self.dmanager, date, f) for f in filenames]
+            raws.sort(key=(lambda x: get_key_num(x.filename)))
+            return raws
+        if kind == SWEEPS:
+            # Unmigrated data may exist as json and binary file: list only once
+            names = sorted({
+                stem(e.name) for e in os.scandir(directory)
+                if e.is_file() and is_sweeps_file(e.name)
+            })
+            sweeps = [Sweep(self.dmanager, date, name) for name in names]
+        else:
+            dirs = [e.name for e in os.scandir(directory) if e.is_dir()]
+            sweeps = [Sweep(self.dmanager, date, d) for d in dirs]
+        sweeps.sort(key=(lambda x: get_key_num(x.name)))
+        return sweeps
+
+
+def get_key_num(name: str) -> str:
+    try:
+        re_str = r"\S(\d\d?)\S*"
+        m = re.search(re_str, name)
+        return m.group(1).rjust(3, "0")
+    except Exception as err:
+        print("Failed to get num from {name}: {repr(err)}")
+        return name
+
+
+def _list_dates(root: str) -> List[str]:
+    if not os.path.isdir(root):
+        return []
+    return [e.name for e in os.scandir(root) if e.is_dir()]
+
+
+def _stamp(path: str | None) -> int | None:
+    try:
+        return os.stat(path).st_mtime_ns if path is not None else None
+    except FileNotFoundError:
+        return None
+
+
+def _touch_file(path: str) -> None:
+    with open(path, "a"):
+        pass
+    os.utime(path)
+
+
+def _mtime(path: str) -> float:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return 0
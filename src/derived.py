@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+
+# Derived values are numbers (stored as json) or arrays (stored as .npy)
+type Value = int | float | np.ndarray
+
+
+class DerivedCache:
+    """ Cache of data derived from a (sweeps) file: counts, sampling time,
+    averages, concatenations, ...
+
+    Entries are keyed by the file's path and identity (inode, size, mtime), so
+    they never outlive a change of the file. Recently used entries are kept in
+    memory (at most `max_bytes`) and on disk in `<directory>/<hash of path>/`
+    (at most `max_disk_bytes`, least recently used entries are removed
+    first). Values cheap to compute (`persist=False`) are only kept in
+    memory. `invalidate` drops all entries of a file.
+    """
+    def __init__(
+        self, directory: str, max_bytes: int = 256 << 20, max_disk_bytes: int = 1 << 30
+    ) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.memory: OrderedDict[Tuple[str, str], Value] = OrderedDict()
+        self.size = 0
+        # Bytes on disk (estimate, shared with other processes), None: unknown
+        self.disk_size = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self, path: str, name: str, compute: Callable[[], Value],
+        persist: bool = True, **params
+    ) -> Value:
+        """ Value `name` (with `params`) derived from file `path`, computed
+        by `compute` on a miss. Only kept in memory, unless `persist`.
+        """
+        key = self._key(path, name, params)
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return self.memory[key]
+        value = self._load(key) if persist else None
+        if value is None:
+            self.misses += 1
+            value = compute()
+            if isinstance(value, (list, tuple)):
+                value = np.asarray(value)
+            if persist:
+                self._store(key, value)
+        else:
+            self.hits += 1
+        if isinstance(value, np.ndarray):
+            # Shared by all callers
+            value.setflags(write=False)
+        self._remember(key, value)
+        return value
+
+    def invalidate(self, path: str) -> None:
+        """ Removes all entries derived from `path` (also of other versions
+        of the file)
+        """
+        file_key = _path_hash(path)
+        with self.lock:
+            for key in [k for k in self.memory if k[0].startswith(file_key)]:
+                self.size -= _nbytes(self.memory.pop(key))
+        shutil.rmtree(os.path.join(self.directory, file_key), ignore_errors=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.memory),
+            "bytes": self.size,
+        }
+
+    def _key(self, path: str, name: str, params: Dict) -> Tuple[str, str]:
+        stat = os.stat(path)
+        identity = f"{stat.st_ino}-{stat.st_size}-{stat.st_mtime_ns}"
+        entry = hashlib.sha1(
+            json.dumps([name, params], sort_keys=True).encode()
+        ).hexdigest()[:16]
+        return (f"{_path_hash(path)}/{identity}", f"{name}-{entry}")
+
+    def _remember(self, key: Tuple[str, str], value: Value) -> None:
+        size = _nbytes(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.memory:
+                return
+            self.memory[key] = value
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self.memory.popitem(last=False)
+                self.size -= _nbytes(evicted)
+
+    def _load(self, key: Tuple[str, str]) -> Value | None:
+        base = os.path.join(self.directory, *key)
+        try:
+            if os.path.exists(f"{base}.npy"):
+                # Mtime marks the last use (see `_evict`)
+                os.utime(f"{base}.npy")
+                return np.load(f"{base}.npy")
+            if os.path.exists(f"{base}.json"):
+                os.utime(f"{base}.json")
+                with open(f"{base}.json", "r") as f:
+                    return json.load(f)
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def _store(self, key: Tuple[str, str], value: Value) -> None:
+        file_dir = os.path.join(self.directory, key[0].split("/")[0])
+        entry_dir = os.path.join(self.directory, key[0])
+        # Entries of older versions of the file are never used again
+        if os.path.isdir(file_dir):
+            for old in os.listdir(file_dir):
+                if os.path.join(file_dir, old) != entry_dir:
+                    shutil.rmtree(os.path.join(file_dir, old), ignore_errors=True)
+        os.makedirs(entry_dir, exist_ok=True)
+        base = os.path.join(entry_dir, key[1])
+        # Write to temporary file and rename: other processes share the cache
+        tmp = f"{base}.{os.getpid()}.tmp"
+        if isinstance(value, np.ndarray):
+            with open(tmp, "wb") as f:
+                np.save(f, value)
+            os.replace(tmp, f"{base}.npy")
+            size = os.path.getsize(f"{base}.npy")
+        else:
+            with open(tmp, "w") as f:
+                json.dump(value, f)
+            os.replace(tmp, f"{base}.json")
+            size = os.path.getsize(f"{base}.json")
+        with self.lock:
+            if self.disk_size is not None:
+                self.disk_size += size
+            if self.disk_size is None or self.disk_size > self.max_disk_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        """ Measures the disk tier and removes least recently used entries
+        down to 90% of `max_disk_bytes` (while `lock` is held)
+        """
+        files = []
+        for root, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                try:
+                    stat = os.stat(os.path.join(root, filename))
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime_ns, stat.st_size, os.path.join(root, filename)))
+        self.disk_size = sum(size for _, size, _ in files)
+        if self.disk_size <= self.max_disk_bytes:
+            return
+        for _, size, file in sorted(files):
+            if self.disk_size <= 0.9*self.max_disk_bytes:
+                break
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+            self.disk_size -= size
+
+
+def _path_hash(path: str) -> str:
+    return hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16]
+
+
+def _nbytes(value: Value) -> int:
+    return value.nbytes if isinstance(value, np.ndarray) else 64
@@ -1,116 +1,232 @@
-import json
 import os
 import shutil
 from typing import Dict, List, Tuple
 
 from dmanager.dmodels import Project
+from dmanager.projectindex import ProjectIndex
+from dmanager.stores import JsonStore, SqliteStore
+from dmanager.tagindex import TagIndex
+from metrics import timed
 from utils import stem
 
 class DManager: 
-    def __init__(self, upload_folder) -> None:
-        # Dir to database paths
-        self.dir_peaks = os.path.join(upload_folder, "peaks.json")
-        self.dir_map_num_sweeps = os.path.join(upload_folder, "num_sweeps.json")
-        self.dir_tags = os.path.join(upload_folder, "tags.json")
-        self.dir_all_tags = os.path.join(upload_folder, "all_tags.json")
-        self.dir_favorites = os.path.join(upload_folder, "favorites.json")
+    def __init__(
+        self, upload_folder, backend: str = "json", flush_delay: float = 0
+    ) -> None:
         self.dir_projects = os.path.join(upload_folder, "projects")
-        # Database fields
-        self.peaks = {}
-        self.map_num_sweeps = {}
-        self.all_tags = []
-        self.tags = {}
-        self.favorites = {}
-        self.projects = self.load_projects()
-        print("loading tags: ", self.all_tags)
-        self.load_data()
-
-    def store_peaks(self): 
-        with open(self.dir_peaks, "w") as f: 
-            json.dump(self.peaks, f)
-
-    def store_num_sweeps(self): 
-         with open(self.dir_map_num_sweeps, "w") as f: 
-            json.dump(self.map_num_sweeps, f)
-
-    def store_tags(self): 
-         with open(self.dir_tags, "w") as f: 
-            json.dump(self.tags, f)
-         with open(self.dir_all_tags, "w") as f: 
-            json.dump(self.all_tags, f)
-            print("loaded tags: ", self.all_tags)
+        # Database (tags, favorites, num sweeps, peaks and project members)
+        if backend == "sqlite":
+            self.store = SqliteStore(upload_folder, self.dir_projects)
+        elif backend == "json":
+            self.store = JsonStore(upload_folder, flush_delay)
+        else:
+            raise ValueError(f"Unknown metadata backend: {backend}")
+        self.store_version = self.store.version
+        self.tags_version = self.store.tags_version
+        self.projects_version = self.store.projects_version
+        # Projects and tag index are built on first access (see `warm`)
+        self._projects = None
+        self._tag_index = None
+
+    def refresh(self) -> None:
+        """ Picks up changes of other processes (f.e. gunicorn workers): the
+        tag index is rebuilt, if tags changed, all projects are reloaded, if
+        projects were added, renamed or removed, otherwise only projects
+        with changed members
+        """
+        self.store.refresh()
+        if self.store_version == self.store.version:
+            return
+        self.store_version = self.store.version
+        if self.tags_version != self.store.tags_version:
+            self.tags_version = self.store.tags_version
+            self._tag_index = None
+        if self._projects is None:
+            return
+        if self.projects_version != self.store.projects_version:
+            self.projects_version = self.store.projects_version
+            self._projects = self.load_projects()
+            return
+        changed = [p for p in self._projects.values() if self.store.project_changed(p)]
+        for project in changed:
+            project.analysis = self.store.load_project(project)
+        if changed:
+            self._index_projects(self._projects)
+
+    def warm(self) -> None:
+        """ Loads all data, which is loaded on first access otherwise """
+        for name in (
+            "peaks", "map_num_sweeps", "tags", "all_tags", "favorites", "raw_hashes",
+            "tag_index", "projects"
+        ): 
+            getattr(self, name)
+
+    def flush(self) -> None:
+        """ Writes pending changes (see `JsonStore`) """
+        self.store.flush()
+
+    @property
+    def peaks(self) -> Dict: 
+        self.refresh()
+        return self.store.peaks
+
+    @property
+    def map_num_sweeps(self) -> Dict[str, int]: 
+        self.refresh()
+        return self.store.num_sweeps
+
+    @property
+    def tags(self) -> Dict[str, List[str]]: 
+        self.refresh()
+        return self.store.tags
+
+    @property
+    def all_tags(self) -> List[str]: 
+        self.refresh()
+        return self.store.all_tags
+
+    @property
+    def favorites(self) -> Dict[str, bool]: 
+        self.refresh()
+        return self.store.favorites
+
+    @property
+    def raw_hashes(self) -> Dict[str, str]: 
+        self.refresh()
+        return self.store.raw_hashes
+
+    @property
+    def projects(self) -> Dict[str, Project]: 
+        self.refresh()
+        if self._projects is None: 
+            self._projects = self.load_projects()
+        return self._projects
 
+    @property
+    def tag_index(self) -> TagIndex: 
+        self.refresh()
+        if self._tag_index is None: 
+            self._tag_index = TagIndex(self.store.tags)
+        return self._tag_index
+
+    def analysis_projects(self, analysis: str) -> List[str]: 
+        """ Names of all projects containing given analysis (png path) """
+        # Index is built with the projects
+        self.projects
+        return self.project_index.projects(analysis)
+
+    @timed("dmanager.load_projects")
     def load_projects(self) -> Dict[str, Project]: 
+        self.projects_version = self.store.projects_version
         projects = {}
         for (root, dirs, _) in os.walk(self.dir_projects):
+            # Hidden directories (f.e. thumbnails) are no projects
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
             for dir_name in dirs:
                 full_path = os.path.join(root, dir_name)
                 full_name = full_path[len(self.dir_projects)+1:]
-                projects[full_name] = Project(full_path)
+                projects[full_name] = Project(full_path, full_name, self.store)
+        self._index_projects(projects)
         return projects
 
-    def load_data(self): 
-        with open(self.dir_peaks, "r") as f: 
-            self.peaks = json.load(f)
-        with open(self.dir_map_num_sweeps, "r") as f: 
-            self.map_num_sweeps= json.load(f)
-        with open(self.dir_tags, "r") as f: 
-            self.tags = json.load(f)
-        with open(self.dir_all_tags, "r") as f: 
-            self.all_tags = json.load(f)
-        with open(self.dir_favorites, "r") as f: 
-            self.favorites = json.load(f)
+    def _index_projects(self, projects: Dict[str, Project]) -> None: 
+        self.project_index = ProjectIndex(projects.values())
+        for project in projects.values(): 
+            project.index = self.project_index
+
+    def add_tag(self, path: str, tag: str) -> bool: 
+        if path in self.tags and tag in self.tags[path]:
+            return False
+        self.store.add_tag(path, tag)
+        self.tag_index.add(path, tag)
+        return True
+
+    def remove_tag(self, path: str, tag: str) -> bool: 
+        if path not in self.tags or tag not in self.tags[path]:
+            return False
+        self.store.remove_tag(path, tag)
+        self.tag_index.remove(path, tag)
+        return True
    
-    def add_num_sweeps(self, path: str, num_sweeps: int) -> int: 
-        self.map_num_sweeps[path] = num_sweeps
-        self.store_num_sweeps()
-        return num_sweeps
+    def add_peaks(self, key: str, path: str, source: str, params: Dict) -> None: 
+        """ Indexes calculated peaks (see `Service.calc_peaks`) """
+        self.store.set_peaks(key, {"path": path, "source": source, "params": params})
+
+    def remove_peaks(self, path: str) -> None: 
+        """ Removes all indexed peaks stored in `path` """
+        prefix = os.path.join(path, "")
+        for key, entry in list(self.peaks.items()): 
+            peaks_path = entry.get("path", "") if isinstance(entry, dict) else ""
+            if peaks_path.startswith(prefix) or peaks_path == path: 
+                self.store.set_peaks(key, None)
+
+    def add_raw_hash(self, digest: str, path: str) -> None: 
+        self.store.set_raw_hash(digest, path)
+
+    def remove_raw_hashes(self, path: str) -> None: 
+        """ Removes hashes of raw file `path` (or of all files in it) """
+        prefix = os.path.join(path, "")
+        for digest, raw_path in list(self.raw_hashes.items()): 
+            if raw_path == path or raw_path.startswith(prefix): 
+                self.store.set_raw_hash(digest, None)
+
+    def remove_num_sweeps(self, path: str) -> None: 
+        """ Forgets the number of sweeps of a deleted sweeps-file """
+        for key in list(self.map_num_sweeps.keys()): 
+            if key == path or stem(key) == stem(path): 
+                self.store.del_num_sweeps(key)
 
     def add_favorite(self, name: str): 
-        self.favorites[name] = True
-        with open(self.dir_favorites, "w") as f: 
-            json.dump(self.favorites, f)
+        self.store.set_favorite(name, True)
 
     def del_favorite(self, name: str):
-        del self.favorites[name]
-        with open(self.dir_favorites, "w") as f: 
-            json.dump(self.favorites, f)
+        self.store.set_favorite(name, False)
 
     def add_project(self, name: str) -> Tuple[str, str]: 
         if len(name) == 0: 
             return ("missing project name!", "danger")
-        if name in self.projects: 
-            return ("Project already exists!", "danger")
-        project_path = os.path.join(self.dir_projects, name)
-        os.mkdir(project_path)
-        self.projects[name] = Project(project_path)
+        with self.store.locked(): 
+            if name in self.projects: 
+                return ("Project already exists!", "danger")
+            project_path = os.path.join(self.dir_projects, name)
+            os.mkdir(project_path)
+            self._projects[name] = Project(
+                project_path, name, self.store, self.project_index
+            )
+            self.store.projects_changed()
         return (f"Sucessfully added project: {name}", "success")
 
     def rename_project(self, cur_name: str, new_name: str) -> Tuple[str, str]: 
         print(f"Renaming project \"{cur_name}\" to \"{new_name}\"")
-        if cur_name not in self.projects: 
-            return ("Project does not exist!", "danger")
-        if new_name in self.projects: 
-            return (f"Project \"{new_name}\" already exists!", "danger")
-        self.projects[new_name] = self.projects[cur_name] 
-        del self.projects[cur_name]
-        shutil.move(
-            os.path.join(self.dir_projects, cur_name),
-            os.path.join(self.dir_projects, new_name)
-        )
+        with self.store.locked(): 
+            if cur_name not in self.projects: 
+                return ("Project does not exist!", "danger")
+            if new_name in self.projects: 
+                return (f"Project \"{new_name}\" already exists!", "danger")
+            self.store.rename_project(cur_name, new_name)
+            shutil.move(
+                os.path.join(self.dir_projects, cur_name),
+                os.path.join(self.dir_projects, new_name)
+            )
+            self.store.projects_changed()
+            # Reload, as paths (also of sub-projects) changed
+            self._projects = self.load_projects()
         return (
             f"Project \"{cur_name}\" sucessfully renamed to: \"{new_name}\"",
             "success"
         )
 
     def del_project(self, name: str) -> Tuple[str, str]: 
-        if name not in self.projects: 
-            return ("Project does not exist!", "danger")
-        project_path = os.path.join(self.dir_projects, name)
-        shutil.rmtree(project_path)
-        size_before = len(self.projects)
-        self.projects = self.load_projects()
-        num_deleted = size_before-len(self.projects)
+        with self.store.locked(): 
+            if name not in self.projects: 
+                return ("Project does not exist!", "danger")
+            project_path = os.path.join(self.dir_projects, name)
+            self.store.del_project(name)
+            shutil.rmtree(project_path)
+            self.store.projects_changed()
+            size_before = len(self._projects)
+            self._projects = self.load_projects()
+        num_deleted = size_before-len(self._projects)
         if num_deleted > 1:
             return (
                 f"Sucessfully removed project: {name} and {num_deleted-1} others",
@@ -1,9 +1,10 @@
-import json
 import os
 from dataclasses import dataclass
 from enum import Enum
 from typing import Tuple
 
+from dmanager.stacked import StackedSweeps
+
 ANALYSIS_INIT = "project.json"
 
 class AnalysisOpts(Enum):
@@ -17,33 +18,57 @@ class Tag:
     name: str 
     raw: bool
 
+@dataclass
+class UploadStatus: 
+    file: str
+    msg: str
+    msg_type: str
+    # Stored as (f.e. "2024-06-11/cell1.ibw"), if stored
+    path: str | None = None
+    job: str | None = None
+
 class Project: 
-    def __init__(self, path: str) -> None:
+    def __init__(self, path: str, name: str, store, index=None) -> None:
         self.path = path 
-        # Load analysis included in project
+        self.name = name
+        # Reverse index of all projects' members (see `dmanager.projectindex`)
+        self.index = index
+        # Persists analysis included in project (see `dmanager.stores`)
+        self.store = store
         self.project_file = os.path.join(self.path, ANALYSIS_INIT)
-        if os.path.exists(self.project_file): 
-            with open(self.project_file, "r") as f: 
-                self.analysis = json.load(f) 
-        else: 
-            self.analysis = []
-            self.safe()
+        self.analysis = self.store.load_project(self)
+        # Sweeps of all single-sweep analysis, updated on add/remove
+        self.stacked = StackedSweeps(self.path)
 
     def add(self, analysis: str) -> Tuple[str, int]: 
-        if analysis in self.analysis: 
-            return ("Analysis already in project", 401)
-        self.analysis.append(analysis) 
-        self.safe()
+        # Locked across processes: stacked sweeps are shared files as well
+        with self.store.locked(): 
+            if analysis in self.analysis: 
+                return ("Analysis already in project", 401)
+            try: 
+                num_sweeps = self.stacked.add(analysis)
+            except OSError: 
+                return ("Analysis not found", 404)
+            self.analysis.append(analysis) 
+            self.store.project_added(self, analysis)
+        if self.index is not None: 
+            self.index.add(analysis, self.name)
+        if num_sweeps != 1: 
+            return (f"Added analysis to project (not stackable: {num_sweeps} sweeps)", 200)
         return ("Added analysis to project", 200)
 
     def remove(self, analysis: str) -> Tuple[str, int]: 
-        if analysis not in self.analysis:
-            return ("Analysis not in project", 404)
-        self.analysis.remove(analysis) 
-        self.safe()
+        with self.store.locked(): 
+            if analysis not in self.analysis:
+                return ("Analysis not in project", 404)
+            self.analysis.remove(analysis) 
+            self.store.project_removed(self, analysis)
+            self.stacked.remove(analysis)
+        if self.index is not None: 
+            self.index.remove(analysis, self.name)
         return ("removed analysis from project", 200)
             
 
     def safe(self) -> None: 
-        with open(self.project_file, "w") as f: 
-            json.dump(self.analysis, f)
+        with self.store.locked(): 
+            self.store.store_project(self)
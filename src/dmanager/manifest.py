@@ -0,0 +1,121 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, List
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, run a single process only
+    fcntl = None
+
+# Per analysis directory (`data/analysis/<date>/<sweeps>/`): summary of every
+# analysis plot, so listing a directory needs no probing of plugin data
+MANIFEST_FILE = "manifest.json"
+
+# Manifests are updated by the server and by job workers: threads hold this
+# lock, processes an advisory lock of the analysis directory (see `_locked`)
+_lock = threading.Lock()
+
+
+def analysis_entry(directory: str, filename: str) -> Dict:
+    """ Selection, version and name (parsed from the filename) and a summary
+    (parameters and sweeps, not the data) of every plugin of an analysis plot
+    """
+    parts = filename.split("_")
+    plug = {}
+    path_to_plugin_data = os.path.join(directory, filename.replace(".png", "_plug"))
+    if os.path.exists(path_to_plugin_data):
+        entries = sorted(os.scandir(path_to_plugin_data), key=lambda x: x.name)
+        for entry in entries:
+            summary = _plugin_summary(entry.path) if entry.is_dir() else None
+            if summary is not None:
+                plug[entry.name] = summary
+    return {
+        "selection": parts[0],
+        "version": parts[1],
+        "name": parts[2],
+        "plug": plug,
+    }
+
+
+def update_manifest(directory: str, filenames: List[str]) -> None:
+    """ (Re-)Creates the entries of the given analysis plots """
+    with _locked(directory):
+        manifest = _load(directory)
+        for filename in filenames:
+            manifest[filename] = analysis_entry(directory, filename)
+        _store(directory, manifest)
+
+
+def load_manifest(directory: str, filenames: List[str]) -> Dict[str, Dict]:
+    """ Entries of the given analysis plots. Plots without entry (f.e. of
+    analysis created before manifests) are added, entries of deleted plots
+    removed.
+    """
+    manifest = _load(directory)
+    if set(manifest) == set(filenames):
+        return manifest
+    # Read again under the lock: another process may have updated it
+    with _locked(directory):
+        manifest = _load(directory)
+        missing = [f for f in filenames if f not in manifest]
+        deleted = set(manifest) - set(filenames)
+        for filename in missing:
+            manifest[filename] = analysis_entry(directory, filename)
+        for filename in deleted:
+            del manifest[filename]
+        if missing or deleted:
+            _store(directory, manifest)
+        return manifest
+
+
+def _plugin_summary(path: str) -> Dict | None:
+    """ Parameters (if stored) and sweeps (plotted as `<sweep>.png`) of the
+    data of a plugin, None while it is written (no `data.json` yet)
+    """
+    summary = {"params": {}, "sweeps": []}
+    try:
+        names = os.listdir(path)
+        if "data.json" not in names:
+            return None
+        if "params.json" in names:
+            with open(os.path.join(path, "params.json"), "r") as f:
+                summary["params"] = json.load(f)
+    except (OSError, ValueError):
+        # Removed (or still written) meanwhile
+        return None
+    sweeps = [name[:-len(".png")] for name in names if name.endswith(".png")]
+    summary["sweeps"] = sorted(sweeps, key=lambda x: (len(x), x))
+    return summary
+
+
+@contextmanager
+def _locked(directory: str):
+    with _lock:
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+
+def _load(directory: str) -> Dict[str, Dict]:
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _store(directory: str, manifest: Dict[str, Dict]) -> None:
+    path = os.path.join(directory, MANIFEST_FILE)
+    # Written to temporary file and renamed: other processes read manifests
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, path)
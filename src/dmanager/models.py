@@ -1,16 +1,27 @@
 import json
 import os
+from functools import cached_property
 from dmanager.dmanager import DManager
+from dmanager.manifest import analysis_entry
 from utils import stem
-from typing import List
+from typing import Dict, List
 from dmanager.dmodels import Tag
 
 class Raw: 
     def __init__(self, dmanager: DManager, path: str, filename: str):
+        self.dmanager = dmanager
         self.path = path 
         self.filename = filename 
         self.name = stem(filename) 
-        self.tags = get_tags(dmanager, path, self.name)
+
+    @property
+    def tags(self) -> List[Tag]: 
+        # Not cached: raw objects are kept in the catalog, tags may change 
+        return get_tags(self.dmanager, self.path, self.name)
+
+    @property
+    def tag_ids(self) -> List[str]: 
+        return tag_ids(self.path, self.name)
 
     def tags_match(self, tag: str) -> bool: 
         for t in self.tags: 
@@ -20,10 +31,20 @@ class Raw:
 
 class Sweep: 
     def __init__(self, dmanager: DManager, date: str, filename: str) -> None:
+        self.dmanager = dmanager
+        self.date = date
         self.filename = filename
         self.name = filename.split("_")[1]
         self.version = filename.split("_")[0]
-        self.tags = get_tags(dmanager, date, self.name, filename)
+
+    @property
+    def tags(self) -> List[Tag]: 
+        # Not cached: sweep objects are kept in the catalog, tags may change 
+        return get_tags(self.dmanager, self.date, self.name, self.filename)
+
+    @property
+    def tag_ids(self) -> List[str]: 
+        return tag_ids(self.date, self.name, self.filename)
 
     def tags_match(self, tag: str) -> bool: 
         for t in self.tags: 
@@ -32,35 +53,43 @@ class Sweep:
         return False
 
 class Analysis: 
-    def __init__(self, path: str, name: str, projects: List[str]) -> None:
-        print("Creating Analysis from: ", path, name)
+    def __init__(
+        self, path: str, name: str, projects: List[str], entry: Dict | None = None
+    ) -> None:
         self.parent = path
         self.path = os.path.join(path, name)
-        self.selection = name.split("_")[0]
-        self.version = name.split("_")[1]
-        self.name = name.split("_")[2]
-        self.plug = {}
+        # Summary of the analysis (see `dmanager.manifest`), if not given
+        # read from the analysis directory
+        if entry is None: 
+            entry = analysis_entry(path, name)
+        self.selection = entry["selection"]
+        self.version = entry["version"]
+        self.name = entry["name"]
         self.projects = projects
         path_to_plugin_data = os.path.join(path, name.replace(".png", "_plug"))
-        if os.path.exists(path_to_plugin_data): 
-            for entry in os.scandir(path_to_plugin_data):
-                if entry.is_dir():
-                    self.plug[entry.name] = PluginData(
-                        os.path.join(path_to_plugin_data, entry.name)
-                    )
+        self.plug = {
+            plugin: PluginData(os.path.join(path_to_plugin_data, plugin), summary)
+            for plugin, summary in entry["plug"].items()
+        }
 
 class PluginData: 
-    def __init__(self, path: str):
+    def __init__(self, path: str, summary: Dict):
         self.path_to_plot = path
-        with open(os.path.join(path, "data.json"), "r") as f: 
-            self.data = json.load(f)
+        # Parameters the data was calculated with (if stored, f.e. peaks)
+        self.params = summary["params"]
+        self.sweeps = summary["sweeps"]
+
+    @cached_property
+    def data(self) -> Dict[str, List]: 
+        """ Data (table per sweep), only read when accessed """
+        with open(os.path.join(self.path_to_plot, "data.json"), "r") as f: 
+            return json.load(f)
 
 def get_tags(
     dmanager: DManager, date: str, filename: str, name: str = ""
 ) -> List[Tag]:
     tags = []
-    raw_id = os.path.join(date, filename)
-    analysis_id = os.path.join(raw_id, name)
+    raw_id, analysis_id = tag_ids(date, filename, name)
     for tag_type in [raw_id, analysis_id]:
         if tag_type in dmanager.tags: 
             for tag in dmanager.tags[tag_type]:
@@ -68,3 +97,10 @@ def get_tags(
                     tags.append(Tag(tag, tag_type==raw_id))
     tags.sort(key=(lambda x: x.name))
     return tags
+
+def tag_ids(date: str, filename: str, name: str = "") -> List[str]:
+    """ Keys of an entry in `DManager.tags`: tags of the raw file (shared by
+    its sweeps and analysis) and tags of the sweeps/analysis only.
+    """
+    raw_id = os.path.join(date, filename)
+    return [raw_id, os.path.join(raw_id, name)]
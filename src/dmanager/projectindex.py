@@ -0,0 +1,25 @@
+from typing import Dict, Iterable, List, Set
+
+
+class ProjectIndex:
+    """ Reverse index of project members: analysis -> names of the projects
+    containing it
+    """
+    def __init__(self, projects: Iterable = ()) -> None:
+        self.entries: Dict[str, Set[str]] = {}
+        for project in projects:
+            for analysis in project.analysis:
+                self.add(analysis, project.name)
+
+    def add(self, analysis: str, project_name: str) -> None:
+        self.entries.setdefault(analysis, set()).add(project_name)
+
+    def remove(self, analysis: str, project_name: str) -> None:
+        if analysis not in self.entries:
+            return
+        self.entries[analysis].discard(project_name)
+        if len(self.entries[analysis]) == 0:
+            del self.entries[analysis]
+
+    def projects(self, analysis: str) -> List[str]:
+        return sorted(self.entries.get(analysis, ()))
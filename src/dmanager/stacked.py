@@ -0,0 +1,173 @@
+import json
+import os
+import threading
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from extractor.functions import calc_time_from_sweeps
+from sweepstore import (
+    append_sweeps, load_sweeps, open_sweeps, read_header, write_sweeps
+)
+
+STACKED_FILE = "stacked.bin"
+STACKED_INDEX = "stacked.json"
+
+
+class StackedSweeps:
+    """ The sweeps of all single-sweep analysis of a project, stacked into
+    one binary sweeps file (`stacked.bin`, shorter sweeps padded with nan)
+    next to `project.json`.
+
+    `stacked.json` lists the analysis of every row (with number of samples
+    and time of its sweep) and the analysis which can not be stacked (more
+    than one sweep). Every analysis is read once, when it is added.
+    """
+    def __init__(self, directory: str) -> None:
+        self.path = os.path.join(directory, STACKED_FILE)
+        self.index_path = os.path.join(directory, STACKED_INDEX)
+        # {"analysis": ..., "length": ..., "time": ...} per row of the matrix
+        self.rows: List[Dict] = []
+        # Analysis with more than one sweep: number of sweeps
+        self.multi: Dict[str, int] = {}
+        self.mtime = None
+        self.lock = threading.Lock()
+
+    def add(self, analysis: str) -> int:
+        """ Adds the sweep of `analysis` (png path) to the matrix. Returns the
+        number of sweeps of the analysis (only 1 is stacked).
+        """
+        with self.lock:
+            self._reload()
+            if analysis in self.multi:
+                return self.multi[analysis]
+            if analysis in self._analysis():
+                return 1
+            sweeps = load_sweeps(analysis.replace(".png", ".json"))
+            if len(sweeps) != 1:
+                self.multi[analysis] = len(sweeps)
+                self._store_index()
+                return len(sweeps)
+            sweep = np.asarray(sweeps[0], dtype=float)
+            num_samples = max([row["length"] for row in self.rows], default=0)
+            if not self.rows or len(sweep) > num_samples:
+                # Longer sweep: all rows are padded again
+                matrix = self._matrix()
+                self.rows.append({
+                    "analysis": analysis,
+                    "length": len(sweep),
+                    "time": calc_time_from_sweeps(sweeps),
+                })
+                self._write([*matrix, sweep])
+            else:
+                append_sweeps(self.path, _pad(sweep, num_samples))
+                self.rows.append({
+                    "analysis": analysis,
+                    "length": len(sweep),
+                    "time": calc_time_from_sweeps(sweeps),
+                })
+            self._store_index()
+            return 1
+
+    def remove(self, analysis: str) -> None:
+        with self.lock:
+            self._reload()
+            if analysis in self.multi:
+                del self.multi[analysis]
+            elif analysis in self._analysis():
+                index = self._analysis().index(analysis)
+                matrix = self._matrix()
+                del matrix[index]
+                del self.rows[index]
+                self._write(matrix)
+            else:
+                return
+            self._store_index()
+
+    def sync(self, analysis: List[str]) -> None:
+        """ Brings matrix in line with the project's analysis (f.e. projects
+        created before stacked matrices or changed by another process)
+        """
+        with self.lock:
+            self._reload()
+            known = set(self._analysis()) | set(self.multi)
+        for a in known - set(analysis):
+            self.remove(a)
+        for a in analysis:
+            if a not in known:
+                self.add(a)
+
+    def not_stackable(self) -> Dict[str, int]:
+        with self.lock:
+            self._reload()
+            return dict(self.multi)
+
+    def sweeps(self) -> Tuple[List[List[float]], List[str], float]:
+        """ Stacked sweeps (without padding), their analysis and the time of
+        the last sweep
+        """
+        with self.lock:
+            self._reload()
+            if not self.rows:
+                return [], [], 0
+            matrix = open_sweeps(self.path)
+            return (
+                [matrix[i, :row["length"]].tolist() for i, row in enumerate(self.rows)],
+                self._analysis(),
+                self.rows[-1]["time"],
+            )
+
+    def _analysis(self) -> List[str]:
+        return [row["analysis"] for row in self.rows]
+
+    def _matrix(self) -> List[np.ndarray]:
+        if not self.rows:
+            return []
+        matrix = open_sweeps(self.path)
+        return [matrix[i, :row["length"]] for i, row in enumerate(self.rows)]
+
+    def _write(self, sweeps: List[np.ndarray]) -> None:
+        if not sweeps:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        num_samples = max(len(sweep) for sweep in sweeps)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        write_sweeps(tmp, [_pad(sweep, num_samples) for sweep in sweeps])
+        os.replace(tmp, self.path)
+
+    def _reload(self) -> None:
+        """ Re-reads the index, if it was changed (f.e. by another process) """
+        try:
+            mtime = os.stat(self.index_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self.mtime:
+            return
+        self.rows, self.multi = [], {}
+        if mtime is not None:
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+            self.rows, self.multi = index["rows"], index["multi"]
+        self.mtime = mtime
+        # Matrix does not match its index (f.e. interrupted write): rebuilt
+        # by the next `sync`
+        if self.rows and (
+            not os.path.exists(self.path)
+            or read_header(self.path).num_sweeps != len(self.rows)
+        ):
+            self.rows = []
+
+    def _store_index(self) -> None:
+        tmp = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"rows": self.rows, "multi": self.multi}, f)
+        os.replace(tmp, self.index_path)
+        self.mtime = os.stat(self.index_path).st_mtime_ns
+
+
+def _pad(sweep: np.ndarray, num_samples: int) -> np.ndarray:
+    return np.pad(
+        np.asarray(sweep, dtype=float), (0, num_samples - len(sweep)),
+        constant_values=np.nan
+    )
@@ -0,0 +1,825 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, run a single process only
+    fcntl = None
+
+from dmanager.dmodels import ANALYSIS_INIT
+from metrics import span
+
+# Advisory lock of all processes (gunicorn workers, job workers) writing
+# metadata and projects of an upload folder
+LOCK_FILE = "metadata.lock"
+# Touched, whenever project directories are added, moved or removed
+PROJECTS_STAMP = "projects.stamp"
+
+
+class MetadataStore(ABC):
+    """ In-memory metadata (tags, favorites, sweep counts, peaks, project
+    members, content hashes of raw files) plus its persistence. Every
+    mutation updates the in-memory data and persists it; subclasses decide
+    how (see `JsonStore`, `SqliteStore`).
+    """
+    def __init__(self, upload_folder: str) -> None:
+        self.peaks: Dict = {}
+        self.num_sweeps: Dict[str, int] = {}
+        self.tags: Dict[str, List[str]] = {}
+        self.all_tags: List[str] = []
+        self.favorites: Dict[str, bool] = {}
+        # Content hash -> raw file (`<date>/<filename>`)
+        self.raw_hashes: Dict[str, str] = {}
+        # Incremented, whenever data is (re-)loaded from disk (`version`),
+        # tags were changed by another process (`tags_version`) or project
+        # directories were (`projects_version`, see `projects_changed`)
+        self.version = 0
+        self.tags_version = 0
+        self.projects_version = 0
+        self.lock = threading.RLock()
+        self.lock_path = os.path.join(upload_folder, LOCK_FILE)
+        self.lock_file = None
+        self.lock_pid = None
+        self.lock_depth = 0
+
+    @contextmanager
+    def locked(self):
+        """ Holds the lock of the store across threads and processes
+        (advisory lock of `metadata.lock`). Reentrant.
+        """
+        with self.lock:
+            # Locks of an open file are shared with forked processes: every
+            # process opens its own
+            if self.lock_pid != os.getpid():
+                self.lock_file = open(self.lock_path, "a")
+                self.lock_pid = os.getpid()
+                self.lock_depth = 0
+            if self.lock_depth == 0 and fcntl is not None:
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+            self.lock_depth += 1
+            try:
+                yield
+            finally:
+                self.lock_depth -= 1
+                if self.lock_depth == 0 and fcntl is not None:
+                    fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    def refresh(self) -> bool:
+        """ Reloads data, if it was changed by another process. """
+        return False
+
+    def projects_changed(self) -> None:
+        """ Project directories were added, moved or removed (while
+        `locked`): other processes reload their projects.
+        """
+        pass
+
+    def project_changed(self, project) -> bool:
+        """ Whether the members of `project` were changed by another process
+        (checked after `version` changed)
+        """
+        return False
+
+    def flush(self) -> None:
+        """ Persists pending changes (if a store delays writing them) """
+        pass
+
+    def add_tag(self, entry_id: str, tag: str) -> None:
+        with self.lock:
+            if tag not in self.all_tags:
+                self.all_tags.append(tag)
+            self.tags.setdefault(entry_id, []).append(tag)
+            self._tag_added(entry_id, tag)
+
+    def remove_tag(self, entry_id: str, tag: str) -> None:
+        with self.lock:
+            self.tags[entry_id].remove(tag)
+            self._tag_removed(entry_id, tag)
+
+    def set_num_sweeps(self, path: str, num_sweeps: int) -> None:
+        with self.lock:
+            self.num_sweeps[path] = num_sweeps
+            self._num_sweeps_changed(path)
+
+    def del_num_sweeps(self, path: str) -> None:
+        with self.lock:
+            if path in self.num_sweeps:
+                del self.num_sweeps[path]
+                self._num_sweeps_changed(path)
+
+    def set_favorite(self, name: str, favorite: bool) -> None:
+        with self.lock:
+            if favorite:
+                self.favorites[name] = True
+            else:
+                self.favorites.pop(name, None)
+            self._favorite_changed(name)
+
+    def set_peaks(self, key: str, value) -> None:
+        with self.lock:
+            if value is None:
+                self.peaks.pop(key, None)
+            else:
+                self.peaks[key] = value
+            self._peaks_changed(key)
+
+    def set_raw_hash(self, digest: str, path: str | None) -> None:
+        with self.lock:
+            if path is None:
+                self.raw_hashes.pop(digest, None)
+            else:
+                self.raw_hashes[digest] = path
+            self._raw_hash_changed(digest)
+
+    @abstractmethod
+    def store_all(self) -> None:
+        """ Persists all data (not only changed entries). Merged with the
+        data of other processes: entries are added or updated, never removed.
+        """
+
+    # Project members (project: dmodels.Project)
+
+    @abstractmethod
+    def load_project(self, project) -> List[str]:
+        """ Members of `project` (created, if new) """
+
+    def project_added(self, project, analysis: str) -> None:
+        self.store_project(project)
+
+    def project_removed(self, project, analysis: str) -> None:
+        self.store_project(project)
+
+    @abstractmethod
+    def store_project(self, project) -> None:
+        """ Persists all members of `project` (merged like `store_all`) """
+
+    def rename_project(self, cur_name: str, new_name: str) -> None:
+        pass
+
+    def del_project(self, name: str) -> None:
+        pass
+
+    # Persistence hooks
+
+    @abstractmethod
+    def _tag_added(self, entry_id: str, tag: str) -> None:
+        pass
+
+    @abstractmethod
+    def _tag_removed(self, entry_id: str, tag: str) -> None:
+        pass
+
+    @abstractmethod
+    def _num_sweeps_changed(self, path: str) -> None:
+        pass
+
+    @abstractmethod
+    def _favorite_changed(self, name: str) -> None:
+        pass
+
+    @abstractmethod
+    def _peaks_changed(self, key: str) -> None:
+        pass
+
+    @abstractmethod
+    def _raw_hash_changed(self, digest: str) -> None:
+        pass
+
+
+class _JsonFile:
+    """ Metadata of a `JsonStore`, read from its json file (path in attribute
+    `path_attr` of the store) on first access
+    """
+    def __init__(self, path_attr: str, optional: bool = False) -> None:
+        self.path_attr = path_attr
+        # Optional files (added later, f.e. raw hashes) do not exist for older data
+        self.optional = optional
+
+    def __set_name__(self, owner, name: str) -> None:
+        self.name = f"_{name}"
+
+    def __get__(self, store, owner=None):
+        if store is None:
+            return self
+        with store.lock:
+            if store.__dict__.get(self.name) is None:
+                path = getattr(store, self.path_attr)
+                # Stamp before reading: a concurrent write is detected later
+                store.stamps[path] = _stamp(path)
+                if self.optional and store.stamps[path] is None:
+                    store.__dict__[self.name] = {}
+                else:
+                    with open(path, "r") as f, span("store.load"):
+                        store.__dict__[self.name] = json.load(f)
+            return store.__dict__[self.name]
+
+    def __set__(self, store, value) -> None:
+        store.__dict__[self.name] = value
+
+
+class JsonStore(MetadataStore):
+    """ Stores every kind of metadata in its own json file in the upload
+    folder and every project's members in `<project>/project.json`.
+
+    Files are only read when their data is first used, so creating a store
+    costs nothing. Changes only mark files as dirty. Dirty files are written
+    by `flush`: called at the end of every request (see app), after every job
+    and latest `flush_delay` seconds after the first change (0: write at
+    once). Files are replaced atomically, so a crash never leaves a partial
+    file.
+
+    Several processes (gunicorn workers, job workers) may share the files:
+    `flush` holds the lock of the store and, if a dirty file was written by
+    another process meanwhile, replays this process's changes on the file's
+    current data instead of overwriting it (full writes, f.e. `store_all`,
+    merge all entries into it). Every flush touches the lock file, so
+    `refresh` only stats it to notice changes of other processes and then
+    reloads the changed files.
+    """
+    FILES = ("peaks", "num_sweeps", "tags", "all_tags", "favorites", "raw_hashes")
+
+    peaks = _JsonFile("dir_peaks")
+    num_sweeps = _JsonFile("dir_map_num_sweeps")
+    tags = _JsonFile("dir_tags")
+    all_tags = _JsonFile("dir_all_tags")
+    favorites = _JsonFile("dir_favorites")
+    raw_hashes = _JsonFile("dir_raw_hashes", optional=True)
+
+    def __init__(self, upload_folder: str, flush_delay: float = 0) -> None:
+        super().__init__(upload_folder)
+        self.flush_delay = flush_delay
+        # Path -> data (dict or list) to write on next flush and the changes
+        # made to it
+        self.dirty: Dict[str, Tuple[Dict|List, List[Callable]]] = {}
+        # Path -> stamp of the file, when this process read or wrote it
+        self.stamps: Dict[str, Tuple | None] = {}
+        # Mtime of the lock file, when changes were last picked up
+        self.stamp = _mtime(self.lock_path)
+        self.projects_stamp_path = os.path.join(upload_folder, PROJECTS_STAMP)
+        self.projects_stamp = _mtime(self.projects_stamp_path)
+        self.timer = None
+        self.dir_peaks = os.path.join(upload_folder, "peaks.json")
+        self.dir_map_num_sweeps = os.path.join(upload_folder, "num_sweeps.json")
+        self.dir_tags = os.path.join(upload_folder, "tags.json")
+        self.dir_all_tags = os.path.join(upload_folder, "all_tags.json")
+        self.dir_favorites = os.path.join(upload_folder, "favorites.json")
+        self.dir_raw_hashes = os.path.join(upload_folder, "raw_hashes.json")
+        self.load()
+
+    def load(self) -> None:
+        """ (Re-)Reads all files on next access """
+        with self.lock:
+            for name in self.FILES:
+                setattr(self, name, None)
+            self.version += 1
+            self.tags_version += 1
+
+    def refresh(self) -> bool:
+        if _mtime(self.lock_path) == self.stamp:
+            return False
+        with self.lock:
+            return self._pick_up_changes()
+
+    def flush(self) -> None:
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not self.dirty:
+                return
+            with self.locked(), span("store.flush"):
+                self._pick_up_changes()
+                merged = False
+                for path, (data, changes) in self.dirty.items():
+                    if _stamp(path) != self.stamps.get(path):
+                        # Written by another process: apply own changes to its data
+                        current = _load(path, type(data)())
+                        for change in changes:
+                            change(current)
+                        _assign(data, current)
+                        merged = True
+                        if path == self.dir_tags:
+                            self.tags_version += 1
+                    self.stamps[path] = _dump(path, data)
+                self.dirty.clear()
+                self._touch()
+                if merged:
+                    self.version += 1
+
+    def projects_changed(self) -> None:
+        with self.locked():
+            _touch_file(self.projects_stamp_path)
+            self.projects_stamp = _mtime(self.projects_stamp_path)
+            self._touch()
+
+    def project_changed(self, project) -> bool:
+        path = project.project_file
+        with self.lock:
+            return path not in self.dirty and _stamp(path) != self.stamps.get(path)
+
+    def store_all(self) -> None:
+        with self.lock:
+            # All recorded before flushing: a flush may unload unchanged files
+            for name in self.FILES:
+                path = getattr(self, getattr(type(self), name).path_attr)
+                self._record(path, getattr(self, name))
+            self._schedule_flush()
+
+    def load_project(self, project) -> List[str]:
+        path = project.project_file
+        with self.lock:
+            if path in self.dirty:
+                # Pending changes are kept (merged with other processes' on flush)
+                return self.dirty[path][0]
+            stamp = _stamp(path)
+            if stamp is not None:
+                self.stamps[path] = stamp
+                return _load(path, [])
+        with self.locked():
+            self.stamps[path] = _stamp(path)
+            if self.stamps[path] is not None:
+                return _load(path, [])
+            self.stamps[path] = _dump(path, [])
+            return []
+
+    def project_added(self, project, analysis: str) -> None:
+        self._mark_dirty(
+            project.project_file, project.analysis,
+            lambda members: _add_unique(members, analysis)
+        )
+
+    def project_removed(self, project, analysis: str) -> None:
+        self._mark_dirty(
+            project.project_file, project.analysis,
+            lambda members: _remove(members, analysis)
+        )
+
+    def store_project(self, project) -> None:
+        self._mark_dirty(project.project_file, project.analysis)
+
+    def rename_project(self, cur_name: str, new_name: str) -> None:
+        # Pending changes would recreate the moved project's directory
+        self.flush()
+
+    def del_project(self, name: str) -> None:
+        self.flush()
+
+    def _pick_up_changes(self) -> bool:
+        """ Unloads files written by other processes since the last call
+        (files with pending changes are merged by `flush`)
+        """
+        stamp = _mtime(self.lock_path)
+        if stamp == self.stamp:
+            return False
+        self.stamp = stamp
+        for name in self.FILES:
+            path = getattr(self, getattr(type(self), name).path_attr)
+            if self.__dict__.get(f"_{name}") is None or path in self.dirty:
+                continue
+            if _stamp(path) != self.stamps.get(path):
+                setattr(self, name, None)
+                if name == "tags":
+                    self.tags_version += 1
+        projects_stamp = _mtime(self.projects_stamp_path)
+        if projects_stamp != self.projects_stamp:
+            self.projects_stamp = projects_stamp
+            self.projects_version += 1
+        # Members of projects may have changed as well (see `project_changed`)
+        self.version += 1
+        return True
+
+    def _touch(self) -> None:
+        """ Sets a new mtime of the lock file (while `locked`) """
+        mtime = time.time_ns()
+        if self.stamp is not None and mtime <= self.stamp:
+            mtime = self.stamp + 1
+        os.utime(self.lock_path, ns=(mtime, mtime))
+        self.stamp = _mtime(self.lock_path)
+
+    def _mark_dirty(self, path: str, data: Dict|List, change: Callable | None = None) -> None:
+        self._record(path, data, change)
+        self._schedule_flush()
+
+    def _record(self, path: str, data: Dict|List, change: Callable | None = None) -> None:
+        """ Marks `data` (stored in `path`) as changed by `change` (applied
+        to the data, None: all entries of data changed)
+        """
+        with self.lock:
+            if change is None:
+                # Merged into the data of other processes (not replacing it)
+                change = lambda current: _merge(current, data)  # noqa: E731
+            self.dirty.setdefault(path, (data, []))[1].append(change)
+
+    def _schedule_flush(self) -> None:
+        with self.lock:
+            if self.flush_delay <= 0:
+                self.flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.flush_delay, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def _mark_key(self, path: str, data: Dict, key: str) -> None:
+        """ Marks `key` of `data` (stored in `path`) as changed """
+        if key in data:
+            value = data[key]
+            self._mark_dirty(path, data, lambda d: d.__setitem__(key, value))
+        else:
+            self._mark_dirty(path, data, lambda d: d.pop(key, None))
+
+    def _tag_added(self, entry_id: str, tag: str) -> None:
+        self._record(
+            self.dir_tags, self.tags,
+            lambda tags: _add_unique(tags.setdefault(entry_id, []), tag)
+        )
+        self._record(
+            self.dir_all_tags, self.all_tags, lambda all_tags: _add_unique(all_tags, tag)
+        )
+        self._schedule_flush()
+
+    def _tag_removed(self, entry_id: str, tag: str) -> None:
+        self._mark_dirty(
+            self.dir_tags, self.tags, lambda tags: _remove(tags.get(entry_id, []), tag)
+        )
+
+    def _num_sweeps_changed(self, path: str) -> None:
+        self._mark_key(self.dir_map_num_sweeps, self.num_sweeps, path)
+
+    def _favorite_changed(self, name: str) -> None:
+        self._mark_key(self.dir_favorites, self.favorites, name)
+
+    def _peaks_changed(self, key: str) -> None:
+        self._mark_key(self.dir_peaks, self.peaks, key)
+
+    def _raw_hash_changed(self, digest: str) -> None:
+        self._mark_key(self.dir_raw_hashes, self.raw_hashes, digest)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tags (entry TEXT NOT NULL, tag TEXT NOT NULL, PRIMARY KEY (entry, tag));
+CREATE INDEX IF NOT EXISTS tags_tag ON tags (tag);
+CREATE TABLE IF NOT EXISTS all_tags (tag TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS favorites (name TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS num_sweeps (path TEXT PRIMARY KEY, num INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS peaks (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS raw_hashes (hash TEXT PRIMARY KEY, path TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS projects (name TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS project_analysis (
+    project TEXT NOT NULL REFERENCES projects (name) ON UPDATE CASCADE ON DELETE CASCADE,
+    analysis TEXT NOT NULL,
+    PRIMARY KEY (project, analysis)
+);
+CREATE INDEX IF NOT EXISTS project_analysis_analysis ON project_analysis (analysis);
+CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+"""
+
+
+class SqliteStore(MetadataStore):
+    """ Stores all metadata in one sqlite database (`<upload_folder>/
+    metadata.sqlite`, WAL-mode). Every mutation is a single row update, so
+    concurrent processes (f.e. gunicorn workers) never overwrite each
+    other's changes. The in-memory data is reloaded, when another process
+    committed changes (`PRAGMA data_version`).
+    """
+    def __init__(self, upload_folder: str, dir_projects: str) -> None:
+        super().__init__(upload_folder)
+        self.path = os.path.join(upload_folder, "metadata.sqlite")
+        self.dir_projects = dir_projects
+        self.connection = None
+        self.pid = None
+        # Project -> members and `projects_changed` counter of the last load
+        self.members: Dict[str, List[str]] = {}
+        self.projects_counter = None
+        # The database is opened (its schema created, if missing) and data
+        # loaded on first `refresh`: creating a store writes nothing
+        self.schema_created = False
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        # A connection must not be used by forked processes (f.e. gunicorn
+        # workers of a preloaded app): every process opens its own
+        if self.pid != os.getpid():
+            self.connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute("PRAGMA foreign_keys=ON")
+            if not self.schema_created:
+                self.connection.executescript(_SCHEMA)
+                self.schema_created = True
+            self.pid = os.getpid()
+            # Data versions are per connection: reload on next refresh
+            self.data_version = None
+        return self.connection
+
+    def refresh(self) -> bool:
+        with self.lock:
+            data_version = self.db.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self.data_version:
+                return False
+            self.data_version = data_version
+            self.load()
+            return True
+
+    def load(self) -> None:
+        with self.lock, span("store.load"):
+            tags = {}
+            for entry, tag in self.db.execute("SELECT entry, tag FROM tags ORDER BY rowid"):
+                tags.setdefault(entry, []).append(tag)
+            if tags != self.tags:
+                self.tags = tags
+                self.tags_version += 1
+            self.all_tags = [
+                tag for tag, in self.db.execute("SELECT tag FROM all_tags ORDER BY rowid")
+            ]
+            self.favorites = {
+                name: True for name, in self.db.execute("SELECT name FROM favorites")
+            }
+            self.num_sweeps = dict(self.db.execute("SELECT path, num FROM num_sweeps"))
+            self.peaks = {
+                key: json.loads(value)
+                for key, value in self.db.execute("SELECT key, value FROM peaks")
+            }
+            self.raw_hashes = dict(self.db.execute("SELECT hash, path FROM raw_hashes"))
+            members = {}
+            for project, analysis in self.db.execute(
+                "SELECT project, analysis FROM project_analysis ORDER BY rowid"
+            ):
+                members.setdefault(project, []).append(analysis)
+            self.members = members
+            counter = self._projects_counter()
+            if counter != self.projects_counter:
+                self.projects_counter = counter
+                self.projects_version += 1
+            self.version += 1
+
+    def store_all(self) -> None:
+        # Merged like by the json store: rows of other processes are kept
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO tags (entry, tag) VALUES (?, ?)",
+                [(entry, tag) for entry, tags in self.tags.items() for tag in tags]
+            )
+            self.db.executemany(
+                "INSERT OR IGNORE INTO all_tags (tag) VALUES (?)",
+                [(tag,) for tag in self.all_tags]
+            )
+            self.db.executemany(
+                "INSERT OR IGNORE INTO favorites (name) VALUES (?)",
+                [(name,) for name in self.favorites]
+            )
+            self.db.executemany(
+                "INSERT OR REPLACE INTO num_sweeps (path, num) VALUES (?, ?)",
+                self.num_sweeps.items()
+            )
+            self.db.executemany(
+                "INSERT OR REPLACE INTO peaks (key, value) VALUES (?, ?)",
+                [(key, json.dumps(value)) for key, value in self.peaks.items()]
+            )
+            self.db.executemany(
+                "INSERT OR REPLACE INTO raw_hashes (hash, path) VALUES (?, ?)",
+                self.raw_hashes.items()
+            )
+
+    def load_project(self, project) -> List[str]:
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR IGNORE INTO projects (name) VALUES (?)", (project.name,)
+            )
+            return [
+                analysis for analysis, in self.db.execute(
+                    "SELECT analysis FROM project_analysis WHERE project = ? ORDER BY rowid",
+                    (project.name,)
+                )
+            ]
+
+    def project_added(self, project, analysis: str) -> None:
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR IGNORE INTO project_analysis (project, analysis) VALUES (?, ?)",
+                (project.name, analysis)
+            )
+
+    def project_removed(self, project, analysis: str) -> None:
+        with self.lock, self.db:
+            self.db.execute(
+                "DELETE FROM project_analysis WHERE project = ? AND analysis = ?",
+                (project.name, analysis)
+            )
+
+    def store_project(self, project) -> None:
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR IGNORE INTO projects (name) VALUES (?)", (project.name,)
+            )
+            self.db.executemany(
+                "INSERT OR IGNORE INTO project_analysis (project, analysis) VALUES (?, ?)",
+                [(project.name, analysis) for analysis in project.analysis]
+            )
+
+    def projects_changed(self) -> None:
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT INTO counters (name, value) VALUES ('projects', 1) "
+                "ON CONFLICT (name) DO UPDATE SET value = value + 1"
+            )
+            # Own changes do not change the data version
+            self.projects_counter = self._projects_counter()
+
+    def project_changed(self, project) -> bool:
+        with self.lock:
+            return self.members.get(project.name, []) != project.analysis
+
+    def rename_project(self, cur_name: str, new_name: str) -> None:
+        # Sub-projects are moved with their parent
+        with self.lock, self.db:
+            self.db.execute(
+                "UPDATE projects SET name = ? || substr(name, ?) WHERE name = ? OR name LIKE ? ESCAPE '\\'",
+                (new_name, len(cur_name)+1, cur_name, _like_prefix(cur_name))
+            )
+
+    def del_project(self, name: str) -> None:
+        with self.lock, self.db:
+            self.db.execute(
+                "DELETE FROM projects WHERE name = ? OR name LIKE ? ESCAPE '\\'",
+                (name, _like_prefix(name))
+            )
+
+    def import_json(self, upload_folder: str) -> None:
+        """ Imports metadata of the json store (and all projects' members).
+        Existing rows are kept, imported rows added.
+        """
+        json_store = JsonStore(upload_folder)
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO tags (entry, tag) VALUES (?, ?)",
+                [(entry, tag) for entry, tags in json_store.tags.items() for tag in tags]
+            )
+            self.db.executemany(
+                "INSERT OR IGNORE INTO all_tags (tag) VALUES (?)",
+                [(tag,) for tag in json_store.all_tags]
+            )
+            self.db.executemany(
+                "INSERT OR IGNORE INTO favorites (name) VALUES (?)",
+                [(name,) for name in json_store.favorites]
+            )
+            self.db.executemany(
+                "INSERT OR REPLACE INTO num_sweeps (path, num) VALUES (?, ?)",
+                json_store.num_sweeps.items()
+            )
+            self.db.executemany(
+                "INSERT OR REPLACE INTO peaks (key, value) VALUES (?, ?)",
+                [(key, json.dumps(value)) for key, value in json_store.peaks.items()]
+            )
+            self.db.executemany(
+                "INSERT OR REPLACE INTO raw_hashes (hash, path) VALUES (?, ?)",
+                json_store.raw_hashes.items()
+            )
+            for root, _, files in os.walk(self.dir_projects):
+                if ANALYSIS_INIT not in files:
+                    continue
+                name = os.path.relpath(root, self.dir_projects)
+                with open(os.path.join(root, ANALYSIS_INIT), "r") as f:
+                    members = json.load(f)
+                self.db.execute("INSERT OR IGNORE INTO projects (name) VALUES (?)", (name,))
+                self.db.executemany(
+                    "INSERT OR IGNORE INTO project_analysis (project, analysis) VALUES (?, ?)",
+                    [(name, analysis) for analysis in members]
+                )
+        self.load()
+
+    def _projects_counter(self) -> int:
+        row = self.db.execute("SELECT value FROM counters WHERE name = 'projects'").fetchone()
+        return row[0] if row else 0
+
+    def _tag_added(self, entry_id: str, tag: str) -> None:
+        with self.lock, self.db:
+            self.db.execute("INSERT OR IGNORE INTO all_tags (tag) VALUES (?)", (tag,))
+            self.db.execute(
+                "INSERT OR IGNORE INTO tags (entry, tag) VALUES (?, ?)", (entry_id, tag)
+            )
+
+    def _tag_removed(self, entry_id: str, tag: str) -> None:
+        with self.lock, self.db:
+            self.db.execute(
+                "DELETE FROM tags WHERE entry = ? AND tag = ?", (entry_id, tag)
+            )
+
+    def _num_sweeps_changed(self, path: str) -> None:
+        with self.lock, self.db:
+            if path in self.num_sweeps:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO num_sweeps (path, num) VALUES (?, ?)",
+                    (path, self.num_sweeps[path])
+                )
+            else:
+                self.db.execute("DELETE FROM num_sweeps WHERE path = ?", (path,))
+
+    def _favorite_changed(self, name: str) -> None:
+        with self.lock, self.db:
+            if name in self.favorites:
+                self.db.execute("INSERT OR IGNORE INTO favorites (name) VALUES (?)", (name,))
+            else:
+                self.db.execute("DELETE FROM favorites WHERE name = ?", (name,))
+
+    def _peaks_changed(self, key: str) -> None:
+        with self.lock, self.db:
+            if key in self.peaks:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO peaks (key, value) VALUES (?, ?)",
+                    (key, json.dumps(self.peaks[key]))
+                )
+            else:
+                self.db.execute("DELETE FROM peaks WHERE key = ?", (key,))
+
+    def _raw_hash_changed(self, digest: str) -> None:
+        with self.lock, self.db:
+            if digest in self.raw_hashes:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO raw_hashes (hash, path) VALUES (?, ?)",
+                    (digest, self.raw_hashes[digest])
+                )
+            else:
+                self.db.execute("DELETE FROM raw_hashes WHERE hash = ?", (digest,))
+
+
+def _dump(path: str, data) -> Tuple:
+    """ Writes data and returns the stamp of the written file """
+    # Write to temporary file and rename, so readers never see partial data
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+    return _stamp(path)
+
+
+def _load(path: str, default):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def _stamp(path: str) -> Tuple | None:
+    """ Changes, whenever the file is replaced (None: missing) """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+
+
+def _mtime(path: str) -> int | None:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _touch_file(path: str) -> None:
+    with open(path, "a"):
+        pass
+    os.utime(path)
+
+
+def _merge(current: Dict|List, data: Dict|List) -> None:
+    """ Adds all entries of `data` to `current` (entries only in `current`
+    are kept)
+    """
+    if isinstance(current, dict):
+        current.update(data)
+    else:
+        for value in data:
+            _add_unique(current, value)
+
+
+def _assign(data: Dict|List, current: Dict|List) -> None:
+    """ Replaces the content of `data` in place (it is referenced by the
+    store and by projects)
+    """
+    if isinstance(data, dict):
+        data.clear()
+        data.update(current)
+    else:
+        data[:] = current
+
+
+def _add_unique(values: List, value) -> None:
+    if value not in values:
+        values.append(value)
+
+
+def _remove(values: List, value) -> None:
+    if value in values:
+        values.remove(value)
+
+
+def _like_prefix(name: str) -> str:
+    escaped = name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"{escaped}/%"
@@ -0,0 +1,54 @@
+from typing import Dict, List, Set
+
+GRAM_SIZE = 3
+
+
+class TagIndex:
+    """ Inverted index of tags: tag -> ids of tagged entries (the paths used
+    as keys in `DManager.tags`) and trigram -> tags, so tags containing a
+    search term are found without scanning every tag.
+    """
+    def __init__(self, tags: Dict[str, List[str]]) -> None:
+        self.entries: Dict[str, Set[str]] = {}
+        self.grams: Dict[str, Set[str]] = {}
+        for entry_id, entry_tags in tags.items():
+            for tag in entry_tags:
+                self.add(entry_id, tag)
+
+    def add(self, entry_id: str, tag: str) -> None:
+        if tag not in self.entries:
+            self.entries[tag] = set()
+            for gram in _grams(tag):
+                self.grams.setdefault(gram, set()).add(tag)
+        self.entries[tag].add(entry_id)
+
+    def remove(self, entry_id: str, tag: str) -> None:
+        if tag not in self.entries:
+            return
+        self.entries[tag].discard(entry_id)
+        if len(self.entries[tag]) == 0:
+            del self.entries[tag]
+            for gram in _grams(tag):
+                self.grams[gram].discard(tag)
+                if len(self.grams[gram]) == 0:
+                    del self.grams[gram]
+
+    def matching_tags(self, term: str) -> Set[str]:
+        """ All tags containing `term` """
+        if len(term) < GRAM_SIZE:
+            candidates = self.entries.keys()
+        else:
+            postings = [self.grams.get(gram, set()) for gram in _grams(term)]
+            candidates = set.intersection(*postings)
+        return {tag for tag in candidates if term in tag}
+
+    def search(self, term: str) -> Set[str]:
+        """ Ids of all entries with a tag containing `term` """
+        entry_ids = set()
+        for tag in self.matching_tags(term):
+            entry_ids |= self.entries[tag]
+        return entry_ids
+
+
+def _grams(text: str) -> Set[str]:
+    return {text[i:i+GRAM_SIZE] for i in range(len(text)-GRAM_SIZE+1)}
@@ -0,0 +1,97 @@
+import io
+import json
+import os
+import time
+import zipfile
+from dataclasses import dataclass
+from typing import Iterator, List
+
+import numpy as np
+
+CHUNK_SIZE = 1 << 20
+# Deflating these again only costs time
+STORED_EXTS = (".png", ".jpg", ".npz", ".zip", ".gz")
+# Members of unknown size above this may exceed 4 GiB once written
+_ZIP64_SIZE = 1 << 30
+
+
+@dataclass
+class Member:
+    """ File of a zip archive: copied from `path`, or `data` if given. With
+    `npy` the (json) sweep-selection at `path` is converted to a numpy array.
+    """
+    arcname: str
+    path: str | None = None
+    data: bytes | None = None
+    npy: bool = False
+
+
+def stream_zip(members: List[Member]) -> Iterator[bytes]:
+    """ Yields a zip archive of the given members while it is written, so
+    neither the archive nor a whole member is ever held in memory.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w") as zip_file:
+        for member in members:
+            for _ in _write_member(zip_file, member):
+                yield sink.drain()
+    yield sink.drain()
+
+
+def sweeps_array(path: str) -> np.ndarray:
+    """ Sweeps of a sweep-selection as (sweeps x samples) array. Shorter
+    sweeps are padded with nan.
+    """
+    with open(path, "r") as f:
+        sweeps = json.load(f)
+    num_samples = max((len(sweep) for sweep in sweeps), default=0)
+    data = np.full((len(sweeps), num_samples), np.nan)
+    for index, sweep in enumerate(sweeps):
+        data[index, :len(sweep)] = sweep
+    return data
+
+
+def _write_member(zip_file: zipfile.ZipFile, member: Member) -> Iterator[None]:
+    info = zipfile.ZipInfo(member.arcname, date_time=_date_time(member.path))
+    info.compress_type = (
+        zipfile.ZIP_STORED if member.arcname.endswith(STORED_EXTS)
+        else zipfile.ZIP_DEFLATED
+    )
+    size = os.path.getsize(member.path) if member.path else len(member.data or b"")
+    with zip_file.open(info, "w", force_zip64=size > _ZIP64_SIZE) as f:
+        if member.data is not None:
+            f.write(member.data)
+        elif member.npy:
+            np.save(f, sweeps_array(member.path))
+        else:
+            with open(member.path, "rb") as source:
+                while chunk := source.read(CHUNK_SIZE):
+                    f.write(chunk)
+                    yield
+    yield
+
+
+def _date_time(path: str | None):
+    if path is None:
+        return time.localtime()[:6]
+    return time.localtime(os.path.getmtime(path))[:6]
+
+
+class _Sink(io.RawIOBase):
+    """ Write-only (not seekable) stream collecting written bytes until
+    drained. zipfile then writes sizes after each member's data.
+    """
+    def __init__(self) -> None:
+        self.chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self.chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
@@ -0,0 +1,109 @@
+import struct
+from dataclasses import dataclass
+from typing import Iterator, Tuple
+
+import numpy as np
+
+from sweepstore import SweepWriter, SweepsHeader
+
+# Igor binary wave layout (Igor Technical Note 003): a binary header, a wave
+# header and the wave data. Multi-dimensional data is stored column-major,
+# i.e. every column (sweep) of a (samples x sweeps) wave is one contiguous
+# block, so sweeps can be read one after another without transposing.
+_BIN_HEADER_SIZE = {1: 8, 2: 16, 3: 20, 5: 64}
+_WAVE_HEADER2_SIZE = 110
+_WAVE_HEADER5_SIZE = 320
+
+# Igor number types (NT_UNSIGNED: 0x40 added to integer types)
+_TYPES = {
+    2: np.float32,
+    4: np.float64,
+    0x08: np.int8,
+    0x10: np.int16,
+    0x20: np.int32,
+    0x48: np.uint8,
+    0x50: np.uint16,
+    0x60: np.uint32,
+}
+
+# Sweeps read (and written) at once: limits memory to a few sweeps
+_BLOCK_SIZE = 1 << 23
+
+
+@dataclass
+class WaveInfo:
+    version: int
+    dtype: np.dtype
+    num_samples: int
+    num_sweeps: int
+    interval: float
+    data_offset: int
+
+
+class UnsupportedWave(ValueError):
+    """ Wave layout (complex, text or more than 2 dimensions) not streamable """
+
+
+def read_wave_info(path: str) -> WaveInfo:
+    """ Reads headers of an igor binary wave (versions 1, 2, 3 and 5) """
+    with open(path, "rb") as f:
+        head = f.read(_BIN_HEADER_SIZE[5] + _WAVE_HEADER5_SIZE)
+    # Version is a short: a leading zero byte means big-endian
+    order = ">" if head[0] == 0 else "<"
+    version = struct.unpack_from(f"{order}h", head, 0)[0]
+    if version not in _BIN_HEADER_SIZE:
+        raise UnsupportedWave(f"Unknown igor binary wave version: {version}")
+    offset = _BIN_HEADER_SIZE[version]
+    if version == 5:
+        num_points, wave_type = struct.unpack_from(f"{order}ih", head, offset + 12)
+        dims = struct.unpack_from(f"{order}4i", head, offset + 68)
+        interval = struct.unpack_from(f"{order}d", head, offset + 84)[0]
+        data_offset = offset + _WAVE_HEADER5_SIZE
+    else:
+        wave_type = struct.unpack_from(f"{order}h", head, offset)[0]
+        num_points = struct.unpack_from(f"{order}i", head, offset + 42)[0]
+        interval = struct.unpack_from(f"{order}d", head, offset + 48)[0]
+        dims = (num_points, 0, 0, 0)
+        data_offset = offset + _WAVE_HEADER2_SIZE
+    if wave_type not in _TYPES:
+        raise UnsupportedWave(f"Unsupported igor wave type: {wave_type}")
+    if dims[2] > 0:
+        raise UnsupportedWave(f"Unsupported igor wave dimensions: {dims}")
+    num_sweeps = max(dims[1], 1)
+    if dims[0] * num_sweeps != num_points:
+        raise UnsupportedWave(f"Inconsistent igor wave size: {dims}, {num_points}")
+    return WaveInfo(
+        version=version,
+        dtype=np.dtype(_TYPES[wave_type]).newbyteorder(order),
+        num_samples=dims[0],
+        num_sweeps=num_sweeps,
+        interval=interval,
+        data_offset=data_offset,
+    )
+
+
+def iter_sweeps(path: str, info: WaveInfo) -> Iterator[np.ndarray]:
+    """ Yields blocks (sweeps x samples) of consecutive sweeps, read
+    directly from the file
+    """
+    per_block = max(_BLOCK_SIZE // max(info.num_samples * info.dtype.itemsize, 1), 1)
+    with open(path, "rb") as f:
+        f.seek(info.data_offset)
+        for start in range(0, info.num_sweeps, per_block):
+            num = min(per_block, info.num_sweeps - start)
+            block = np.fromfile(f, dtype=info.dtype, count=num * info.num_samples)
+            if len(block) != num * info.num_samples:
+                raise ValueError(f"Truncated igor binary wave: {path}")
+            yield block.reshape(num, info.num_samples)
+
+
+def ibw_to_sweeps(path: str, sweeps_path: str) -> Tuple[SweepsHeader, WaveInfo]:
+    """ Streams all sweeps (columns) of an igor binary wave into a binary
+    sweeps file. Floats keep their precision, integers are stored as float64.
+    """
+    info = read_wave_info(path)
+    dtype = info.dtype if info.dtype.kind == "f" else np.float64
+    with SweepWriter(sweeps_path, info.num_samples, info.interval, dtype) as writer:
+        for block in iter_sweeps(path, info):
+            writer.write(block)
+    return writer.header, info
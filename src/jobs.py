@@ -0,0 +1,367 @@
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, List
+
+from utils import ensure_dir_exists
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, run a single process only
+    fcntl = None
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Held (advisory lock) by the one server process doing the startup work
+LEADER_LOCK = "startup.lock"
+# Finished jobs are removed after a day (on the next submit or restart)
+JOB_RETENTION = 24*3600
+# Workers are never forked from the (multi-threaded) server process: a fork
+# would inherit locks held by other threads (render, catalog, metadata)
+MP_CONTEXT = (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+# Service of the current worker process (see `_init_worker`)
+_service = None
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    args: Dict
+    state: str = QUEUED
+    progress: int = 0
+    total: int = 0
+    msg: str = ""
+    msg_type: str = ""
+    pid: int | None = None
+    created: float = field(default_factory=time.time)
+    updated: float = field(default_factory=time.time)
+
+    @property
+    def finished(self) -> bool:
+        return self.state in (DONE, FAILED)
+
+
+class JobQueue:
+    """ Runs long running service calls (analysis, unpacking, peaks) in a
+    process pool. The state of every job is persisted as
+    `<upload_folder>/jobs/<id>.json`, so it can be polled from any process
+    and survives restarts. The worker running a job holds its claim
+    (`<id>.json.claim`, with the pid of the worker).
+    """
+    def __init__(
+        self, upload_folder: str, workers: int = 2, service_options: Dict | None = None
+    ) -> None:
+        self.upload_folder = upload_folder
+        # Keyword arguments for the Service of each worker process
+        self.service_options = service_options or {}
+        self.dir_jobs = os.path.join(upload_folder, "jobs")
+        ensure_dir_exists(f"{self.dir_jobs}/")
+        self.workers = workers
+        self.executor = None
+        self.lock = threading.Lock()
+        self.leader_file = None
+        # Called (in this process) with every finished job
+        self.listeners: List[Callable[[Job], None]] = []
+
+    def submit(self, kind: str, **args) -> str:
+        """ Enqueues a job and returns its id. `args` must be json
+        serializable (see TASKS for kinds and arguments)
+        """
+        if kind not in TASKS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        self.prune()
+        job = Job(uuid.uuid4().hex, kind, args)
+        _store_job(self.dir_jobs, job)
+        self._enqueue(job)
+        return job.id
+
+    def get(self, job_id: str) -> Job | None:
+        return _load_job(self.dir_jobs, job_id)
+
+    def recover(self) -> List[str]:
+        """ Handles jobs of a previous run of the server: queued jobs are
+        enqueued again, jobs that were claimed or running in a no longer
+        existing process are marked as failed. Returns ids of resumed jobs.
+        """
+        self.prune()
+        resumed = []
+        for job in self._jobs():
+            if job.finished:
+                continue
+            claimed = os.path.exists(_claim_path(self.dir_jobs, job.id))
+            if claimed or job.state == RUNNING:
+                pid = job.pid if job.state == RUNNING else _claim_pid(self.dir_jobs, job.id)
+                if not _pid_alive(pid):
+                    _update_job(
+                        self.dir_jobs, job, state=FAILED, msg_type="danger",
+                        msg="Job interrupted by server restart. Please try again."
+                    )
+                    _remove(_claim_path(self.dir_jobs, job.id))
+            else:
+                self._enqueue(job)
+                resumed.append(job.id)
+        return resumed
+
+    def lead(self) -> bool:
+        """ Whether this process does the startup work (`recover`, backfills).
+        Only one server process (f.e. of several gunicorn workers) does,
+        holding a lock of `jobs/startup.lock` as long as it lives.
+        """
+        if self.leader_file is not None or fcntl is None:
+            return True
+        f = open(os.path.join(self.dir_jobs, LEADER_LOCK), "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self.leader_file = f
+        return True
+
+    def prune(self, max_age: float = JOB_RETENTION) -> int:
+        """ Removes finished jobs (and their claims) older than `max_age`
+        seconds. Returns the number of removed jobs.
+        """
+        removed = 0
+        for job in self._jobs():
+            if job.finished and time.time() - job.updated > max_age:
+                _remove(_claim_path(self.dir_jobs, job.id))
+                _remove(_job_path(self.dir_jobs, job.id))
+                removed += 1
+        return removed
+
+    def shutdown(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+
+    def _jobs(self) -> List[Job]:
+        jobs = []
+        for filename in os.listdir(self.dir_jobs):
+            if filename.endswith(".json"):
+                job = _load_job(self.dir_jobs, filename[:-len(".json")])
+                if job is not None:
+                    jobs.append(job)
+        return jobs
+
+    def _enqueue(self, job: Job) -> None:
+        with self.lock:
+            try:
+                executor = self._executor()
+                future = executor.submit(_run_job, self.dir_jobs, job.id)
+            except BrokenProcessPool:
+                # A worker died while the pool was idle
+                self.executor = None
+                executor = self._executor()
+                future = executor.submit(_run_job, self.dir_jobs, job.id)
+        future.add_done_callback(lambda f: self._notify(job.id, f, executor))
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(MP_CONTEXT),
+                initializer=_init_worker,
+                initargs=(self.upload_folder, self.service_options)
+            )
+        return self.executor
+
+    def _notify(self, job_id: str, future: Future, executor: ProcessPoolExecutor) -> None:
+        """ Calls the listeners, if the job was run (or failed) in this
+        process, not if another process claimed it
+        """
+        error = future.exception()
+        if error is None and not future.result():
+            return
+        job = self.get(job_id)
+        if job is None:
+            return
+        if error is not None and not job.finished:
+            if isinstance(error, BrokenProcessPool):
+                # A worker died (f.e. killed): a new pool is started, jobs
+                # that did not start yet are run there
+                with self.lock:
+                    if self.executor is executor:
+                        self.executor = None
+                executor.shutdown(wait=False)
+                claimed = os.path.exists(_claim_path(self.dir_jobs, job_id))
+                if claimed and _pid_alive(_claim_pid(self.dir_jobs, job_id)):
+                    # Run by another process
+                    return
+                if job.state == QUEUED and not claimed:
+                    self._enqueue(job)
+                    return
+            print(f"Job {job_id} ({job.kind}) failed: {repr(error)}")
+            _update_job(
+                self.dir_jobs, job, state=FAILED, msg_type="danger",
+                msg=f"Failed: {repr(error)}"
+            )
+            _remove(_claim_path(self.dir_jobs, job_id))
+        for listener in self.listeners:
+            try:
+                listener(job)
+            except Exception as e:
+                print(f"Job listener failed for {job_id}: {repr(e)}")
+
+
+def _init_worker(upload_folder: str, service_options: Dict) -> None:
+    global _service
+    from service import Service
+    _service = Service(upload_folder, **service_options)
+
+
+def _run_job(dir_jobs: str, job_id: str) -> bool:
+    """ Runs a job, unless it is claimed by another process or finished
+    already. Returns whether it was run.
+    """
+    # Claim job, so it is never run twice (f.e. when resumed by two processes)
+    if not _claim(dir_jobs, job_id):
+        return False
+    job = _load_job(dir_jobs, job_id)
+    if job is None or job.finished:
+        _remove(_claim_path(dir_jobs, job_id))
+        return False
+    _update_job(dir_jobs, job, state=RUNNING, pid=os.getpid())
+
+    def progress(done: int, total: int) -> None:
+        _update_job(dir_jobs, job, progress=done, total=total)
+
+    try:
+        msg, msg_type = TASKS[job.kind](_service, progress, **job.args)
+        state = DONE if msg_type != "danger" else FAILED
+    except Exception as e:
+        print(f"Job {job.id} ({job.kind}) failed: {repr(e)}")
+        msg, msg_type, state = f"Failed: {repr(e)}", "danger", FAILED
+    _service.dmanager.flush()
+    _update_job(dir_jobs, job, state=state, msg=msg, msg_type=msg_type)
+    # Finished jobs are never run again
+    _remove(_claim_path(dir_jobs, job_id))
+    return True
+
+
+def _analysis_task(
+    service, progress, date, filename, opt, start, end, ylim, scalebar, decimate=True
+):
+    from dmanager.dmodels import AnalysisOpts
+    from extractor.functions import Scalebar
+    return service.do_analysis(
+        date=date,
+        filename=filename,
+        opt=AnalysisOpts(opt),
+        start=start,
+        end=end,
+        ylim=tuple(ylim) if ylim is not None else None,
+        scalebar=Scalebar(**scalebar),
+        decimate=decimate,
+        progress=progress
+    )
+
+
+def _unpack_task(service, progress, date, filename):
+    return service.unpack_raw(date, filename, progress=progress)
+
+
+def _peaks_task(service, progress, path, peaks_info):
+    from extractor.functions import Peaks
+    service.calc_peaks(path, Peaks(**peaks_info), progress=progress)
+    return ("Successfully calculated peaks!", "success")
+
+
+def _raw_hashes_task(service, progress):
+    return service.hash_raw_files(progress=progress)
+
+
+TASKS: Dict[str, Callable] = {
+    "analysis": _analysis_task,
+    "unpack": _unpack_task,
+    "peaks": _peaks_task,
+    "raw_hashes": _raw_hashes_task,
+}
+
+
+def _job_path(dir_jobs: str, job_id: str) -> str:
+    return os.path.join(dir_jobs, f"{job_id}.json")
+
+
+def _claim_path(dir_jobs: str, job_id: str) -> str:
+    return f"{_job_path(dir_jobs, job_id)}.claim"
+
+
+def _claim(dir_jobs: str, job_id: str) -> bool:
+    """ Claims a job for this process. The claim is created with the pid in
+    it (linked, fails if it exists), so a claim without a living process is
+    known to be stale.
+    """
+    tmp = f"{_claim_path(dir_jobs, job_id)}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(str(os.getpid()))
+    try:
+        os.link(tmp, _claim_path(dir_jobs, job_id))
+    except FileExistsError:
+        return False
+    finally:
+        os.remove(tmp)
+    return True
+
+
+def _claim_pid(dir_jobs: str, job_id: str) -> int | None:
+    try:
+        with open(_claim_path(dir_jobs, job_id), "r") as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _load_job(dir_jobs: str, job_id: str) -> Job | None:
+    # Job ids are generated hex strings, never accept paths
+    if not job_id.isalnum():
+        return None
+    try:
+        with open(_job_path(dir_jobs, job_id), "r") as f:
+            return Job(**json.load(f))
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def _store_job(dir_jobs: str, job: Job) -> None:
+    # Write to temporary file and rename, so pollers never see partial state
+    path = _job_path(dir_jobs, job.id)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(asdict(job), f)
+    os.replace(f"{path}.tmp", path)
+
+
+def _update_job(dir_jobs: str, job: Job, **changes) -> None:
+    for key, value in changes.items():
+        setattr(job, key, value)
+    job.updated = time.time()
+    _store_job(dir_jobs, job)
+
+
+def _pid_alive(pid: int | None) -> bool:
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
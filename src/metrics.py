@@ -0,0 +1,178 @@
+import contextvars
+import cProfile
+import functools
+import os
+import threading
+import time
+from contextlib import nullcontext
+from typing import Callable, Dict, List, Tuple
+
+# Spans are only recorded with ANALYZER_METRICS=1. Otherwise `timed` returns
+# functions as they are and `span` a shared no-op context.
+ENABLED = os.environ.get("ANALYZER_METRICS") == "1"
+# Directory for a cProfile dump of every request (ANALYZER_PROFILE=<dir>)
+PROFILE_DIR = os.environ.get("ANALYZER_PROFILE") or None
+
+# Upper bounds (seconds) of histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+SPAN_SECONDS = "analyzer_span_seconds"
+REQUEST_SECONDS = "analyzer_request_seconds"
+REQUESTS_TOTAL = "analyzer_requests_total"
+_HELP = {
+    SPAN_SECONDS: "Duration of instrumented spans (service, store, plotting)",
+    REQUEST_SECONDS: "Duration of requests per endpoint",
+    REQUESTS_TOTAL: "Requests per endpoint and status",
+}
+
+_lock = threading.Lock()
+# (metric, labels) -> bucket counts (+Inf last), sum and count
+_histograms: Dict[Tuple[str, Tuple], List] = {}
+_counters: Dict[Tuple[str, Tuple], float] = {}
+# Spans of the current request: name -> [count, seconds] (None outside requests)
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+# Only one profiler may be active per process (python >= 3.12)
+_profile_lock = threading.Lock()
+
+_NO_SPAN = nullcontext()
+
+
+class _Span:
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __enter__(self) -> "_Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        record(self.name, time.perf_counter() - self.start)
+
+
+def span(name: str):
+    """ Context measuring the duration of its block as span `name` """
+    return _Span(name) if ENABLED else _NO_SPAN
+
+
+def timed(name: str) -> Callable:
+    """ Decorator measuring every call of a function as span `name` """
+    def decorator(func: Callable) -> Callable:
+        if not ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record(name: str, seconds: float) -> None:
+    """ Adds a span to the histogram and to the spans of the current request """
+    observe(SPAN_SECONDS, seconds, span=name)
+    spans = _request_spans.get()
+    if spans is not None:
+        entry = spans.setdefault(name, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+
+def observe(metric: str, value: float, **labels) -> None:
+    key = (metric, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0]*(len(BUCKETS)+1), 0.0, 0]
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram[0][index] += 1
+                break
+        else:
+            histogram[0][-1] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+def count(metric: str, value: float = 1, **labels) -> None:
+    key = (metric, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def start_request() -> contextvars.Token:
+    """ Collects spans of the current request (until `end_request`) """
+    return _request_spans.set({})
+
+
+def end_request(token: contextvars.Token) -> Dict[str, List]:
+    """ Spans of the current request: name -> [count, seconds] """
+    spans = _request_spans.get() or {}
+    _request_spans.reset(token)
+    return spans
+
+
+def server_timing(spans: Dict[str, List], total: float) -> str:
+    """ Value of a `Server-Timing` header (durations in milliseconds) """
+    metrics = [
+        f'{name};dur={seconds*1000:.1f};desc="{num}x"'
+        for name, (num, seconds) in sorted(spans.items(), key=lambda x: -x[1][1])
+    ]
+    return ", ".join([*metrics, f"total;dur={total*1000:.1f}"])
+
+
+def prometheus() -> str:
+    """ All metrics of this process in the Prometheus text format """
+    with _lock:
+        histograms = {k: (list(v[0]), v[1], v[2]) for k, v in _histograms.items()}
+        counters = dict(_counters)
+    lines = []
+    for metric in sorted({metric for metric, _ in histograms}):
+        lines += [f"# HELP {metric} {_HELP.get(metric, metric)}", f"# TYPE {metric} histogram"]
+        for (name, labels), (buckets, total, num) in sorted(histograms.items()):
+            if name != metric:
+                continue
+            cumulative = 0
+            for bound, bucket in zip([*BUCKETS, "+Inf"], buckets):
+                cumulative += bucket
+                lines.append(f"{metric}_bucket{_labels(labels, le=bound)} {cumulative}")
+            lines.append(f"{metric}_sum{_labels(labels)} {total}")
+            lines.append(f"{metric}_count{_labels(labels)} {num}")
+    for metric in sorted({metric for metric, _ in counters}):
+        lines += [f"# HELP {metric} {_HELP.get(metric, metric)}", f"# TYPE {metric} counter"]
+        for (name, labels), value in sorted(counters.items()):
+            if name == metric:
+                lines.append(f"{metric}{_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def start_profile() -> cProfile.Profile | None:
+    """ Profiles the current request, unless another one is profiled """
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    profile = cProfile.Profile()
+    profile.enable()
+    return profile
+
+
+def stop_profile(profile: cProfile.Profile, name: str) -> str:
+    """ Stops profiling and dumps the stats (`python -m pstats <file>`) to
+    `<PROFILE_DIR>/<time>-<name>.prof`
+    """
+    profile.disable()
+    _profile_lock.release()
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{time.time_ns()}-{name}.prof")
+    profile.dump_stats(path)
+    return path
+
+
+def _labels(labels: Tuple, **extra) -> str:
+    pairs = [*labels, *extra.items()]
+    if not pairs:
+        return ""
+    escaped = [
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in pairs
+    ]
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
@@ -0,0 +1,53 @@
+""" One-shot migrations of existing data.
+
+Run from the project root (like the server), f.e.:
+    python src/migrate.py sweeps [--remove]
+    python src/migrate.py metadata
+"""
+import argparse
+import json
+import os
+
+from dmanager.stores import SqliteStore
+from sweepstore import migrate_tree
+
+with open("server.config") as f:
+    config = json.load(f)
+    UPLOAD_FOLDER = config["upload_folder"]
+
+
+def migrate_sweeps(args):
+    """ Converts all legacy `*_sweeps.json` files in `data/sweeps/<date>/` to
+    the binary sweeps format.
+    """
+    migrated = migrate_tree(os.path.join(UPLOAD_FOLDER, "sweeps"), args.remove)
+    for path in migrated:
+        print("Migrated: ", path)
+    print(f"Migrated {len(migrated)} sweeps-files.")
+
+
+def migrate_metadata(args):
+    """ Imports tags, favorites, num sweeps, peaks and project members from
+    the json files into the sqlite database (`"metadata_backend": "sqlite"`).
+    """
+    store = SqliteStore(UPLOAD_FOLDER, os.path.join(UPLOAD_FOLDER, "projects"))
+    store.import_json(UPLOAD_FOLDER)
+    print(
+        f"Imported {sum(len(x) for x in store.tags.values())} tags, "
+        f"{len(store.favorites)} favorites, {len(store.num_sweeps)} num sweeps "
+        f"and {len(store.peaks)} peaks into {store.path}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+    sweeps_parser = commands.add_parser("sweeps", help=migrate_sweeps.__doc__)
+    sweeps_parser.add_argument(
+        "--remove", action="store_true", help="remove json files after migration"
+    )
+    sweeps_parser.set_defaults(func=migrate_sweeps)
+    metadata_parser = commands.add_parser("metadata", help=migrate_metadata.__doc__)
+    metadata_parser.set_defaults(func=migrate_metadata)
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,146 @@
+import csv
+import json
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from extractor.functions import Peaks, calc_time_from_sweeps
+
+CSV_FIELDS = [
+    "source", "sweep", "window", "window_start", "window_end",
+    "min", "min_time", "max", "max_time"
+]
+
+
+def load_batch(sources: List[str]) -> List[Tuple[str, int, np.ndarray, float]]:
+    """ Loads all sweeps of the given sweep-selection files as
+    (source, sweep index, values, time per sample)
+    """
+    rows = []
+    for source in sources:
+        with open(source, "r") as f:
+            sweeps = json.load(f)
+        if len(sweeps) == 0:
+            continue
+        sample_time = calc_time_from_sweeps(sweeps) / len(sweeps[0])
+        for index, sweep in enumerate(sweeps):
+            rows.append((source, index, np.asarray(sweep, dtype=float), sample_time))
+    return rows
+
+
+def window_bounds(peaks_info: Peaks) -> np.ndarray:
+    """ (start, end) time of every interval: start + i*step + [0, interval) """
+    starts = peaks_info.start + peaks_info.step*np.arange(peaks_info.num_intervals)
+    return np.stack([starts, starts + peaks_info.interval], axis=1)
+
+
+def window_extrema(
+    data: np.ndarray, sample_time: float, peaks_info: Peaks
+) -> Dict[str, np.ndarray]:
+    """ Min and max (and their time) of every interval of every sweep.
+
+    `data` holds one sweep per row (shorter sweeps padded with nan). Interval
+    `i` are the samples `[s, s + length)` with `s = round((start + i*step) /
+    sample_time)` and `length = round(interval / sample_time)`, like in
+    `extractor.ibw.peaks` (the first sample wins on equal values). All
+    intervals are taken as strided views of the same array and reduced at
+    once, so there is no python loop over sweeps or intervals. Parts of
+    intervals beyond the end of a sweep are left out (nan, if all of it).
+    Raises ValueError for intervals starting before or after the sweeps.
+    """
+    num_samples = data.shape[1]
+    bounds = window_bounds(peaks_info)
+    starts = np.round(bounds[:, 0] / sample_time).astype(int)
+    length = max(int(round(peaks_info.interval / sample_time)), 1)
+    if len(starts) and (starts.min() < 0 or starts.max() >= num_samples):
+        raise ValueError(
+            f"Peaks intervals must start within the sweeps (0 - {num_samples*sample_time})!"
+        )
+    # Pad (by less than one interval), so every interval has `length` samples
+    pad = max(int(starts.max(initial=0)) + length - num_samples, 0)
+    padded = np.pad(data, ((0, 0), (0, pad)), constant_values=np.nan) if pad else data
+    # (sweeps, all windows, length) view, then pick the interval starts
+    windows = np.lib.stride_tricks.sliding_window_view(padded, length, axis=1)[:, starts]
+    empty = np.isnan(windows).all(axis=2)
+    filled = np.where(np.isnan(windows), np.inf, windows)
+    argmin = filled.argmin(axis=2)
+    argmax = np.where(np.isnan(windows), -np.inf, windows).argmax(axis=2)
+    rows = np.arange(data.shape[0])[:, None]
+    cols = np.arange(len(starts))[None, :]
+    result = {
+        "min": windows[rows, cols, argmin],
+        "max": windows[rows, cols, argmax],
+        "min_time": (starts[None, :] + argmin) * sample_time,
+        "max_time": (starts[None, :] + argmax) * sample_time,
+    }
+    for key in result:
+        result[key] = np.where(empty, np.nan, result[key])
+    return result
+
+
+def batch_peaks(sources: List[str], peaks_info: Peaks) -> Dict:
+    """ Applies the same peaks windows to every sweep of all sources.
+    Raises ValueError for intervals outside of the sweeps.
+    """
+    return batch_extrema(load_batch(sources), peaks_info)
+
+
+def batch_extrema(
+    rows: List[Tuple[str, int, np.ndarray, float]], peaks_info: Peaks
+) -> Dict:
+    """ Extrema of all rows (see `load_batch`). Sweeps are stacked into one
+    array per sample rate.
+    """
+    results = [None] * len(rows)
+    for sample_time in sorted({row[3] for row in rows}):
+        members = [i for i, row in enumerate(rows) if row[3] == sample_time]
+        length = max(len(rows[i][2]) for i in members)
+        data = np.full((len(members), length), np.nan)
+        for pos, i in enumerate(members):
+            data[pos, :len(rows[i][2])] = rows[i][2]
+        extrema = {
+            key: _to_list(value)
+            for key, value in window_extrema(data, sample_time, peaks_info).items()
+        }
+        for pos, i in enumerate(members):
+            results[i] = {
+                "source": rows[i][0],
+                "sweep": rows[i][1],
+                **{key: value[pos] for key, value in extrema.items()}
+            }
+    return {"windows": window_bounds(peaks_info).tolist(), "sweeps": results}
+
+
+def store_batch(directory: str, batch: Dict) -> Tuple[str, str]:
+    """ Stores a batch result as `data.json` and (one row per sweep and
+    interval) `data.csv`. Returns both paths.
+    """
+    json_path = os.path.join(directory, "data.json")
+    csv_path = os.path.join(directory, "data.csv")
+    with open(json_path, "w") as f:
+        json.dump(batch, f)
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for sweep in batch["sweeps"]:
+            for window, (start, end) in enumerate(batch["windows"]):
+                writer.writerow({
+                    "source": sweep["source"],
+                    "sweep": sweep["sweep"],
+                    "window": window,
+                    "window_start": start,
+                    "window_end": end,
+                    **{
+                        key: sweep[key][window]
+                        for key in ("min", "min_time", "max", "max_time")
+                    }
+                })
+    return json_path, csv_path
+
+
+def _to_list(values: np.ndarray) -> List:
+    # json has no nan
+    converted = values.astype(object)
+    converted[np.isnan(values)] = None
+    return converted.tolist()
@@ -0,0 +1,176 @@
+import inspect
+import json
+import os
+import threading
+from contextlib import contextmanager
+from dataclasses import asdict
+from typing import Dict, List
+
+import numpy as np
+
+from extractor.functions import Scalebar
+from metrics import span
+from thumbnails import thumbnail_path
+
+# matplotlib (also via `extractor.plotting`) is only imported when the first
+# plot is rendered: importing it takes longer than starting the server
+
+# Stored next to every plot (`{path}.plot.json`): sweep-selection file(s) and
+# plot options needed to render the plot's svg on first request.
+SPEC_EXT = ".plot.json"
+
+# Traces longer than 2*DECIMATION_BUCKETS values are reduced to the min and max
+# of each bucket before plotting. Plots are ~500 pixel columns wide, so every
+# column still gets several buckets and the rendered trace looks the same.
+DECIMATION_BUCKETS = 2000
+
+# pyplot is a global state machine: never render two plots at once from
+# different (request) threads of the same process.
+_lock = threading.Lock()
+
+
+def plot_png(
+    path: str,
+    values,
+    total_time: float,
+    sources: List[str],
+    select: str | int,
+    decimate: bool = False,
+    **kwargs
+) -> None:
+    """ Plots given data, but only stores `{path}.png`. The svg is rendered
+    on demand by `render_svg`.
+
+    `sources` are the sweep-selection files the values are built from and
+    `select` tells how: "join" (all sweeps in a row), "all" (one line per
+    sweep) or an index (single sweep). With `decimate` a single long trace
+    is reduced to its min/max envelope (also for the svg).
+    """
+    spec = {
+        "sources": sources,
+        "select": select,
+        "time": total_time,
+        "decimate": decimate,
+        "kwargs": _dump_kwargs(kwargs),
+    }
+    if decimate:
+        values = decimate_minmax(values)
+    with _lock, span("render.png"):
+        _plot(path, values, total_time, "png", kwargs)
+    with open(f"{path}{SPEC_EXT}", "w") as f:
+        json.dump(spec, f)
+    # Svg and thumbnail of an earlier plot (or an svg saved with the png) are
+    # stale: recreated from the new png and spec on demand
+    for file in (f"{path}.svg", thumbnail_path(f"{path}.png")):
+        if os.path.exists(file):
+            os.remove(file)
+
+
+def render_svg(path: str) -> bool:
+    """ Renders `{path}.svg` from the stored plot spec, if not rendered yet.
+    Returns False, if there is nothing to render the svg from.
+    """
+    if os.path.exists(f"{path}.svg"):
+        return True
+    if not os.path.exists(f"{path}{SPEC_EXT}"):
+        return False
+    with open(f"{path}{SPEC_EXT}", "r") as f:
+        spec = json.load(f)
+    with span("render.load"):
+        values = _load_values(spec["sources"], spec["select"])
+    if spec.get("decimate"):
+        values = decimate_minmax(values)
+    with _lock, span("render.svg"):
+        _plot(path, values, spec["time"], "svg", _load_kwargs(spec["kwargs"]))
+    return True
+
+
+def decimate_minmax(values, buckets: int = DECIMATION_BUCKETS):
+    """ Reduces a single trace to the min and max of `buckets` equally sized
+    buckets (in the order they occur), i.e. the envelope a line plot of the
+    full trace draws. Lists of sweeps and short traces are returned as is.
+    """
+    if len(values) <= 2*buckets or not isinstance(values[0], float):
+        return values
+    data = np.asarray(values, dtype=float)
+    size = -(-len(data) // buckets)
+    # Pad last bucket with its last value (changes neither min nor max)
+    data = np.pad(data, (0, size*buckets - len(data)), mode="edge")
+    data = data.reshape(buckets, size)
+    rows = np.arange(buckets)
+    argmin = data.argmin(axis=1)
+    argmax = data.argmax(axis=1)
+    mins = data[rows, argmin]
+    maxs = data[rows, argmax]
+    envelope = np.empty((buckets, 2))
+    envelope[:, 0] = np.where(argmin <= argmax, mins, maxs)
+    envelope[:, 1] = np.where(argmin <= argmax, maxs, mins)
+    return envelope.ravel().tolist()
+
+
+def remove_plot(path: str) -> None:
+    """ Removes the (optional) svg, thumbnail and plot spec of plot `path` """
+    for file in (f"{path}.svg", f"{path}{SPEC_EXT}", thumbnail_path(f"{path}.png")):
+        if os.path.exists(file):
+            os.remove(file)
+
+
+def _plot(path: str, values, total_time: float, fmt: str, kwargs: Dict) -> None:
+    """ Plots into `{path}.{fmt}` only: with the `formats` parameter of
+    `plot_data`, if it has one, otherwise by skipping other formats' saves
+    """
+    from extractor.plotting import plot_data
+    if "formats" in inspect.signature(plot_data).parameters:
+        plot_data(path, values, total_time, formats=(fmt,), **kwargs)
+        return
+    with _only_format(fmt):
+        plot_data(path, values, total_time, **kwargs)
+
+
+@contextmanager
+def _only_format(fmt: str):
+    """ Skips all `pyplot.savefig` calls for other formats than `fmt` """
+    from matplotlib import pyplot
+    savefig = pyplot.savefig
+
+    def savefig_filtered(fname, *args, **kwargs):
+        if kwargs.get("format", os.path.splitext(str(fname))[1][1:]) == fmt:
+            return savefig(fname, *args, **kwargs)
+
+    pyplot.savefig = savefig_filtered
+    try:
+        yield
+    finally:
+        pyplot.savefig = savefig
+
+
+def _load_values(sources: List[str], select: str | int):
+    sweeps = []
+    for source in sources:
+        with open(source, "r") as f:
+            sweeps.extend(json.load(f))
+    if select == "join":
+        from extractor.preprocessing import join_lists
+        return join_lists(sweeps)
+    if select == "all":
+        return sweeps
+    return sweeps[select]
+
+
+def _dump_kwargs(kwargs: Dict) -> Dict:
+    dumped = {}
+    for key, value in kwargs.items():
+        if key == "scalebar" and value is not None:
+            value = asdict(value)
+        elif key in ("min_peaks", "max_peaks") and value is not None:
+            value = np.asarray(value).tolist()
+        dumped[key] = value
+    return dumped
+
+
+def _load_kwargs(kwargs: Dict) -> Dict:
+    if kwargs.get("scalebar") is not None:
+        kwargs["scalebar"] = Scalebar(**kwargs["scalebar"])
+    if kwargs.get("ylim") is not None:
+        kwargs["ylim"] = tuple(kwargs["ylim"])
+    return kwargs
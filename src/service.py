@@ -1,143 +1,278 @@
 from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict
+import hashlib
 import json
 import os
 import re
 import shutil
-from typing import Dict, List, OrderedDict, Tuple
-from matplotlib.cbook import delete_masked_points
+import tempfile
+import zipfile
+from typing import IO, Dict, List, Tuple
+import numpy as np
 from werkzeug.datastructures import FileStorage
 from werkzeug.utils import secure_filename
+from catalog import ANALYSIS, CATALOG_STAMP, RAW, SWEEPS, Catalog
 from dmanager.dmanager import DManager
-from dmanager.dmodels import AnalysisOpts, Project
+from dmanager.dmodels import AnalysisOpts, Project, UploadStatus
+from dmanager.manifest import load_manifest, update_manifest
 from dmanager.models import Analysis, Sweep, Raw
+from derived import DerivedCache
+from ibwstream import UnsupportedWave, ibw_to_sweeps
+from metrics import span, timed
+import peakbatch
+from render import plot_png
 from extractor.functions import Peaks, Scalebar, calc_time_from_sweeps
-from extractor.plotting import plot_data
-from extractor.preprocessing import convert_rows_to_columns, extract_data, join_lists
-from extractor.ibw import VERSION, Selection, peaks, get_range
+# `extractor.ibw` and `extractor.preprocessing` (igor, pandas, scipy,
+# matplotlib) are imported on first use, so the server starts fast
+from sweepstore import (
+    SweepReader, index_path, is_sweeps_file, open_reader, sweeps_file, write_sweeps
+)
 from utils import ensure_dir_exists, stem
 
 type Data = Dict[str, List[Raw|Sweep]]
+type Progress = Callable[[int, int], None]
 
 ALLOWED_EXTENSIONS = {'ibw'}
 
+# Uploads are streamed to disk (and hashed) in chunks of this size
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Parameters of calculated peaks (next to their `data.json`)
+PEAKS_PARAMS = "params.json"
+
 
 class Service: 
-    def __init__(self, upload_folder) -> None:
-        self.dmanager = DManager(upload_folder)
+    def __init__(
+        self,
+        upload_folder,
+        plot_workers: int = 1,
+        metadata_backend: str = "json",
+        metadata_flush_delay: float = 0,
+        cache_size: int = 256,
+        cache_disk_size: int = 1024,
+        catalog_poll_interval: float = 10
+    ) -> None:
+        self.dmanager = DManager(upload_folder, metadata_backend, metadata_flush_delay)
+        self.plot_workers = plot_workers
         self.dir_raw = os.path.join(upload_folder, "raw")
         self.dir_sweeps = os.path.join(upload_folder, "sweeps")
         self.dir_analysis = os.path.join(upload_folder, "analysis")
+        self.dir_peaks = os.path.join(upload_folder, "peaks")
+        self.derived = DerivedCache(
+            os.path.join(upload_folder, "cache"), cache_size << 20, cache_disk_size << 20
+        )
+        self.catalog = Catalog(self.dmanager, {
+            RAW: self.dir_raw, SWEEPS: self.dir_sweeps, ANALYSIS: self.dir_analysis
+        }, os.path.join(upload_folder, CATALOG_STAMP), catalog_poll_interval)
+
+    def warm(self) -> None: 
+        """ Loads everything loaded on first use otherwise: metadata,
+        projects, the catalog and the scientific libraries (f.e. once in the
+        master process of a preloaded app, shared by all workers)
+        """
+        import extractor.ibw, extractor.plotting, extractor.preprocessing  # noqa: F401
+        from matplotlib import pyplot  # noqa: F401
+        self.dmanager.warm()
+        self.catalog.build()
+
+    def job_finished(self, kind: str, args: Dict) -> None: 
+        """ Updates in-memory state after a job (run in another process) """
+        if kind == "unpack": 
+            self.catalog.rescan(SWEEPS, args["date"])
+        elif kind == "analysis": 
+            self.catalog.rescan(ANALYSIS, args["date"])
+        elif kind == "peaks": 
+            self.cached_peaks(args["path"], Peaks(**args["peaks_info"]))
 
     def add_tag_to_entry(self, path, tag): 
-        # If tag already exists for entry, do nothing
-        if path in self.dmanager.tags and tag in self.dmanager.tags[path]:
-            return
-        # Add tag if not exists
-        if tag not in self.dmanager.all_tags: 
-            self.dmanager.all_tags.append(tag) 
-        # Add tags to entry
-        if path in self.dmanager.tags:
-            self.dmanager.tags[path].append(tag)
-        else: 
-            self.dmanager.tags[path] = [tag]
-        self.dmanager.store_tags()
+        # If tag already exists for entry, does nothing
+        self.dmanager.add_tag(path, tag)
 
     def remove_tag_from_entry(self, path, tag): 
-        if path in self.dmanager.tags: 
-            if tag in self.dmanager.tags[path]: 
-                self.dmanager.tags[path].remove(tag)
+        self.dmanager.remove_tag(path, tag)
       
+    @timed("service.get_raw")
     def get_raw(self) -> Dict[str, List[Raw]]: 
-        raw_data = {}
-        for dirpath, _, filenames in os.walk(self.dir_raw):
-            if dirpath == self.dir_raw: 
-                continue
-            relative_path = os.path.relpath(dirpath, self.dir_raw)
-            raws = [Raw(self.dmanager, relative_path, f) for f in filenames]
-            raws.sort(key=(lambda x: _get_key_num(x.filename)))
-            raw_data[relative_path] = raws
-        return OrderedDict(sorted(raw_data.items()))
+        return self.catalog.get(RAW)
 
+    @timed("service.get_sweeps")
     def get_sweeps(self) -> Dict[str, List[Sweep]]: 
-        sweeps_data = {}
-        for dirpath, _, filenames in os.walk(self.dir_sweeps):
-            if dirpath == self.dir_sweeps: 
-                continue
-            relative_path = os.path.relpath(dirpath, self.dir_sweeps)
-            sweeps = [Sweep(self.dmanager, relative_path, stem(f)) for f in filenames]
-            sweeps.sort(key=(lambda x: _get_key_num(x.name)))
-            sweeps_data[relative_path] = sweeps
-        return OrderedDict(sorted(sweeps_data.items()))
+        return self.catalog.get(SWEEPS)
 
+    @timed("service.get_analysis")
     def get_analysis(self) -> Dict[str, List[Sweep]]:  
-        sweeps_data = {}
-        for dirpath, dirs, _ in os.walk(self.dir_analysis):
-            if dirpath == self.dir_analysis or "_sweeps" in dirpath:
-                continue
-            relative_path = os.path.relpath(dirpath, self.dir_analysis)
-            sweeps = [Sweep(self.dmanager, relative_path, f) for f in dirs]
-            sweeps.sort(key=(lambda x: _get_key_num(x.name)))
-            sweeps_data[relative_path] = sweeps
-        return OrderedDict(sorted(sweeps_data.items()))
+        return self.catalog.get(ANALYSIS)
 
     def get_project_analysis_objs(self, project: Project) -> List[Analysis]: 
         return [
             Analysis(a[:a.rfind("/")], a.split("/")[4], []) for a in project.analysis
         ]
 
-    def get_searched(self, get_data_func: Callable[[], Data], tags: str) -> Data: 
-        data = get_data_func()
-        for tag in [t for t in tags.split(";") if len(t) > 0]: 
-            reduced = {} 
-            for date, xs in data.items(): 
-                reduced[date] = [x for x in xs if x.tags_match(tag)]
-            data = reduced
-        return {date:xs for date, xs in data.items() if len(xs) > 0}
+    @timed("service.get_searched")
+    def get_searched(self, kind: str, tags: str) -> Data: 
+        """ Entries of given kind (raw, sweeps, analysis) with tags matching
+        all `;`-separated search terms (a tag matches, if it contains the
+        term). Uses the tag index, so only matching entries are visited.
+        """
+        matches = None
+        for term in [t for t in tags.split(";") if len(t) > 0]: 
+            entry_ids = self.dmanager.tag_index.search(term)
+            found = self.catalog.find(kind, entry_ids)
+            matches = found if matches is None else matches & found
+        if matches is None: 
+            return self.catalog.get(kind)
+        return {
+            date: [x for x in xs if x in matches] 
+            for date, xs in self.catalog.get(kind).items() 
+            if any(x in matches for x in xs)
+        }
 
+    @timed("service.get_single_analysis")
     def get_single_analysis(
         self, date: str, filename: str, only_favorites: bool
     ) -> List[Analysis]:
         path = os.path.join(self.dir_analysis, date, filename)
-        ensure_dir_exists(f"{path}/")
+        if not os.path.exists(path): 
+            ensure_dir_exists(f"{path}/")
+            self.catalog.rescan(ANALYSIS, date)
         favorites = self.dmanager.favorites
+        with span("manifest.load"): 
+            manifest = load_manifest(path, [f for f in os.listdir(path) if ".png" in f])
         analysis_data = [] 
-        for f in os.listdir(path): 
-            if ".png" in f and (not only_favorites or os.path.join(path, f) in favorites):
+        for f, entry in manifest.items(): 
+            if not only_favorites or os.path.join(path, f) in favorites:
                 full_path = os.path.join(path, f)
-                projects = [
-                    project_name for project_name, project in self.dmanager.projects.items() 
-                    if full_path in project.analysis
-                ]
-                analysis_data.append(Analysis(path, f, projects))
+                projects = self.dmanager.analysis_projects(full_path)
+                analysis_data.append(Analysis(path, f, projects, entry))
         # Sort by selection
         def get_selection(elem: Analysis): 
             return elem.selection
         analysis_data.sort(key=get_selection)
         return analysis_data
 
-    def upload_raw(
-        self, file: FileStorage, date: str, extract: bool, tags: str
-    ) -> Tuple[str, str]:
+    def upload_raw(self, file: FileStorage, date: str, tags: str) -> UploadStatus:
+        """ Stores one uploaded igor file (unpacked as a job, if desired) """
         if file.filename == '' or date == '':
-            return ('No file or creation-date', 'danger')
-        if file and _allowed_file(file.filename):
-            # Store file if not exists
-            filename = secure_filename(file.filename)
-            path_to_file = os.path.join(self.dir_raw, date, filename)
-            if os.path.exists(path_to_file): 
-                return ('File already exists ', 'danger')
-            # Store
-            ensure_dir_exists(path_to_file)
-            file.save(path_to_file)
-            for tag in tags.split(", "): 
-                self.add_tag_to_entry(os.path.join(date, stem(filename)), tag)
-            # If extraxting is desired, extract sweeps
-            if extract: 
-                _, _ = self.unpack_raw(date, filename)
-            return ('Upload success!', 'success')
-        else: 
-            return ('Invalid file type!', 'danger')
+            return UploadStatus(file.filename or "", 'No file or creation-date', 'danger')
+        return self.store_raw(file.stream, file.filename, date, tags)
+
+    def upload_many(
+        self, files: List[FileStorage], date: str, tags: str
+    ) -> List[UploadStatus]: 
+        """ Stores many igor files (or zip archives of igor files) of one
+        creation date. Returns the status of every (extracted) file.
+        """
+        if date == '': 
+            return [UploadStatus("", "Missing creation-date", "danger")]
+        report = []
+        for file in files: 
+            if file.filename == '': 
+                continue
+            if file.filename.lower().endswith(".zip"): 
+                report += self._store_zip(file.stream, file.filename, date, tags)
+            else: 
+                report.append(self.store_raw(file.stream, file.filename, date, tags))
+        return report
+
+    @timed("service.store_raw")
+    def store_raw(
+        self, stream: IO[bytes], filename: str, date: str, tags: str
+    ) -> UploadStatus: 
+        """ Streams an uploaded igor file into `raw/<date>/`, unless a file
+        with the same content exists already (even under another name).
+        """
+        if not _allowed_file(filename): 
+            return UploadStatus(filename, 'Invalid file type!', 'danger')
+        secure_name = secure_filename(os.path.basename(filename))
+        path_to_file = os.path.join(self.dir_raw, date, secure_name)
+        if os.path.exists(path_to_file): 
+            return UploadStatus(filename, 'File already exists ', 'danger')
+        ensure_dir_exists(path_to_file)
+        # Hash while writing (to a temporary file): one pass over the data
+        digest = hashlib.sha256()
+        try: 
+            with open(f"{path_to_file}.upload", "wb") as f: 
+                while chunk := stream.read(UPLOAD_CHUNK_SIZE): 
+                    digest.update(chunk)
+                    f.write(chunk)
+        except Exception: 
+            # F.e. the client disconnected: no partial uploads are left
+            os.remove(f"{path_to_file}.upload")
+            self._remove_empty_dir(os.path.dirname(path_to_file))
+            raise
+        duplicate = self.dmanager.raw_hashes.get(digest.hexdigest())
+        if duplicate is not None: 
+            os.remove(f"{path_to_file}.upload")
+            self._remove_empty_dir(os.path.dirname(path_to_file))
+            return UploadStatus(filename, f'Duplicate of {duplicate}', 'warning')
+        os.replace(f"{path_to_file}.upload", path_to_file)
+        raw_path = os.path.join(date, secure_name)
+        self.dmanager.add_raw_hash(digest.hexdigest(), raw_path)
+        self.catalog.rescan(RAW, date)
+        for tag in tags.split(", "): 
+            if tag != "": 
+                self.add_tag_to_entry(os.path.join(date, stem(secure_name)), tag)
+        return UploadStatus(filename, 'Upload success!', 'success', raw_path)
+
+    def unhashed_raw_files(self) -> List[str]: 
+        """ Raw files uploaded before content hashes were stored """
+        known = set(self.dmanager.raw_hashes.values())
+        unhashed = []
+        for date in os.listdir(self.dir_raw) if os.path.isdir(self.dir_raw) else []: 
+            if not os.path.isdir(os.path.join(self.dir_raw, date)): 
+                continue
+            for entry in os.scandir(os.path.join(self.dir_raw, date)): 
+                raw_path = os.path.join(date, entry.name)
+                if entry.is_file() and _allowed_file(entry.name) and raw_path not in known: 
+                    unhashed.append(raw_path)
+        return unhashed
+
+    def hash_raw_files(self, progress: Progress | None = None) -> Tuple[str, str]: 
+        """ Stores the content hash of every raw file without one, so
+        duplicates of old uploads are found too (run as a job at startup)
+        """
+        unhashed = self.unhashed_raw_files()
+        for index, raw_path in enumerate(unhashed): 
+            digest = file_hash(os.path.join(self.dir_raw, raw_path))
+            # Duplicates (uploaded before) keep the hash of the first file
+            if digest not in self.dmanager.raw_hashes: 
+                self.dmanager.add_raw_hash(digest, raw_path)
+            if progress: 
+                progress(index + 1, len(unhashed))
+        return (f"Hashed {len(unhashed)} raw files.", "success")
+
+    def _store_zip(
+        self, stream: IO[bytes], filename: str, date: str, tags: str
+    ) -> List[UploadStatus]: 
+        # Zip archives need random access: spool the upload to disk first
+        with tempfile.TemporaryFile() as tmp: 
+            shutil.copyfileobj(stream, tmp, UPLOAD_CHUNK_SIZE)
+            try: 
+                archive = zipfile.ZipFile(tmp)
+            except zipfile.BadZipFile: 
+                return [UploadStatus(filename, 'Invalid zip file!', 'danger')]
+            report = []
+            with archive: 
+                for member in archive.infolist(): 
+                    if member.is_dir(): 
+                        continue
+                    if not _allowed_file(member.filename): 
+                        report.append(UploadStatus(
+                            f"{filename}/{member.filename}", 'Skipped (no igor file)', 'info'
+                        ))
+                        continue
+                    with archive.open(member) as member_stream: 
+                        status = self.store_raw(member_stream, member.filename, date, tags)
+                    status.file = f"{filename}/{member.filename}"
+                    report.append(status)
+            return report
+
+    def _remove_empty_dir(self, directory: str) -> None: 
+        if os.path.isdir(directory) and len(os.listdir(directory)) == 0: 
+            os.rmdir(directory)
     
+    @timed("service.delete_data")
     def delete_data(
         self, base_path: str, date: str, filename: str
     ) -> Tuple[str, str]: 
@@ -147,38 +282,84 @@ class Service:
         if os.path.isdir(path_to_file): 
             shutil.rmtree(path_to_file)
         else:
+            self.derived.invalidate(path_to_file)
+            self.dmanager.remove_num_sweeps(path_to_file)
             os.remove(path_to_file)
+        self.dmanager.remove_peaks(path_to_file)
+        if os.path.abspath(base_path) == os.path.abspath(self.dir_raw): 
+            self.dmanager.remove_raw_hashes(os.path.join(date, filename))
+        # Remove sweep index of legacy json sweeps
+        if os.path.exists(index_path(path_to_file)): 
+            os.remove(index_path(path_to_file))
         # If directory is now empty, remove directory too
         directory = os.path.dirname(path_to_file)
         if len(os.listdir(directory)) == 0: 
             shutil.rmtree(directory)
+        for kind, kind_dir in self.catalog.dirs.items(): 
+            if os.path.abspath(base_path) == os.path.abspath(kind_dir): 
+                self.catalog.rescan(kind, date)
         return ('Data successfully removed.', 'success')
 
-    def unpack_raw(self, date: str, filename: str) -> Tuple[str, str]: 
+    @timed("service.unpack_raw")
+    def unpack_raw(
+        self, date: str, filename: str, progress: Progress | None = None
+    ) -> Tuple[str, str]: 
+        from extractor.ibw import VERSION
         path_to_file = os.path.join(self.dir_raw, date, filename)
-        data = extract_data(path_to_file, False) 
-        sweeps = convert_rows_to_columns(data, len(data[0]))
-        path_to_data = os.path.join(
-            self.dir_sweeps, date, f'{VERSION}_{stem(filename)}_sweeps.json'
-        )
-        ensure_dir_exists(path_to_data)
+        path_to_data = self.sweeps_path(date, f'{VERSION}_{stem(filename)}_sweeps')
         if os.path.exists(path_to_data):
             return ("Unpacked data already exists!", "danger")
-        with open(path_to_data, 'w') as f:
-            json.dump(sweeps, f)
+        self.derived.invalidate(path_to_data)
+        try: 
+            # Streams sweeps from file to file (memory bound by a few sweeps)
+            ibw_to_sweeps(path_to_file, path_to_data)
+        except UnsupportedWave as e: 
+            print(f"Streaming {path_to_file} not possible ({e}), loading it.")
+            from extractor.preprocessing import convert_rows_to_columns, extract_data
+            data = extract_data(path_to_file, False) 
+            sweeps = convert_rows_to_columns(data, len(data[0]))
+            write_sweeps(path_to_data, sweeps)
+        self.catalog.rescan(SWEEPS, date)
+        if progress: 
+            progress(1, 1)
         return ("Data successfully unpacked", "success")
 
+    def sweeps_path(self, date: str, filename: str) -> str: 
+        """ Path to sweeps-file (binary or legacy json) of given sweeps name """
+        return sweeps_file(os.path.join(self.dir_sweeps, date), filename)
+
+    def sweeps_reader(self, date: str, filename: str) -> SweepReader: 
+        return open_reader(self.sweeps_path(date, filename))
+
     def num_sweeps(self, date:str, filename: str) -> int:  
-        print("loading num sweeps:")
-        path = os.path.join(
-            self.dir_sweeps, date, f'{filename}.json'
+        path = self.sweeps_path(date, filename)
+        return self.derived.get(path, "num_sweeps", lambda: open_reader(path).num_sweeps)
+
+    def sweeps_time(self, reader: SweepReader) -> float: 
+        """ Time of a single sweep of given sweeps-file (0 without sweeps) """
+        def sweep_time(): 
+            sweeps = reader.get(0, 1)
+            return calc_time_from_sweeps(sweeps) if len(sweeps) > 0 else 0.0
+        return self.derived.get(reader.path, "time", sweep_time)
+
+    def sweeps_average(self, reader: SweepReader, start: int, end: int) -> np.ndarray: 
+        def average(): 
+            from extractor.ibw import Selection, get_range
+            values = reader.get(start, end)
+            with span("sweeps.average"): 
+                sweeps, _ = get_range(values, Selection(0, end-start, True))
+            return sweeps[0]
+        return self.derived.get(reader.path, "average", average, start=start, end=end)
+
+    def sweeps_joined(self, reader: SweepReader, start: int, end: int) -> np.ndarray: 
+        from extractor.preprocessing import join_lists
+        # Joining is cheaper than reading the joined sweeps from disk
+        return self.derived.get(
+            reader.path, "join", lambda: join_lists(reader.get(start, end)), 
+            persist=False, start=start, end=end
         )
-        if path in self.dmanager.map_num_sweeps: 
-            return self.dmanager.map_num_sweeps[path] 
-        with open(path, "r") as f: 
-            data = json.load(f)
-            return self.dmanager.add_num_sweeps(path, len(data))
 
+    @timed("service.do_analysis")
     def do_analysis(
         self, 
         date: str, 
@@ -188,96 +369,239 @@ class Service:
         end: int, 
         ylim: Tuple[float, float], 
         scalebar: Scalebar,
+        decimate: bool = True,
+        progress: Progress | None = None,
     ) -> Tuple[str, str]: 
-        path = os.path.join(
-            self.dir_sweeps, date, f'{filename}.json'
-        )
-        base_path = self._create_analysis_path(date, filename, opt, start, end)
-        # Load sweeps
-        with open(path, "r") as f: 
-            all_sweeps = json.load(f)
-        # Get sweeps in specified range 
-        if start > end or start < 0 or end > len(all_sweeps): 
-            # Potentially reload stored number of sweeps
-            if path in self.dmanager.map_num_sweeps:
-                del self.dmanager.map_num_sweeps[path] 
+        """ Analyses sweeps start..end of given sweeps-file. Long inrow and
+        average traces are decimated for plotting, unless `decimate` is False.
+        """
+        reader = self.sweeps_reader(date, filename)
+        # Validated first: an invalid range creates no (empty) analysis directory
+        num_sweeps = self.num_sweeps(date, filename)
+        if start > end or start < 0 or end > num_sweeps: 
             return (
-                f"start ({start}) or end ({end}) invalid! (num sweeps: {len(all_sweeps)}). Please try again.", 
+                f"start ({start}) or end ({end}) invalid! (num sweeps: {num_sweeps}). Please try again.", 
                 "danger"
             )
-        sweeps, time = get_range(
-            all_sweeps, Selection(start, end, opt==AnalysisOpts.AVRG)
-        )
+        base_path = self._create_analysis_path(date, filename, opt, start, end)
+        ensure_dir_exists(base_path)
+        self.catalog.rescan(ANALYSIS, date)
+        time = self.sweeps_time(reader)
         if opt == AnalysisOpts.AVRG or opt == AnalysisOpts.INROW:
-            plot_data(
+            # Average or concatenation of selected sweeps (cached per range)
+            if opt == AnalysisOpts.AVRG: 
+                values = self.sweeps_average(reader, start, end)
+                sweeps = [values.tolist()]
+            else: 
+                values = self.sweeps_joined(reader, start, end)
+                # Sweeps of a file have the same length: the sweep-selection
+                # is the cached join split into sweeps (not read again)
+                sweeps = values.reshape(end - start, -1).tolist() if end > start else []
+            # Store sweep-selection
+            with open(f"{base_path}.json", "w") as f: 
+                json.dump(sweeps, f)
+            plot_png(
                 base_path, 
-                join_lists(sweeps), 
+                values.tolist(), 
                 len(sweeps)*time, 
+                sources=[f"{base_path}.json"],
+                select="join",
+                decimate=decimate,
                 ylim=ylim,
                 scalebar=scalebar
             )
-            # Store sweep-selection
-            with open(f"{base_path}.json", "w") as f: 
-                json.dump(sweeps, f)
         elif opt == AnalysisOpts.ALL: 
-            for index, sweep in enumerate(sweeps):
-                sweep_path = base_path.replace("XX", str(index).zfill(2))
-                plot_data(sweep_path, sweep, time, ylim=ylim, scalebar=scalebar)
-                # Store sweep-selection
-                with open(f"{sweep_path}.json", "w") as f: 
-                    json.dump([sweep], f)
+            sweeps = reader.get(start, end)
+            sweep_paths = [
+                base_path.replace("XX", str(index).zfill(2)) 
+                for index in range(len(sweeps))
+            ]
+            self._plot_sweeps(sweep_paths, sweeps, time, ylim, scalebar, progress)
         elif opt == AnalysisOpts.STACKED: 
-            plot_data(base_path, sweeps, time, ylim=ylim, scalebar=scalebar)
+            sweeps = reader.get(start, end)
             # Store sweep-selection
             with open(f"{base_path}.json", "w") as f: 
                 json.dump(sweeps, f)
+            plot_png(
+                base_path, 
+                sweeps, 
+                time, 
+                sources=[f"{base_path}.json"],
+                select="all",
+                ylim=ylim, 
+                scalebar=scalebar
+            )
+        if opt == AnalysisOpts.ALL: 
+            plots = [f"{os.path.basename(p)}.png" for p in sweep_paths]
+        else: 
+            plots = [f"{os.path.basename(base_path)}.png"]
+        update_manifest(os.path.dirname(base_path), plots)
         return ("Successfully analysed data!", "success")
 
-    def calc_peaks(self, path: str, peaks_info: Peaks) -> Dict[int, Dict]: 
+    def peaks_path(self, path: str, peaks_info: Peaks) -> Tuple[str, str, str]: 
+        """ Sweep-selection of given analysis plot, key of its peaks for the
+        given parameters and the directory they are stored in.
+        """
         base_path = path.replace(".svg" if "svg" in path else ".png", ".json")
+        key = peaks_key(base_path, peaks_info)
+        plugin_path = os.path.join(f"{stem(base_path)}_plug", f"peaks-{key}")
+        return base_path, key, plugin_path
+
+    def cached_peaks(self, path: str, peaks_info: Peaks) -> Dict[str, List] | None: 
+        """ Peaks calculated before for the same sweep-selection and
+        parameters (indexed in `DManager.peaks`), or None
+        """
+        base_path, key, plugin_path = self.peaks_path(path, peaks_info)
+        if not os.path.exists(os.path.join(plugin_path, PEAKS_PARAMS)): 
+            return None
+        if key not in self.dmanager.peaks: 
+            self.dmanager.add_peaks(key, plugin_path, base_path, asdict(peaks_info))
+        with open(os.path.join(plugin_path, "data.json"), "r") as f: 
+            return json.load(f)
+
+    @timed("service.calc_peaks")
+    def calc_peaks(
+        self, path: str, peaks_info: Peaks, progress: Progress | None = None
+    ) -> Dict[int, Dict]: 
+        cached = self.cached_peaks(path, peaks_info)
+        if cached is not None: 
+            return cached
+        from extractor.ibw import peaks
+        base_path, peaks_id, plugin_path = self.peaks_path(path, peaks_info)
         with open(base_path, "r") as f: 
-            sweeps = json.load(f)
-            peak_data, time = peaks(sweeps, peaks_info)
-            plugin_path = os.path.join(f"{stem(base_path)}_plug", "peaks/")
-            ensure_dir_exists(plugin_path)
+            with span("sweeps.load"): 
+                sweeps = json.load(f)
+            with span("peaks"): 
+                peak_data, time = peaks(sweeps, peaks_info)
+            ensure_dir_exists(f"{plugin_path}/")
             reduced = {} 
             for key, value in peak_data.items(): 
                 reduced[key] = value["df"]
                 sweep_path = os.path.join(plugin_path, key)
-                plot_data(
+                plot_png(
                     sweep_path, 
                     sweeps[int(key)], 
                     time,
+                    sources=[base_path],
+                    select=int(key),
                     min_peaks=value["min"],
                     max_peaks=value["max"]
                 )
+                if progress: 
+                    progress(len(reduced), len(peak_data))
             # Save plot and data 
             with open(os.path.join(plugin_path, "data.json"), "w") as f: 
                 json.dump(reduced, f)
+            # Written last: marks the peaks as complete
+            with open(os.path.join(plugin_path, PEAKS_PARAMS), "w") as f: 
+                json.dump(asdict(peaks_info), f)
+            self.dmanager.add_peaks(peaks_id, plugin_path, base_path, asdict(peaks_info))
+            update_manifest(
+                os.path.dirname(base_path), [f"{os.path.basename(stem(base_path))}.png"]
+            )
             return reduced
 
+    @timed("service.batch_peaks")
+    def batch_peaks(
+        self, sources: List[str], peaks_info: Peaks, directory: str
+    ) -> Tuple[str, str]: 
+        """ Applies the same peaks windows to all sweeps of the given
+        sweep-selections at once. The combined result is stored as
+        `data.json` and `data.csv` in `directory` (in `data/peaks/`).
+        """
+        if len(sources) == 0: 
+            return ("No analysis to calculate peaks for!", "danger")
+        try: 
+            batch = peakbatch.batch_peaks(sources, peaks_info)
+        except ValueError as e: 
+            return (str(e), "danger")
+        ensure_dir_exists(f"{directory}/")
+        json_path, _ = peakbatch.store_batch(directory, batch)
+        return (
+            f"Calculated peaks of {len(batch['sweeps'])} sweeps: {json_path}", 
+            "success"
+        )
+
+    def project_peaks(self, project_name: str, peaks_info: Peaks) -> Tuple[str, str]: 
+        if project_name not in self.dmanager.projects: 
+            return f"Project >>{project_name}<< not found!", "danger"
+        project = self.dmanager.projects[project_name]
+        sources = [analysis.replace('.png', '.json') for analysis in project.analysis]
+        directory = os.path.join(self.dir_peaks, "project", project_name)
+        return self.batch_peaks(sources, peaks_info, directory)
+
+    def date_peaks(self, date: str, peaks_info: Peaks) -> Tuple[str, str]: 
+        """ Peaks of all analysis (sweep-selections) of a date """
+        date_path = os.path.join(self.dir_analysis, date)
+        if not os.path.isdir(date_path): 
+            return (f"No analysis for {date}!", "danger")
+        sources = []
+        for entry in sorted(os.scandir(date_path), key=lambda x: x.name): 
+            if entry.is_dir(): 
+                sources += sorted(
+                    os.path.join(entry.path, f.replace(".png", ".json")) 
+                    for f in os.listdir(entry.path) if f.endswith(".png")
+                )
+        directory = os.path.join(self.dir_peaks, "date", date)
+        return self.batch_peaks(sources, peaks_info, directory)
+
+    @timed("service.project_stack_analysis")
     def project_stack_analysis(
         self, project_name: str, ylim: Tuple[float, float]
     ) -> Tuple[str, str]: 
         if project_name not in self.dmanager.projects: 
             return f"Project >>{project_name}<< not found!", "danger"
         project = self.dmanager.projects[project_name]
-        sweeps = []
-        time = 0
-        for analysis in project.analysis: 
-             with open(f"{analysis.replace('.png', '.json')}", "r") as f: 
-                d = json.load(f)
-                time = calc_time_from_sweeps(d)
-                if len(d) > 1: 
-                    return (
-                        f"Merging not possible with more than one sweep. But atleast one analysis has {len(d)} sweeps!", 
-                        "danger"
-                    )
-                sweeps.append(d[0])
+        try: 
+            # Only adds analysis missing in the matrix (f.e. older projects)
+            with self.dmanager.store.locked(): 
+                project.stacked.sync(project.analysis)
+        except OSError as e: 
+            return f"Stacking failed: {e}", "danger"
+        not_stackable = project.stacked.not_stackable()
+        if not_stackable: 
+            analysis, num_sweeps = next(iter(not_stackable.items()))
+            return (
+                f"Merging not possible with more than one sweep. But {len(not_stackable)} "
+                f"analysis have more (f.e. {os.path.basename(analysis)}: {num_sweeps} sweeps)!", 
+                "danger"
+            )
+        sweeps, analysis, time = project.stacked.sweeps()
+        sources = [a.replace('.png', '.json') for a in analysis]
         path = os.path.join(self.dmanager.dir_projects, project_name, "stacked")
-        plot_data(path, sweeps, time, ylim=ylim)
+        plot_png(path, sweeps, time, sources=sources, select="all", ylim=ylim)
         return "Successfully stacked projects analysis", "success"
 
+    def _plot_sweeps(
+        self, 
+        paths: List[str], 
+        sweeps: List[List[float]], 
+        time: float, 
+        ylim: Tuple[float, float], 
+        scalebar: Scalebar, 
+        progress: Progress | None
+    ) -> None: 
+        """ Plots every sweep to its own path. With more than one plot worker,
+        sweeps are plotted in a process pool (every process has its own
+        pyplot state, so plots can not interfere).
+        """
+        if self.plot_workers <= 1 or len(sweeps) <= 1: 
+            for index, (path, sweep) in enumerate(zip(paths, sweeps)): 
+                _plot_sweep(path, sweep, time, ylim, scalebar)
+                if progress: 
+                    progress(index+1, len(sweeps))
+            return
+        workers = min(self.plot_workers, len(sweeps))
+        with ProcessPoolExecutor(max_workers=workers) as executor: 
+            futures = [
+                executor.submit(_plot_sweep, path, sweep, time, ylim, scalebar) 
+                for path, sweep in zip(paths, sweeps)
+            ]
+            for index, future in enumerate(as_completed(futures)): 
+                future.result()
+                if progress: 
+                    progress(index+1, len(sweeps))
+
     def _create_analysis_path(
         self, date: str, filename: str, opt: AnalysisOpts, start: int, end: int
     ) -> str: 
@@ -292,16 +616,40 @@ class Service:
         return os.path.join(self.dir_analysis, date, filename, name)
 
 
+def _plot_sweep(
+    path: str, sweep: List[float], time: float, ylim: Tuple[float, float], scalebar: Scalebar
+) -> None: 
+    # Store sweep-selection
+    with open(f"{path}.json", "w") as f: 
+        json.dump([sweep], f)
+    plot_png(
+        path, 
+        sweep, 
+        time, 
+        sources=[f"{path}.json"], 
+        select=0, 
+        ylim=ylim, 
+        scalebar=scalebar
+    )
+
+def peaks_key(source: str, peaks_info: Peaks) -> str: 
+    """ Content key of peaks: hash of the sweep-selection and parameters """
+    digest = hashlib.sha256()
+    with open(source, "rb") as f: 
+        for chunk in iter(lambda: f.read(1 << 20), b""): 
+            digest.update(chunk)
+    digest.update(json.dumps(asdict(peaks_info), sort_keys=True).encode())
+    return digest.hexdigest()[:16]
+
+
+def file_hash(path: str) -> str: 
+    digest = hashlib.sha256()
+    with open(path, "rb") as f: 
+        while chunk := f.read(UPLOAD_CHUNK_SIZE): 
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 def _allowed_file(filename):
-    print(filename, filename.rsplit('.', 1)[1].lower())
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
-def _get_key_num(name: str) -> str: 
-    try:
-        re_str = r"\S(\d\d?)\S*"
-        m = re.search(re_str, name) 
-        return m.group(1).rjust(3, "0")
-    except Exception as err: 
-        print("Failed to get num from {name}: {repr(err)}")
-        return name
@@ -13,3 +13,39 @@ function ToggleScaleBarOptions() {
     document.getElementById("for_scale_x_size").style.display="block";
   }
 }
+
+// Plugin data (tables) of an analysis is only loaded, when its modal is opened
+function LoadPluginData(modal) {
+  modal.querySelectorAll("table.plugin-data:not(.loaded)").forEach(table => {
+    table.classList.add("loaded");
+    fetch(table.dataset.src)
+      .then(response => response.json())
+      .then(data => {
+        (data[table.dataset.sweep] || []).forEach((row, index) => {
+          const tr = table.insertRow();
+          row.forEach(value => {
+            const cell = document.createElement(index === 0 ? "th" : "td");
+            cell.textContent = value;
+            tr.appendChild(cell);
+          });
+        });
+      })
+      .catch(error => {
+        table.classList.remove("loaded");
+        console.log(error);
+      });
+  });
+}
+
+// Modals show full size images: only loaded, when the modal is opened
+function LoadImages(modal) {
+  modal.querySelectorAll("img[data-src]").forEach(img => {
+    img.src = img.dataset.src;
+    img.removeAttribute("data-src");
+  });
+}
+
+document.addEventListener("show.bs.modal", event => {
+  LoadImages(event.target);
+  LoadPluginData(event.target);
+});
@@ -0,0 +1,40 @@
+function PollJob(jobId) {
+  fetch("/api/jobs/" + jobId)
+    .then(response => response.json())
+    .then(job => {
+      // Reloading shows the result of the finished job
+      if (job.finished) {
+        window.location.reload();
+        return;
+      }
+      const progress = document.getElementById("job_progress");
+      if (job.total > 0) {
+        progress.style.width = Math.round(100 * job.progress / job.total) + "%";
+        progress.innerHTML = job.progress + "/" + job.total;
+      }
+      else {
+        progress.innerHTML = (job.state === "running") ? "Running..." : "Waiting for job...";
+      }
+      setTimeout(() => PollJob(jobId), 1000);
+    })
+    .catch(error => alert(error));
+}
+
+// Shows the state of a job in a (report) table cell until it is finished
+function PollReportJob(cell) {
+  fetch("/api/jobs/" + cell.dataset.reportJob)
+    .then(response => response.json())
+    .then(job => {
+      cell.innerHTML = (job.finished) ? job.msg : job.state;
+      if (!job.finished)
+        setTimeout(() => PollReportJob(cell), 1000);
+    })
+    .catch(error => cell.innerHTML = error);
+}
+
+document.addEventListener("DOMContentLoaded", () => {
+  const status = document.getElementById("job_status");
+  if (status)
+    PollJob(status.dataset.job);
+  document.querySelectorAll("[data-report-job]").forEach(PollReportJob);
+});
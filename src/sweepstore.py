@@ -0,0 +1,338 @@
+import json
+import os
+import struct
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+
+from metrics import timed
+from utils import ensure_dir_exists, stem
+
+# On-disk layout of a binary sweeps file:
+#   [64 byte header][sweep 0][sweep 1]...[sweep n-1]
+# Every sweep is stored as one contiguous block of `num_samples` values, so a
+# range of sweeps is a single contiguous slice of the file.
+MAGIC = b"ANASWEEP"
+FORMAT_VERSION = 1
+HEADER_SIZE = 64
+_HEADER = struct.Struct("<8sHHQQd")
+
+SWEEPS_EXT = ".bin"
+LEGACY_EXT = ".json"
+INDEX_EXT = ".idx"
+_INDEX_CHUNK_SIZE = 1 << 24
+
+_DTYPES = {1: np.dtype("<f4"), 2: np.dtype("<f8")}
+_DTYPE_CODES = {dtype: code for code, dtype in _DTYPES.items()}
+
+
+@dataclass
+class SweepsHeader:
+    num_sweeps: int
+    num_samples: int
+    interval: float
+    dtype: np.dtype
+
+
+def write_sweeps(
+    path: str, sweeps, interval: float = float("nan"), dtype=np.float64
+) -> SweepsHeader:
+    """ Writes sweeps (list of sweeps or 2d array: sweeps x samples) to a
+    binary sweeps file at `path`.
+    """
+    data = np.ascontiguousarray(sweeps, dtype=np.dtype(dtype).newbyteorder("<"))
+    if data.ndim == 1:
+        data = data.reshape(1, -1)
+    header = SweepsHeader(data.shape[0], data.shape[1], interval, data.dtype)
+    ensure_dir_exists(path)
+    with open(path, "wb") as f:
+        f.write(_pack_header(header))
+        data.tofile(f)
+    return header
+
+
+class SweepWriter:
+    """ Writes a binary sweeps file sweep by sweep (or in blocks of sweeps),
+    so sweeps never have to be in memory at once. The file is written to
+    `<path>.tmp` and moved to `path` on `close` (only if no error occurred):
+
+        with SweepWriter(path, num_samples) as writer:
+            writer.write(sweep)
+    """
+    def __init__(
+        self, path: str, num_samples: int, interval: float = float("nan"), dtype=np.float64
+    ) -> None:
+        self.path = path
+        self.header = SweepsHeader(
+            0, num_samples, interval, np.dtype(dtype).newbyteorder("<")
+        )
+        ensure_dir_exists(path)
+        self.file = open(f"{path}.tmp", "wb")
+        self.file.write(_pack_header(self.header))
+
+    def write(self, sweeps) -> None:
+        """ Appends one sweep or a 2d block (sweeps x samples) of sweeps """
+        data = np.ascontiguousarray(sweeps, dtype=self.header.dtype)
+        if data.ndim == 1:
+            data = data.reshape(1, -1)
+        if data.shape[1] != self.header.num_samples:
+            raise ValueError(
+                f"Sweeps of {data.shape[1]} samples written to file of "
+                f"{self.header.num_samples} samples per sweep"
+            )
+        data.tofile(self.file)
+        self.header.num_sweeps += data.shape[0]
+
+    def close(self) -> SweepsHeader:
+        self.file.seek(0)
+        self.file.write(_pack_header(self.header))
+        self.file.close()
+        os.replace(f"{self.path}.tmp", self.path)
+        return self.header
+
+    def abort(self) -> None:
+        self.file.close()
+        os.remove(f"{self.path}.tmp")
+
+    def __enter__(self) -> "SweepWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def append_sweeps(path: str, sweeps) -> SweepsHeader:
+    """ Appends sweeps (of the file's number of samples) to an existing
+    binary sweeps file in place. The header is updated after the data, so an
+    interrupted append leaves the file's previous sweeps intact.
+    """
+    with open(path, "r+b") as f:
+        header = _unpack_header(f.read(HEADER_SIZE), path)
+        data = np.ascontiguousarray(sweeps, dtype=header.dtype)
+        if data.ndim == 1:
+            data = data.reshape(1, -1)
+        if data.shape[1] != header.num_samples:
+            raise ValueError(
+                f"Sweeps of {data.shape[1]} samples appended to file of "
+                f"{header.num_samples} samples per sweep"
+            )
+        f.seek(HEADER_SIZE + header.num_sweeps*header.num_samples*header.dtype.itemsize)
+        data.tofile(f)
+        f.truncate()
+        f.flush()
+        header.num_sweeps += data.shape[0]
+        f.seek(0)
+        f.write(_pack_header(header))
+    return header
+
+
+def read_header(path: str) -> SweepsHeader:
+    with open(path, "rb") as f:
+        return _unpack_header(f.read(HEADER_SIZE), path)
+
+
+def open_sweeps(path: str) -> np.memmap:
+    """ Memory-maps a binary sweeps file as (read only) 2d array of shape
+    (num_sweeps, num_samples). Nothing is read until a sweep is accessed.
+    """
+    header = read_header(path)
+    return np.memmap(
+        path,
+        dtype=header.dtype,
+        mode="r",
+        offset=HEADER_SIZE,
+        shape=(header.num_sweeps, header.num_samples)
+    )
+
+
+def load_sweeps(path: str) -> List[List[float]]:
+    """ Loads all sweeps of a sweeps file (binary or legacy json) as lists. """
+    if path.endswith(SWEEPS_EXT):
+        return open_sweeps(path).tolist()
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+class SweepReader(ABC):
+    """ Reads ranges of sweeps from a sweeps file without loading the sweeps
+    outside of the requested range.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    @property
+    @abstractmethod
+    def num_sweeps(self) -> int:
+        """ Number of sweeps in the file """
+
+    @abstractmethod
+    def get(self, start: int, end: int) -> List[List[float]]:
+        """ Returns sweeps start..end (end exclusive) """
+
+
+class BinarySweepReader(SweepReader):
+    def __init__(self, path: str) -> None:
+        super().__init__(path)
+        self.header = read_header(path)
+
+    @property
+    def num_sweeps(self) -> int:
+        return self.header.num_sweeps
+
+    @timed("sweeps.read")
+    def get(self, start: int, end: int) -> List[List[float]]:
+        return open_sweeps(self.path)[start:end].tolist()
+
+
+class JsonSweepReader(SweepReader):
+    """ Reader for legacy json sweeps. The byte offsets of all sweeps are
+    stored in an index next to the sweeps file (`<file>.json.idx`), which is
+    (re-)built on first access.
+    """
+    def __init__(self, path: str) -> None:
+        super().__init__(path)
+        self.offsets = _load_or_build_index(path)
+
+    @property
+    def num_sweeps(self) -> int:
+        return len(self.offsets)
+
+    @timed("sweeps.read")
+    def get(self, start: int, end: int) -> List[List[float]]:
+        offsets = self.offsets[start:end]
+        if len(offsets) == 0:
+            return []
+        with open(self.path, "rb") as f:
+            f.seek(offsets[0][0])
+            # Sweeps are separated only by commas (and whitespace), so the
+            # slice from first to last sweep is a valid json list body
+            return json.loads(b"[" + f.read(offsets[-1][1] - offsets[0][0]) + b"]")
+
+
+def open_reader(path: str) -> SweepReader:
+    if path.endswith(SWEEPS_EXT):
+        return BinarySweepReader(path)
+    return JsonSweepReader(path)
+
+
+def index_path(path: str) -> str:
+    return f"{path}{INDEX_EXT}"
+
+
+def sweeps_file(directory: str, name: str) -> str:
+    """ Returns the path of sweeps-file `name` (without extension) in
+    `directory`. Prefers the binary format, falls back to legacy json.
+    """
+    path = os.path.join(directory, f"{name}{SWEEPS_EXT}")
+    legacy_path = os.path.join(directory, f"{name}{LEGACY_EXT}")
+    if not os.path.exists(path) and os.path.exists(legacy_path):
+        return legacy_path
+    return path
+
+
+def is_sweeps_file(filename: str) -> bool:
+    return os.path.splitext(filename)[1] in (SWEEPS_EXT, LEGACY_EXT)
+
+
+def migrate_json(path: str, remove: bool = False) -> str | None:
+    """ Converts a legacy `*_sweeps.json` file to the binary format (with
+    `remove` the json file and its index are removed). Returns path of the new
+    file or None, if binary data already exists.
+    """
+    new_path = f"{stem(path)}{SWEEPS_EXT}"
+    if os.path.exists(new_path):
+        return None
+    with open(path, "r") as f:
+        sweeps = json.load(f)
+    # Write to temporary file first, so an interrupted migration does not
+    # leave a truncated sweeps file behind.
+    write_sweeps(f"{new_path}.tmp", sweeps)
+    os.replace(f"{new_path}.tmp", new_path)
+    if remove:
+        os.remove(path)
+        # The sweep index (see `JsonSweepReader`) is of no use without its file
+        if os.path.exists(index_path(path)):
+            os.remove(index_path(path))
+    return new_path
+
+
+def migrate_tree(dir_sweeps: str, remove: bool = False) -> List[str]:
+    """ Migrates all legacy json sweeps-files in `data/sweeps/<date>/`. """
+    migrated = []
+    for dirpath, _, filenames in os.walk(dir_sweeps):
+        for filename in sorted(filenames):
+            if not filename.endswith(f"_sweeps{LEGACY_EXT}"):
+                continue
+            new_path = migrate_json(os.path.join(dirpath, filename), remove)
+            if new_path is not None:
+                migrated.append(new_path)
+    return migrated
+
+
+def _load_or_build_index(path: str) -> List[List[int]]:
+    stat = os.stat(path)
+    try:
+        with open(index_path(path), "r") as f:
+            index = json.load(f)
+        if index["size"] == stat.st_size and index["mtime"] == stat.st_mtime:
+            return index["offsets"]
+    except (OSError, ValueError, KeyError):
+        pass
+    offsets = _index_json_sweeps(path)
+    with open(index_path(path), "w") as f:
+        json.dump({"size": stat.st_size, "mtime": stat.st_mtime, "offsets": offsets}, f)
+    return offsets
+
+
+def _index_json_sweeps(path: str) -> List[List[int]]:
+    """ Finds [start, end) byte offsets of every sweep in a json list of
+    lists. Numbers never contain brackets, so it suffices to track the
+    nesting depth of `[`/`]`, which is done chunk-wise with numpy.
+    """
+    starts, ends = [], []
+    depth = 0
+    pos = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(_INDEX_CHUNK_SIZE):
+            data = np.frombuffer(chunk, dtype=np.uint8)
+            brackets = np.flatnonzero((data == ord("[")) | (data == ord("]")))
+            steps = np.where(data[brackets] == ord("["), 1, -1)
+            depths = depth + np.cumsum(steps)
+            # A sweep starts where an opening bracket enters depth 2 and ends
+            # where a closing bracket leaves it
+            starts.extend((brackets[(steps == 1) & (depths == 2)] + pos).tolist())
+            ends.extend((brackets[(steps == -1) & (depths == 1)] + pos + 1).tolist())
+            if len(depths) > 0:
+                depth = int(depths[-1])
+            pos += len(chunk)
+    return [[s, e] for s, e in zip(starts, ends)]
+
+
+def _pack_header(header: SweepsHeader) -> bytes:
+    packed = _HEADER.pack(
+        MAGIC,
+        FORMAT_VERSION,
+        _DTYPE_CODES[header.dtype],
+        header.num_sweeps,
+        header.num_samples,
+        header.interval,
+    )
+    return packed.ljust(HEADER_SIZE, b"\0")
+
+
+def _unpack_header(data: bytes, path: str) -> SweepsHeader:
+    if len(data) < _HEADER.size:
+        raise ValueError(f"Invalid sweeps file {path}: header too short")
+    magic, version, dtype_code, num_sweeps, num_samples, interval = _HEADER.unpack(
+        data[:_HEADER.size]
+    )
+    if magic != MAGIC:
+        raise ValueError(f"Invalid sweeps file {path}: wrong magic number")
+    if version != FORMAT_VERSION or dtype_code not in _DTYPES:
+        raise ValueError(f"Unsupported sweeps file {path} (version: {version})")
+    return SweepsHeader(num_sweeps, num_samples, interval, _DTYPES[dtype_code])
@@ -1,6 +1,18 @@
 import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import matplotlib
 import numpy as np
 from typing import Dict, List, Tuple
+
+# Headless mode (`python3 run.py --headless` or `MINIMAL_HEADLESS=1`): plots
+# are only stored, never shown, so many figures can be rendered by a script
+HEADLESS = "--headless" in sys.argv or os.environ.get("MINIMAL_HEADLESS") == "1"
+if HEADLESS: 
+    matplotlib.use("Agg")
+
 from matplotlib import colors as mcolors
 from matplotlib import pyplot as plt
 
@@ -64,29 +76,47 @@ def build_stacked(names: List[str]) -> List[List[float]]:
         time = calc_time_from_sweeps(sweeps)
         plot_data("stacked-sweep00-sweep13", sweeps, time) 
     """
-    sweeps = []
-    for name in names: 
-        data, _ = load_analysis(FILES[name]) 
-        sweeps.append(data[0])
-    return sweeps
+    paths = [FILES[name] for name in names]
+    # Only memory-mapped .npy files are loaded in parallel (numpy releases the
+    # GIL while pages are read), json.load holds it: threads would not help
+    npy_paths = [path for path in paths if path.endswith(".npy")]
+    with ThreadPoolExecutor(max_workers=min(len(npy_paths), 8) or 1) as pool: 
+        loaded = dict(zip(npy_paths, pool.map(load_analysis, npy_paths)))
+    return [
+        (loaded[path] if path in loaded else load_analysis(path))[0][0] 
+        for path in paths
+    ]
 
 def load_analysis(path: str) -> Tuple[List[List[float]], float]:
-    """ Loads single analysis """
-    with open(path, "r") as f: 
-        sweeps = json.load(f) # Load data from json
-        time = calc_time_from_sweeps(sweeps) # Calculate time
-        return sweeps, time
+    """ Loads single analysis (exported as json or as numpy array) """
+    if path.endswith(".npy"): 
+        # Memory mapped (sweeps x samples): sweeps are only read when used.
+        # Shorter sweeps are padded with nan.
+        sweeps = [_without_padding(sweep) for sweep in np.load(path, mmap_mode="r")]
+    else: 
+        with open(path, "r") as f: 
+            sweeps = json.load(f) # Load data from json
+    time = calc_time_from_sweeps(sweeps) # Calculate time
+    return sweeps, time
+
+def _without_padding(sweep: np.ndarray) -> np.ndarray: 
+    """ Sweep without trailing nan (padding of shorter sweeps) """
+    if len(sweep) == 0 or not np.isnan(sweep[-1]): 
+        return sweep
+    valid = np.flatnonzero(~np.isnan(sweep))
+    return sweep[:valid[-1]+1] if len(valid) > 0 else sweep[:0]
 
 
 #### PLOT DATA ####
 
 def plot_data(
-    path, values, total_time, ylim=None, min_peaks=None, max_peaks=None, df=None
+    path, values, total_time, ylim=None, min_peaks=None, max_peaks=None, df=None,
+    show=not HEADLESS
 ):  
     """ Plots given data. 
 
     plot_data stores a .png at "{path}.png" and a .svg ag "{path}.svg"
-    NOTE: To show plots, uncomment line 46 in extractor.plotting
+    The plot is shown, unless `show` is False (default in headless mode).
     """
     num_values = len(values) if isinstance(values[0], float) else len(values[0])
     print("Plotting now: ", num_values, total_time)
@@ -123,24 +153,29 @@ def plot_data(
     # Store df (peaks)
     if df is not None:
         df.to_csv(f"{path}.csv")
-    plt.show()
+    if show: 
+        plt.show()
     plt.cla()
     plt.clf()
 
-def _color_names(num_plots: int) -> List[str]: 
-    def sorted_colors() -> List[str]: 
-        return sorted(
-            mcolors.CSS4_COLORS, 
-            key=lambda c: tuple(mcolors.rgb_to_hsv(mcolors.to_rgb(c)))
-        )
+@lru_cache(maxsize=None)
+def _sorted_colors() -> Tuple[str, ...]: 
+    return tuple(sorted(
+        mcolors.CSS4_COLORS, 
+        key=lambda c: tuple(mcolors.rgb_to_hsv(mcolors.to_rgb(c)))
+    ))
+
+@lru_cache(maxsize=None)
+def _color_names(num_plots: int) -> Tuple[str, ...]: 
+    """ Palette for `num_plots` lines (computed once per number of lines) """
     if num_plots <= 6:
-        return list(mcolors.BASE_COLORS)
+        return tuple(mcolors.BASE_COLORS)
     elif num_plots <= 10: 
-        return list(mcolors.TABLEAU_COLORS)
+        return tuple(mcolors.TABLEAU_COLORS)
     elif num_plots <= 25: 
-        return sorted_colors()[4::5] 
+        return _sorted_colors()[4::5]
     else:
-        return sorted_colors()[2::3] 
+        return _sorted_colors()[2::3]
  
 if __name__ == "__main__": 
     run()
@@ -0,0 +1,39 @@
+import os
+
+from metrics import span
+
+# Thumbnails are stored next to the plots: `<dir>/.thumbs/<plot>.png`
+THUMBS_DIR = ".thumbs"
+THUMB_WIDTH = 320
+# Plots have few colors: a palette keeps thumbnails small
+THUMB_COLORS = 64
+
+
+def thumbnail_path(path: str) -> str:
+    directory, filename = os.path.split(path)
+    return os.path.join(directory, THUMBS_DIR, filename)
+
+
+def thumbnail(path: str, width: int = THUMB_WIDTH) -> str | None:
+    """ Returns path of the thumbnail of png `path`, (re-)created if missing
+    or older than the png. None, if there is no such png.
+    """
+    thumb = thumbnail_path(path)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if os.path.exists(thumb) and os.stat(thumb).st_mtime_ns >= mtime:
+        return thumb
+    from PIL import Image
+    os.makedirs(os.path.dirname(thumb), exist_ok=True)
+    with Image.open(path) as image, span("thumbnail"):
+        # Only shrinks: height follows the aspect ratio
+        image.thumbnail((width, image.height))
+        small = image.convert("RGB").quantize(THUMB_COLORS)
+        # Written to temporary file and renamed: served by concurrent requests
+        tmp = f"{thumb}.{os.getpid()}.tmp"
+        small.save(tmp, format="PNG", optimize=True)
+    os.replace(tmp, thumb)
+    return thumb
+
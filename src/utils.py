@@ -5,7 +5,8 @@ def ensure_dir_exists(path: str) -> None:
     directory = os.path.dirname(path)
     if not os.path.exists(directory): 
         print("Creating dirs: ", path, directory)
-        os.makedirs(directory) 
+        # exist_ok: directory may be created concurrently (f.e. by job workers)
+        os.makedirs(directory, exist_ok=True) 
 
 def stem(path: str) -> str:
     """ Gets path without extension (f.e. "path/to/dir" from "path/to/dir.txt")